@@ -0,0 +1,372 @@
+# aoi.py
+"""
+Configuración multi-área (AOI) y caché compartida de áreas cargadas.
+
+aois.toml (o .yaml/.yml si PyYAML está instalado) declara, por área, el land
+cover, el directorio de máscaras de pérdida y la paleta. Un área se carga al
+seleccionarla por primera vez (catálogo + land cover; los frames se cargan
+bajo demanda) y queda en AOICache, que mantiene las áreas usadas más
+recientemente dentro de un presupuesto de memoria y desaloja el resto (LRU).
+"""
+import hashlib
+import os
+import threading
+import tomllib
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+import artifact_cache
+import catalog
+import cube
+import derived
+import export
+import history
+import hotspots
+import pipeline
+import rasters
+import sat
+import shared_store
+import stats
+from encoders import Encoded
+from rasters import DEFAULT_PALETTE, LANDCOVER_CLASSES, MASK_COLOR, MAX_PIXELS, Palette, _hex_to_rgb
+
+AOI_CONFIG = os.environ.get("DARIEN_AOI_CONFIG", "aois.toml")
+AOI_CACHE_MAX_BYTES = int(float(os.environ.get("DARIEN_AOI_CACHE_MB", "1024")) * 2**20)
+
+NAMED_LANDCOVER = {"copernicus": tuple(LANDCOVER_CLASSES)}
+
+
+@dataclass(frozen=True)
+class AOI:
+    key: str
+    title: str
+    loss_dir: str
+    landcover: str = None
+    palette: Palette = DEFAULT_PALETTE
+
+
+DEFAULT_AOIS = {"darien": AOI("darien", "Darién", "mask_loss", "landcover_darien.tif")}
+
+
+# ================== CONFIG ==================
+def _parse_color(value) -> tuple:
+    """"#rrggbb", "#rrggbbaa" o [r, g, b(, a)] → (r, g, b, a)."""
+    if isinstance(value, str):
+        h = value.strip().lstrip("#")
+        rgb = _hex_to_rgb(h[:6])
+        return (*rgb, int(h[6:8], 16) if len(h) == 8 else 255)
+    rgba = tuple(int(v) for v in value)
+    return rgba if len(rgba) == 4 else (*rgba, 255)
+
+
+def _parse_palette(spec: dict) -> Palette:
+    spec = spec or {}
+    mask_color = _parse_color(spec["mask_color"]) if "mask_color" in spec else MASK_COLOR
+    lc = spec.get("landcover", "copernicus")
+    if isinstance(lc, str):
+        if lc not in NAMED_LANDCOVER:
+            raise ValueError(f"Paleta de land cover desconocida: {lc}")
+        classes = NAMED_LANDCOVER[lc]
+    else:
+        classes = tuple((int(code), str(color), str(label)) for code, color, label in lc)
+    return Palette(mask_color, classes)
+
+
+def _read(path: str) -> dict:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError as exc:
+            raise ImportError("Para configurar AOIs en YAML instala PyYAML (pip install pyyaml)") from exc
+        with open(path, encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def load_config(path: str = AOI_CONFIG):
+    """
+    ({clave: AOI}, clave por defecto). Sin fichero de configuración se usa el
+    área única de siempre (Darién). Las rutas son relativas al fichero.
+    """
+    if not os.path.exists(path):
+        return DEFAULT_AOIS, "darien"
+    raw = _read(path)
+    base = os.path.dirname(path)
+
+    def resolve(p):
+        return p if (p is None or os.path.isabs(p)) else os.path.normpath(os.path.join(base, p))
+
+    aois = {}
+    for key, spec in (raw.get("aoi") or {}).items():
+        aois[key] = AOI(
+            key=key,
+            title=spec.get("title", key),
+            loss_dir=resolve(spec.get("loss_dir", "mask_loss")),
+            landcover=resolve(spec.get("landcover")),
+            palette=_parse_palette(spec.get("palette")),
+        )
+    if not aois:
+        raise ValueError(f"{path} no define ninguna [aoi.<clave>]")
+    default = raw.get("default", next(iter(aois)))
+    if default not in aois:
+        raise ValueError(f"AOI por defecto desconocida: {default}")
+    return aois, default
+
+
+# ================== ÁREA CARGADA ==================
+class AOIData:
+    """
+    Lo que el visor necesita de un área: catálogo (cabeceras), land cover y un
+    FrameLoader perezoso para los frames y el cubo. Con DARIEN_SHARED_DIR el
+    cubo, las capas derivadas y los bloques del historial se construyen una
+    vez entre todas las réplicas y se adjuntan con memmap (shared_store.py).
+    """
+
+    def __init__(self, aoi: AOI, max_pixels: int = MAX_PIXELS):
+        self.aoi = aoi
+        self.max_pixels = max_pixels
+        self.catalog = catalog.Catalog.scan(aoi.loss_dir, max_pixels)
+        self.landcover = None
+        if aoi.landcover and os.path.exists(aoi.landcover):
+            self.landcover = artifact_cache.load_landcover(aoi.landcover, max_pixels, palette=aoi.palette)
+        self.frames = pipeline.FrameLoader([e.path for e in self.catalog.frames], max_pixels,
+                                           palette=aoi.palette)
+        self._cube = None
+        self._cube_lock = threading.Lock()
+        self._stats = None
+        self._stats_lock = threading.Lock()
+        self._history = None
+        self._history_blocks = {}
+        self._derived = None
+        self._derived_lock = threading.Lock()
+        self._history_lock = threading.Lock()
+        self.sat = sat.SATSet(self.catalog.frames, aoi.landcover if self.landcover is not None else None,
+                              palette=aoi.palette)
+        self.hotspots = hotspots.HotspotSet(self.catalog.frames, aoi.palette)
+        self.shared = shared_store.default_store()
+        raw = (f"{artifact_cache.CACHE_VERSION}|{max_pixels}|{aoi.palette.key}|{rasters.DOWNSAMPLE}"
+               f"|{history.HISTORY_VERSION}|" + "|".join(e.version for e in self.catalog.frames))
+        self.shared_prefix = f"{aoi.key}-{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]}"
+
+    def packed_cube(self, start: int = 0):
+        """(cubo empaquetado, bounds, ancho) de los frames; del almacén compartido si lo hay."""
+        if self.shared is None:
+            return cube.load_loss_cube(self.frames.paths, self.max_pixels, self.frames, start)
+        name = f"{self.shared_prefix}-cube-packed"
+        geometry = {}
+
+        def build():
+            c, bounds, width = cube.load_loss_cube(self.frames.paths, self.max_pixels, self.frames, start)
+            geometry.update(bounds=list(bounds), width=int(width))
+            return c
+        packed = self.shared.array(name, build, lambda _c: geometry)
+        meta = self.shared.meta(name)
+        return packed, tuple(meta["bounds"]), meta["width"]
+
+    def cube(self, start: int = 0):
+        """(gzip del cubo, cabecera) de los frames; se construye una vez."""
+        with self._cube_lock:
+            if self._cube is None:
+                c, bounds, width = self.packed_cube(start)
+                labels = [e.label for e in self.catalog.frames]
+                if self.shared is None:
+                    self._cube = cube.cube_payload(c, width, bounds, labels)
+                else:
+                    enc = self.shared.encoded(f"{self.shared_prefix}-cube", lambda: Encoded(
+                        cube.cube_payload(c, width, bounds, labels)[0], "application/octet-stream"))
+                    self._cube = (enc.data, cube.cube_header(len(labels), c.shape[1], width, bounds, labels))
+            return self._cube
+
+    def cube_blob(self) -> Encoded:
+        return Encoded(self.cube()[0], "application/octet-stream")
+
+    def derived(self) -> "derived.DerivedLayers":
+        """Acumuladas y comparaciones A vs B de los frames (derived.py); el OR prefijo se calcula una vez."""
+        with self._derived_lock:
+            if self._derived is None:
+                if self.shared is None:
+                    self._derived = derived.DerivedLayers.from_frames(self.catalog.frames, self.max_pixels,
+                                                                      self.frames, self.aoi.palette)
+                else:
+                    packed, bounds, width = self.packed_cube()
+                    cumulative = self.shared.array(f"{self.shared_prefix}-cumulative",
+                                                   lambda: np.bitwise_or.accumulate(packed, axis=0))
+                    self._derived = derived.DerivedLayers(
+                        packed, width, bounds, self.catalog.frames, palette=self.aoi.palette, cumulative=cumulative,
+                        shared=self.shared, shared_prefix=f"{self.shared_prefix}-derived")
+            return self._derived
+
+    def history(self) -> dict:
+        """Historial de pérdida por píxel de los frames (history.py); se construye una vez."""
+        with self._history_lock:
+            if self._history is None:
+                self._history = history.load_history(self.frames.paths, self.max_pixels, self.aoi.palette)
+            return self._history
+
+    def history_block(self, by: int, bx: int) -> Encoded:
+        hist = self.history()
+        with self._history_lock:
+            data = self._history_blocks.get((by, bx))
+            if data is None:
+                if self.shared is not None:
+                    data = self.shared.encoded(f"{self.shared_prefix}-hist-{by}-{bx}", lambda: Encoded(
+                        history.history_block(hist, by, bx), "application/octet-stream")).data
+                else:
+                    data = history.history_block(hist, by, bx)
+                self._history_blocks[(by, bx)] = data
+        return Encoded(data, "application/octet-stream")
+
+    def loss_stats(self):
+        """DataFrame de hectáreas por (periodo, clase) de todas las entradas (stats.py); None sin land cover."""
+        if self.landcover is None:
+            return None
+        with self._stats_lock:
+            if self._stats is None:
+                self._stats = stats.loss_table(self.catalog.entries, self.aoi.landcover, self.aoi.palette)
+            return self._stats
+
+    def export(self, label: str) -> str:
+        """Ruta del GeoJSONSeq de polígonos de pérdida de la entrada label (export.py; cacheado en disco)."""
+        entry = self.catalog.by_label(label)
+        return export.export_frame(entry.path, self.aoi.landcover if self.landcover is not None else None,
+                                   self.aoi.palette)
+
+    def query_loss(self, geometry: dict) -> dict:
+        """Pérdida por frame dentro de un bbox o polígono dibujado (tablas SAT, sat.py)."""
+        return self.sat.query(geometry)
+
+    def refreshed(self, changed) -> "AOIData":
+        """
+        Copia recargada tras cambiar (o aparecer/desaparecer) los ficheros changed.
+        Catálogo y land cover se releen y los artefactos en disco de lo que no
+        cambió son aciertos de caché (van por hash de contenido); además se
+        conservan los frames ya cargados que no cambiaron y, si ninguna máscara
+        cambió, el cubo, el historial, las capas derivadas y los focos.
+        """
+        changed = {os.path.abspath(p) for p in changed}
+        new = AOIData(self.aoi, self.max_pixels)
+        new.frames.adopt(self.frames, [p for p in new.frames.paths if os.path.abspath(p) not in changed])
+        landcover = os.path.abspath(self.aoi.landcover) if self.aoi.landcover else None
+        if changed <= {landcover} and new.frames.paths == self.frames.paths:
+            with self._cube_lock, self._derived_lock, self._history_lock:
+                new._cube, new._derived = self._cube, self._derived
+                new._history, new._history_blocks = self._history, dict(self._history_blocks)
+            new.hotspots = self.hotspots
+        return new
+
+    def nbytes(self) -> int:
+        """Bytes en RAM (los arrays mmap de la caché en disco y del almacén compartido no cuentan)."""
+        total = self.frames.nbytes()
+        if self.landcover is not None:
+            codes = self.landcover["codes"]
+            if not isinstance(codes, np.memmap):
+                total += codes.nbytes
+            total += self.landcover["image"].nbytes
+        if self._cube is not None:
+            total += shared_store.ram_bytes(self._cube[0])
+        if self._stats is not None:
+            total += int(self._stats.memory_usage(deep=True).sum())
+        if self._history is not None:
+            total += sum(a.nbytes for a in self._history.values()
+                         if isinstance(a, np.ndarray) and not isinstance(a, np.memmap))
+        total += sum(shared_store.ram_bytes(b) for b in list(self._history_blocks.values()))
+        if self._derived is not None:
+            total += self._derived.nbytes()
+        return total
+
+    def close(self):
+        self.frames.close()
+
+
+class AOICache:
+    """
+    Áreas cargadas compartidas por todas las sesiones, con presupuesto de
+    memoria y desalojo LRU. El área recién pedida nunca se desaloja.
+    """
+
+    def __init__(self, max_bytes: int = AOI_CACHE_MAX_BYTES, max_pixels: int = MAX_PIXELS):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, aoi: AOI) -> AOIData:
+        """
+        Área cargada (la carga si no lo estaba). Un acierto solo la marca como
+        reciente: el desalojo, que mide todas las áreas, se hace al cargar o
+        recargar una.
+        """
+        with self._lock:
+            data = self._data.get(aoi)
+            if data is not None:
+                self._data.move_to_end(aoi)
+                return data
+            loading = self._loading.setdefault(aoi, threading.Lock())
+        with loading:   # una sola carga por área aunque la pidan varias sesiones
+            with self._lock:
+                data = self._data.get(aoi)
+            if data is not None:
+                with self._lock:
+                    self._data.move_to_end(aoi)
+                return data
+            data = AOIData(aoi, self.max_pixels)
+            with self._lock:
+                self._data[aoi] = data
+                self._data.move_to_end(aoi)
+                self._loading.pop(aoi, None)
+        self._evict(keep=aoi)
+        return data
+
+    def refresh(self, aoi: AOI, changed=()):
+        """
+        Sustituye el área por su versión recargada (AOIData.refreshed) sin tocar
+        las demás. Si no estaba cargada no se carga (None): las áreas solo se
+        cargan cuando alguien las selecciona. La versión vieja se cierra una
+        vez la nueva ha adoptado sus frames.
+        """
+        with self._lock:
+            old = self._data.get(aoi)
+        if old is None:
+            return None
+        data = old.refreshed(changed)
+        with self._lock:
+            if self._data.get(aoi) is not old:   # desalojada (o recargada) mientras tanto
+                data.close()
+                return None
+            self._data[aoi] = data
+            self._data.move_to_end(aoi)
+        old.close()
+        self._evict(keep=aoi)
+        return data
+
+    def _evict(self, keep: AOI):
+        """
+        Desaloja las áreas menos recientes (salvo keep) hasta caber en
+        max_bytes. Los tamaños se miden fuera del lock: las peticiones de las
+        áreas cargadas no esperan a que se recorran todas.
+        """
+        with self._lock:
+            items = list(self._data.items())
+        sizes = [(key, data, data.nbytes()) for key, data in items]
+        total = sum(size for _k, _d, size in sizes)
+        for key, data, size in sizes:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            with self._lock:
+                if self._data.get(key) is not data:   # ya desalojada o recargada
+                    continue
+                del self._data[key]
+            total -= size
+            data.close()
+
+    def loaded(self):
+        """[(clave, bytes)] de las áreas en memoria, de la menos a la más reciente."""
+        with self._lock:
+            return [(k.key, d.nbytes()) for k, d in self._data.items()]
@@ -0,0 +1,315 @@
+# artifact_cache.py
+"""
+Caché persistente en disco de frames ya preprocesados (leídos, reproyectados,
+colorizados y codificados). Sobrevive a reinicios, despliegues y réplicas nuevas:
+la clave depende del contenido del GeoTIFF, de MAX_PIXELS y del CRS destino.
+
+Cada entrada es un directorio con:
+    meta.json     bounds, leyenda, tipo, fuente...
+    *.npy         arrays reproyectados (se abren con mmap_mode="r")
+    frame         imagen codificada (encoders.py; el mime va en meta.json)
+
+Uso (en el build de la imagen):
+    python artifact_cache.py precompute
+    python artifact_cache.py info
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import rasterio
+
+import encoders
+import rasters
+from rasters import DEFAULT_PALETTE, DST_CRS, MAX_PIXELS, Palette, timed
+
+CACHE_DIR = os.environ.get("DARIEN_ARTIFACT_CACHE", ".cache/artifacts")
+CACHE_MAX_BYTES = int(float(os.environ.get("DARIEN_ARTIFACT_CACHE_MB", "2048")) * 2**20)
+CACHE_VERSION = 4   # subir si cambia el formato o el procesamiento de los artefactos
+
+DEFAULT_PATHS = sorted(glob.glob("mask_loss/*.tif")) + ["landcover_darien.tif"]
+
+_HASHES = {}
+_HASHES_LOCK = threading.Lock()
+
+
+def file_hash(path: str) -> str:
+    """sha1 del contenido, memorizado por (ruta, tamaño, mtime) dentro del proceso."""
+    st_ = os.stat(path)
+    memo = (os.path.abspath(path), st_.st_size, st_.st_mtime_ns)
+    with _HASHES_LOCK:
+        if memo in _HASHES:
+            return _HASHES[memo]
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _HASHES_LOCK:
+        _HASHES[memo] = digest
+    return digest
+
+
+class ArtifactCache:
+    """Directorio de entradas con tope de tamaño y desalojo LRU (por último uso)."""
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None   # bytes publicados (se escanea el directorio la primera vez y al desalojar)
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, path: str, kind: str, max_pixels: int = MAX_PIXELS, dst_crs: str = DST_CRS,
+            opts: "encoders.EncoderOptions" = encoders.DEFAULT_OPTIONS, palette: Palette = DEFAULT_PALETTE,
+            extra: str = "") -> str:
+        """extra: dependencias adicionales de la entrada (p. ej. hash de otro fichero)."""
+        raw = (f"{CACHE_VERSION}|{file_hash(path)}|{kind}|{max_pixels}|{dst_crs}|{opts}|{palette.key}"
+               f"|{rasters.DOWNSAMPLE}|{extra}")
+        return f"{kind}-{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]}"
+
+    def _dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str):
+        """
+        Entrada {"meta", "arrays", "blobs"} o None. Los arrays se devuelven como
+        memmap de solo lectura; los blobs (PNG…) como bytes.
+        """
+        d = self._dir(key)
+        meta_path = os.path.join(d, "meta.json")
+        # Otro hilo o proceso puede desalojar la entrada mientras se lee: lo que
+        # falte o esté incompleto cuenta como fallo de caché.
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            arrays = {n: np.load(os.path.join(d, f"{n}.npy"), mmap_mode="r") for n in meta["arrays"]}
+            blobs = {}
+            for n in meta["blobs"]:
+                with open(os.path.join(d, n), "rb") as f:
+                    blobs[n] = f.read()
+            os.utime(meta_path)   # marca de último uso para el LRU
+        except (OSError, ValueError, KeyError):
+            return None
+        return {"meta": meta, "arrays": arrays, "blobs": blobs}
+
+    def put(self, key: str, meta: dict, arrays: dict = None, blobs: dict = None):
+        """
+        Escribe la entrada en un directorio temporal y la publica con un rename
+        atómico: ningún lector ve nunca una entrada a medio escribir.
+        """
+        arrays, blobs = arrays or {}, blobs or {}
+        tmp = os.path.join(self.root, f".tmp-{key}-{os.getpid()}-{threading.get_ident()}")
+        os.makedirs(tmp, exist_ok=True)
+        for n, a in arrays.items():
+            np.save(os.path.join(tmp, f"{n}.npy"), np.ascontiguousarray(a))
+        for n, b in blobs.items():
+            with open(os.path.join(tmp, n), "wb") as f:
+                f.write(b)
+        meta = dict(meta, arrays=sorted(arrays), blobs=sorted(blobs), created=time.time())
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        size = _dir_bytes(tmp)
+        try:
+            os.rename(tmp, self._dir(key))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)   # otro proceso la publicó antes
+            return
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+        if self.total_bytes() > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """[(key, bytes, último uso)] de las entradas publicadas."""
+        out = []
+        for name in os.listdir(self.root):
+            d = self._dir(name)
+            meta_path = os.path.join(d, "meta.json")
+            if name.startswith("."):
+                continue
+            try:   # puede desaparecer mientras se recorre (desalojo en otro proceso)
+                out.append((name, _dir_bytes(d), os.stat(meta_path).st_mtime))
+            except OSError:
+                continue
+        return out
+
+    def total_bytes(self) -> int:
+        """Bytes publicados según el contador del proceso (un escaneo la primera vez)."""
+        with self._lock:
+            if self._total is None:
+                self._total = sum(e[1] for e in self.entries())
+            return self._total
+
+    def evict(self):
+        """
+        Borra las entradas menos usadas recientemente hasta caber en max_bytes.
+        Reescanea el directorio (otros procesos también escriben) y deja el
+        contador al día; put() solo lo llama cuando el contador pasa del tope.
+        """
+        with self._lock:
+            entries = sorted(self.entries(), key=lambda e: e[2])
+            total = sum(e[1] for e in entries)
+            for name, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(self._dir(name), ignore_errors=True)
+                total -= size
+            self._total = total
+
+    def clear(self):
+        with self._lock:
+            for name, _, _ in self.entries():
+                shutil.rmtree(self._dir(name), ignore_errors=True)
+            self._total = 0
+
+
+def _dir_bytes(d: str) -> int:
+    return sum(e.stat().st_size for e in os.scandir(d) if e.is_file())
+
+
+_DEFAULT = None
+
+
+def default_cache() -> ArtifactCache:
+    global _DEFAULT
+    if _DEFAULT is None:
+        _DEFAULT = ArtifactCache()
+    return _DEFAULT
+
+
+# ================== FRAMES ==================
+def load_frame(path: str, max_pixels: int = MAX_PIXELS, cache: ArtifactCache = None,
+               opts: "encoders.EncoderOptions" = encoders.DEFAULT_OPTIONS, timings: dict = None,
+               palette: Palette = DEFAULT_PALETTE) -> dict:
+    """
+    Frame de pérdida (o RGB/RGBA) desde caché o recién procesado:
+    {"bounds" (S,W,N,E), "image" (encoders.Encoded), "index" (solo máscaras),
+    "rgba" (solo RGB/RGBA), "palette"}. El RGBA de una máscara no se construye:
+    quien lo necesite lo pide a frame_rgba.
+    timings (dict) opcional acumula segundos por etapa: read, warp, encode,
+    store (escritura en caché) y cache (hash del fichero + consulta).
+    """
+    cache = cache or default_cache()
+    with timed(timings, "cache"):
+        key = cache.key(path, "frame", max_pixels, opts=opts, palette=palette)
+        hit = cache.get(key)
+    if hit is None:
+        with rasterio.open(path) as src:
+            is_mask = src.count < 3
+        if is_mask:
+            index, bounds = rasters.load_mask_index_and_bounds(path, max_pixels, timings=timings)
+            rgba = None
+            with timed(timings, "encode"):
+                image = encoders.encode_mask(index, opts, palette)
+            arrays = {"index": index}
+        else:
+            rgba, bounds = rasters.load_any_as_rgba_and_bounds(path, max_pixels, timings=timings)
+            index = None
+            with timed(timings, "encode"):
+                image = encoders.encode_rgba(rgba, opts)
+            arrays = {"rgba": rgba}
+        with timed(timings, "store"):
+            cache.put(key, {"kind": "frame", "source": path, "bounds": list(bounds), "mime": image.mime},
+                      arrays, {"frame": image.data})
+        return {"bounds": tuple(bounds), "image": image, "index": index, "rgba": rgba, "palette": palette}
+    meta, arrays = hit["meta"], hit["arrays"]
+    return {"bounds": tuple(meta["bounds"]), "image": encoders.Encoded(hit["blobs"]["frame"], meta["mime"]),
+            "index": arrays.get("index"), "rgba": arrays.get("rgba"), "palette": palette}
+
+
+def frame_rgba(art: dict) -> np.ndarray:
+    """RGBA (H,W,4) de un frame de load_frame; el de una máscara se coloriza aquí."""
+    if art["index"] is None:
+        return art["rgba"]
+    return art["palette"].mask_palette[art["index"]]
+
+
+def load_landcover(path: str, max_pixels: int = MAX_PIXELS, cache: ArtifactCache = None,
+                   opts: "encoders.EncoderOptions" = encoders.DEFAULT_OPTIONS,
+                   palette: Palette = DEFAULT_PALETTE) -> dict:
+    """
+    Land cover desde caché o recién procesado: {"bounds" (S,W,N,E), "legend",
+    "codes", "nodata", "palette", "image" (encoders.Encoded)}. El RGBA se
+    construye aparte con landcover_rgba.
+    """
+    cache = cache or default_cache()
+    key = cache.key(path, "landcover", max_pixels, opts=opts, palette=palette)
+    hit = cache.get(key)
+    if hit is None:
+        codes, bounds, nodata = rasters.load_landcover_codes_and_bounds(path, max_pixels)
+        legend = rasters.landcover_legend(codes, nodata, palette)
+        image = encoders.encode_landcover(codes, nodata, opts=opts, palette=palette)
+        cache.put(key, {"kind": "landcover", "source": path, "bounds": list(bounds),
+                        "legend": legend, "nodata": nodata, "mime": image.mime},
+                  {"codes": codes}, {"frame": image.data})
+        return {"bounds": tuple(bounds), "legend": legend, "codes": codes, "nodata": nodata,
+                "palette": palette, "image": image}
+    meta = hit["meta"]
+    return {"bounds": tuple(meta["bounds"]), "legend": meta["legend"], "codes": hit["arrays"]["codes"],
+            "nodata": meta["nodata"], "palette": palette,
+            "image": encoders.Encoded(hit["blobs"]["frame"], meta["mime"])}
+
+
+def landcover_rgba(art: dict) -> np.ndarray:
+    """RGBA (H,W,4) del land cover de load_landcover."""
+    rgba, _present = rasters.colorize_landcover(art["codes"], art["nodata"], palette=art["palette"])
+    return rgba
+
+
+def _nodata(path):
+    with rasterio.open(path) as src:
+        return src.nodata
+
+
+def _is_landcover(path: str) -> bool:
+    return "landcover" in os.path.basename(path).lower()
+
+
+# ================== CLI ==================
+def precompute(paths=None, max_pixels: int = MAX_PIXELS, cache: ArtifactCache = None):
+    """Rellena la caché para paths (por defecto máscaras + land cover)."""
+    cache = cache or default_cache()
+    for p in paths or DEFAULT_PATHS:
+        if not os.path.exists(p):
+            print(f"[skip] no existe: {p}")
+            continue
+        t0 = time.perf_counter()
+        if _is_landcover(p):
+            load_landcover(p, max_pixels, cache)
+        else:
+            load_frame(p, max_pixels, cache)
+        print(f"[ok] {p} ({time.perf_counter() - t0:.2f}s)")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Caché persistente de frames del visor.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    pre = sub.add_parser("precompute", help="preprocesar y guardar frames")
+    pre.add_argument("paths", nargs="*")
+    pre.add_argument("--max-pixels", type=int, default=MAX_PIXELS)
+    sub.add_parser("info", help="listar entradas y tamaño total")
+    sub.add_parser("clear", help="vaciar la caché")
+    args = ap.parse_args(argv)
+
+    cache = default_cache()
+    if args.cmd == "precompute":
+        precompute(args.paths or None, args.max_pixels, cache)
+    elif args.cmd == "info":
+        entries = cache.entries()
+        for name, size, used in sorted(entries, key=lambda e: -e[2]):
+            print(f"{name}\t{size / 2**20:.1f} MB\t{time.ctime(used)}")
+        print(f"total {sum(e[1] for e in entries) / 2**20:.1f} MB / {cache.max_bytes / 2**20:.0f} MB")
+    elif args.cmd == "clear":
+        cache.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# assets.py
+"""
+Almacén de assets direccionados por contenido (frames, land cover, rejilla de
+códigos). El nombre del fichero es el hash de sus bytes, así que una URL nunca
+cambia de contenido: el servidor local los sirve con ETag y
+Cache-Control immutable y el navegador/proxies los reutilizan entre sesiones.
+"""
+import hashlib
+import mimetypes
+import os
+import threading
+
+ASSETS_DIR = os.environ.get("DARIEN_ASSETS_DIR", ".cache/assets")
+
+EXTENSIONS = {
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "application/octet-stream": ".bin",
+    "application/json": ".json",
+}
+
+
+class AssetStore:
+    """Escribe blobs como <sha256[:20]><ext> bajo root (una sola vez, atómicamente)."""
+
+    def __init__(self, root: str = ASSETS_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, data: bytes, mime: str = "application/octet-stream") -> str:
+        """Guarda data si no existía y devuelve su nombre (que es también su ETag)."""
+        name = hashlib.sha256(data).hexdigest()[:20] + EXTENSIONS.get(mime, ".bin")
+        path = os.path.join(self.root, name)
+        if not os.path.exists(path):
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"   # un temporal por hilo del servidor
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return name
+
+    def path(self, name: str):
+        """Ruta del asset o None si el nombre no es válido / no existe."""
+        if os.path.basename(name) != name or name.startswith("."):
+            return None
+        path = os.path.join(self.root, name)
+        return path if os.path.isfile(path) else None
+
+    @staticmethod
+    def mime(name: str) -> str:
+        return mimetypes.guess_type(name)[0] or "application/octet-stream"
@@ -0,0 +1,77 @@
+# build_overviews.py
+"""
+Construye overviews internas (y opcionalmente reescribe en layout COG) para los
+GeoTIFF del visor, de modo que las lecturas diezmadas de rasters.read_decimated
+y las teselas de tiles.py lean niveles reducidos en vez de la resolución completa.
+
+Uso:
+    python build_overviews.py                 # mask_loss/*.tif + landcover_darien.tif
+    python build_overviews.py --cog a.tif b.tif
+"""
+import argparse
+import glob
+import os
+
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as rio_copy
+
+DEFAULT_PATHS = sorted(glob.glob("mask_loss/*.tif")) + ["landcover_darien.tif"]
+MIN_OVERVIEW_SIZE = 256
+
+
+def overview_factors(width: int, height: int, min_size: int = MIN_OVERVIEW_SIZE):
+    """Factores 2, 4, 8… hasta que el lado mayor quede por debajo de min_size."""
+    factors, f = [], 2
+    while max(width, height) / f >= min_size:
+        factors.append(f)
+        f *= 2
+    return factors
+
+
+def build_overviews(path: str, resampling: str = "nearest"):
+    """Añade overviews internas in situ. Devuelve los factores construidos."""
+    with rasterio.open(path, "r+") as dst:
+        factors = overview_factors(dst.width, dst.height)
+        if factors:
+            dst.build_overviews(factors, Resampling[resampling])
+            dst.update_tags(ns="rio_overview", resampling=resampling)
+    return factors
+
+
+def to_cog(path: str, resampling: str = "nearest", blocksize: int = 512):
+    """
+    Reescribe path como Cloud Optimized GeoTIFF (bloques, overviews internas,
+    DEFLATE). Se escribe a un temporal y se sustituye de forma atómica.
+    """
+    tmp = f"{path}.cog.tmp"
+    rio_copy(
+        path, tmp, driver="COG",
+        COMPRESS="DEFLATE", PREDICTOR="YES", BLOCKSIZE=str(blocksize),
+        OVERVIEW_RESAMPLING=resampling.upper(), OVERVIEWS="IGNORE_EXISTING",
+    )
+    os.replace(tmp, path)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("paths", nargs="*", default=DEFAULT_PATHS)
+    ap.add_argument("--cog", action="store_true", help="reescribir en layout COG")
+    ap.add_argument("--resampling", default="nearest",
+                    help="remuestreo de overviews (nearest para máscaras/categóricos)")
+    args = ap.parse_args(argv)
+
+    for p in args.paths:
+        if not os.path.exists(p):
+            print(f"[skip] no existe: {p}")
+            continue
+        if args.cog:
+            to_cog(p, args.resampling)
+            with rasterio.open(p) as src:
+                print(f"[cog] {p}: overviews {src.overviews(1)}")
+        else:
+            print(f"[ovr] {p}: overviews {build_overviews(p, args.resampling)}")
+
+
+if __name__ == "__main__":
+    main()
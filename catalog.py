@@ -0,0 +1,160 @@
+# catalog.py
+"""
+Catálogo de máscaras de pérdida descubierto en disco. Recorre mask_loss/, saca
+el periodo de cada nombre (…_2020_2021_….tif) y lee solo la cabecera del GeoTIFF
+(CRS, dtype, shape y la malla EPSG:4326 que producirán los loaders), sin tocar
+píxeles: construir el índice cuesta lo mismo con 5 años que con 50.
+
+    frames       periodos de un año, en orden cronológico (la animación)
+    composites   periodos de varios años (p. ej. 2020 → 2025)
+
+Uso:
+    python catalog.py [directorio]
+"""
+import argparse
+import glob
+import hashlib
+import os
+import re
+import warnings
+from dataclasses import dataclass
+
+import rasterio
+
+from rasters import MAX_PIXELS, bounds_of, display_grid
+
+LOSS_DIR = os.environ.get("DARIEN_LOSS_DIR", "mask_loss")
+
+_YEARS_RE = re.compile(r"(?<!\d)((?:19|20)\d{2})[_\-]((?:19|20)\d{2})(?!\d)")
+
+
+def parse_years(filename: str):
+    """(inicio, fin) del primer par de años del nombre, o None."""
+    m = _YEARS_RE.search(os.path.basename(filename))
+    if not m:
+        return None
+    start, end = int(m.group(1)), int(m.group(2))
+    return (start, end) if end > start else None
+
+
+@dataclass(frozen=True)
+class RasterEntry:
+    path: str
+    start: int
+    end: int
+    bounds: tuple       # (S,W,N,E) de la malla de visualización en EPSG:4326
+    shape: tuple        # (H,W) de la malla de visualización
+    src_shape: tuple    # (H,W) nativo
+    crs: str
+    dtype: str
+    count: int
+    nodata: object
+    mtime_ns: int
+    size: int
+
+    @property
+    def label(self) -> str:
+        return f"{self.start} → {self.end}"
+
+    @property
+    def name(self) -> str:
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    @property
+    def span(self) -> int:
+        return self.end - self.start
+
+    @property
+    def version(self) -> str:
+        """Cambia si cambia el fichero (ruta, tamaño, mtime)."""
+        raw = f"{os.path.abspath(self.path)}|{self.size}|{self.mtime_ns}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:10]
+
+
+def read_entry(path: str, max_pixels: int = MAX_PIXELS):
+    """Entrada del catálogo a partir de la cabecera; None si el nombre no trae periodo."""
+    years = parse_years(path)
+    if years is None:
+        return None
+    st_ = os.stat(path)
+    with rasterio.open(path) as src:
+        transform, shape = display_grid(src, max_pixels)
+        return RasterEntry(
+            path=path, start=years[0], end=years[1],
+            bounds=tuple(float(v) for v in bounds_of(transform, shape)), shape=tuple(shape),
+            src_shape=(src.height, src.width), crs=src.crs.to_string() if src.crs else "",
+            dtype=src.dtypes[0], count=src.count, nodata=src.nodata,
+            mtime_ns=st_.st_mtime_ns, size=st_.st_size,
+        )
+
+
+def dir_signature(root: str = LOSS_DIR, pattern: str = "*.tif") -> tuple:
+    """((nombre, tamaño, mtime), …) del directorio: clave barata para cachear el catálogo."""
+    out = []
+    for p in sorted(glob.glob(os.path.join(root, pattern))):
+        st_ = os.stat(p)
+        out.append((os.path.basename(p), st_.st_size, st_.st_mtime_ns))
+    return tuple(out)
+
+
+class Catalog:
+    """Índice de máscaras de pérdida ordenado por periodo."""
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda e: (e.start, e.end, e.path))
+
+    @classmethod
+    def scan(cls, root: str = LOSS_DIR, max_pixels: int = MAX_PIXELS, pattern: str = "*.tif") -> "Catalog":
+        entries = []
+        for p in sorted(glob.glob(os.path.join(root, pattern))):
+            entry = read_entry(p, max_pixels)
+            if entry is None:
+                warnings.warn(f"Sin periodo en el nombre, se ignora: {p}")
+                continue
+            entries.append(entry)
+        return cls(entries)
+
+    @property
+    def frames(self):
+        """Periodos anuales (uno por año de inicio; ante duplicados gana el primero por ruta)."""
+        seen, out = set(), []
+        for e in self.entries:
+            if e.span == 1 and e.start not in seen:
+                seen.add(e.start)
+                out.append(e)
+        return out
+
+    @property
+    def composites(self):
+        return [e for e in self.entries if e.span > 1]
+
+    def rasters(self) -> dict:
+        """{etiqueta: ruta} de los frames, en orden."""
+        return {e.label: e.path for e in self.frames}
+
+    def by_label(self, label: str) -> RasterEntry:
+        for e in self.entries:
+            if e.label == label:
+                return e
+        raise KeyError(label)
+
+    def same_grid(self, entries=None) -> bool:
+        """True si todas las entradas comparten malla de visualización (apilables en un cubo)."""
+        entries = self.frames if entries is None else entries
+        return len({(e.shape, tuple(round(v, 9) for v in e.bounds)) for e in entries}) <= 1
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Índice de máscaras de pérdida (solo cabeceras).")
+    ap.add_argument("root", nargs="?", default=LOSS_DIR)
+    ap.add_argument("--max-pixels", type=int, default=MAX_PIXELS)
+    args = ap.parse_args(argv)
+    cat = Catalog.scan(args.root, args.max_pixels)
+    frames = {e.path for e in cat.frames}
+    for e in cat.entries:
+        kind = "frame" if e.path in frames else ("compuesto" if e.span > 1 else "duplicado")
+        print(f"{e.label:<14}{kind:<11}{e.shape[0]}x{e.shape[1]:<8}{e.crs:<11}{e.dtype:<8}{os.path.basename(e.path)}")
+
+
+if __name__ == "__main__":
+    main()
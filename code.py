@@ -1,18 +1,28 @@
 # app.py
 import os
 import numpy as np
-import rasterio
-from rasterio.warp import (
-    calculate_default_transform,
-    reproject,
-    Resampling,
-    transform_bounds,
-)
 import streamlit as st
-import json, io, base64
+import json, io, base64, hashlib
 from PIL import Image
 from funciones import *    
-import streamlit.components.v1 as components
+import plotly.graph_objects as go
+import rasters
+import pipeline
+import aoi
+from rasters import MAX_PIXELS
+from tiles import TileLayer
+from local_server import LocalServer
+from assets import AssetStore
+from encoders import Encoded
+import cube
+import derived
+import export
+import history
+import map_component
+import hotspots
+import frame_store
+import viewport
+import watcher
 
 # ================== CONFIG ==================
 st.set_page_config(
@@ -24,200 +34,338 @@ st.set_page_config(
 
 # ---- Rutas ----
 LOGO_PATH = "circle-white.svg"
-LANDCOVER_PATH = "landcover_darien.tif"
-dirpath = "mask_loss/"
-
-# ---- Iconos UI ----
-logo_data_uri = img_to_data_uri(LOGO_PATH)
-icon_prev  = img_to_data_uri("previous-svgrepo-com.svg")
-icon_play  = img_to_data_uri("play-svgrepo-com.svg")
-icon_pause = img_to_data_uri("pause-svgrepo-com.svg")
-icon_next  = img_to_data_uri("next-svgrepo-com.svg")
-
-# ================== DATA SOURCES ==================
-RASTERS = {
-    "2020 → 2021": f"{dirpath}Mask_Loss_2020_2021_adaptive.tif",
-    "2021 → 2022": f"{dirpath}Mask_Loss_2021_2022_adaptive.tif",
-    "2022 → 2023": f"{dirpath}Mask_Loss_2022_2023_adaptive.tif",
-    "2023 → 2024": f"{dirpath}Mask_Loss_2023_2024_adaptive.tif",
-    "2024 → 2025": f"{dirpath}Mask_Loss_2024_2025_adaptive.tif",
-}
-LABELS = list(RASTERS.keys())
-MAX_PIXELS = 5_000_000  # controla submuestreo para fluidez
-
-# Paleta Copernicus + utilidades
-LANDCOVER_CLASSES = [
-    (0,   "#282828", "Desconocido"),
-    (20,  "#ffbb22", "Arbustos"),
-    (30,  "#84F58C", "Vegetación herbácea"),
-    (40,  "#EBEB86", "Cultivos / agricultura"),
-    (50,  "#b727f5", "Urbano / construido"),
-    (60,  "#b4b4b4", "Desnudo / vegetación escasa"),
-    (70,  "#f0f0f0", "Nieve y hielo"),
-    (80,  "#0032c8", "Cuerpos de agua permanentes"),
-    (90,  "#0096a0", "Humedal herbáceo"),
-    (100, "#fae6a0", "Musgo y líquenes"),
-    (111, "#58481f", "Bosque cerrado, coníferas perennes"),
-    (112, "#009900", "Bosque cerrado, hoja perenne de amplio espectro"),
-    (113, "#70663e", "Bosque cerrado, hoja caduca de aguja"),
-    (114, "#00cc00", "Bosque cerrado, hoja caduca de amplio espectro"),
-    (115, "#4e751f", "Bosque cerrado, mixto"),
-    (116, "#007800", "Bosque cerrado, otro"),
-    (121, "#666000", "Bosque abierto, coníferas perennes"),
-    (122, "#8db400", "Bosque abierto, hoja perenne de amplio espectro"),
-    (123, "#8d7400", "Bosque abierto, hoja caduca de aguja"),
-    (124, "#a0dc00", "Bosque abierto, hoja caduca de amplio espectro"),
-    (125, "#929900", "Bosque abierto, mixto"),
-    (126, "#648c00", "Bosque abierto, otro"),
-    (200, "#000080", "Océanos, mares"),
-]
+
+# ---- Iconos UI (base64 una vez por proceso) ----
+@st.cache_resource(show_spinner=False)
+def load_icons():
+    return {
+        "logo": img_to_data_uri(LOGO_PATH),
+        "prev": img_to_data_uri("previous-svgrepo-com.svg"),
+        "play": img_to_data_uri("play-svgrepo-com.svg"),
+        "pause": img_to_data_uri("pause-svgrepo-com.svg"),
+        "next": img_to_data_uri("next-svgrepo-com.svg"),
+    }
+
+ICONS = load_icons()
+
+# ================== ÁREAS (AOI) ==================
+AOIS, DEFAULT_AOI = aoi.load_config()
+AOI_KEY = st.query_params.get("aoi", DEFAULT_AOI)
+if AOI_KEY not in AOIS:
+    AOI_KEY = DEFAULT_AOI
+AREA = AOIS[AOI_KEY]
+
+@st.cache_resource(show_spinner=False)
+def get_aoi_cache():
+    """Áreas cargadas compartidas por todas las sesiones, con presupuesto de memoria (LRU)."""
+    return aoi.AOICache()
+
+AOI_CACHE = get_aoi_cache()
+
+# ---- Servidor local en segundo plano: teselas XYZ + assets inmutables ----
+USE_TILES = os.environ.get("DARIEN_TILES", "1") != "0"
+USE_ASSETS = os.environ.get("DARIEN_ASSETS", "1") != "0"
+SHOW_STATS = os.environ.get("DARIEN_STATS", "1") != "0"   # gráfico de hectáreas junto al mapa
+# Pérdida: "cube" (canvas desde el cubo de bits), "tiles" (pirámide XYZ) o "image" (PNG por frame)
+LOSS_RENDER = os.environ.get("DARIEN_LOSS_RENDER", "cube")
+SERVER_HOST = os.environ.get("DARIEN_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("DARIEN_SERVER_PORT", "8502"))
+SERVER_PUBLIC_URL = os.environ.get("DARIEN_SERVER_URL", f"http://localhost:{SERVER_PORT}")
+# Preparación al arrancar: "default" (el área de la primera sesión), "all" (todas) o "0" (al pedirla)
+WARM_UP = os.environ.get("DARIEN_WARM_UP", "default")
 
 # ================== STATE (solo lo que usas) ==================
-if "idx" not in st.session_state:
+if "idx" not in st.session_state or st.session_state.get("aoi") != AOI_KEY:
     st.session_state.idx = 0
+    st.session_state.aoi = AOI_KEY
 if "playing" not in st.session_state:
     st.session_state.playing = False
 if "interval" not in st.session_state:
     st.session_state.interval = 0.6
+# El mapa devuelve el frame en pantalla (map_component.py): Python sigue al navegador
+_map_value = map_component.map_value("map")
+if _map_value.get("area") == AOI_KEY and isinstance(_map_value.get("idx"), int):
+    st.session_state.idx = _map_value["idx"]
 
 
 # ================== UTILS ==================
-def _hex_to_rgb(h: str):
-    h = h.strip()
-    if not h.startswith("#"):
-        h = "#" + h
-    return tuple(int(h[i:i+2], 16) for i in (1, 3, 5))
-
-def rgba_to_dataurl(rgba: np.ndarray) -> str:
-    im = Image.fromarray(rgba, mode="RGBA")
-    buf = io.BytesIO()
-    im.save(buf, format="PNG")
-    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
-
-@st.cache_data(show_spinner=False)
-def load_any_as_rgba_and_bounds(path, max_pixels=MAX_PIXELS):
+def _layer_name(path, area_key=None):
+    return f"{area_key or AOI_KEY}-{os.path.splitext(os.path.basename(path))[0]}"
+
+@st.cache_resource(show_spinner=False)
+def get_local_server():
+    """Servidor de teselas/assets compartido por todas las sesiones (uno por proceso)."""
+    return LocalServer(SERVER_HOST, SERVER_PORT, AssetStore() if USE_ASSETS else None).start()
+
+@st.cache_resource(show_spinner=False)
+def register_area(area_key, versions, landcover_version="-"):
+    """
+    Publica las capas de un área en el servidor local (una vez por proceso y
+    versión de sus ficheros): teselas XYZ, rutas /lazy/ de frames, cubo y
+    bloques del historial por píxel, capas acumuladas y comparaciones A vs B,
+    la consulta /api/ de pérdida dentro de una forma dibujada (tablas SAT) y
+    las descargas /files/ de polígonos.
+    Las rutas pasan por AOI_CACHE, así que sobreviven al desalojo del área.
+    Devuelve {"frames", "cube", "query", "history", "cumulative", "compare",
+    "exports"} con sus nombres. landcover_version solo entra en la clave de la
+    caché: si cambia el land cover se vuelve a publicar su capa de teselas.
+    """
+    area = AOIS[area_key]
+    data = AOI_CACHE.get(area)
+    if USE_TILES:
+        for e in data.catalog.frames:
+            LOCAL_SERVER.register(TileLayer(_layer_name(e.path, area_key), e.path, "mask", palette=area.palette))
+        if area.landcover and os.path.exists(area.landcover):
+            LOCAL_SERVER.register(TileLayer(_layer_name(area.landcover, area_key), area.landcover, "landcover",
+                                            palette=area.palette))
+    names = {}
+    for i, e in enumerate(data.catalog.frames):
+        names[e.label] = f"{area_key}-{e.name}-{e.version}"
+        LOCAL_SERVER.register_lazy(names[e.label], lambda i=i: AOI_CACHE.get(area).frames.get(i)["image"])
+    version = hashlib.sha1("|".join(versions).encode()).hexdigest()[:16]
+    cube_name = f"{area_key}-cube-{version}"
+    LOCAL_SERVER.register_lazy(cube_name, lambda: AOI_CACHE.get(area).cube_blob())
+    query_name = f"{area_key}-query"
+    LOCAL_SERVER.register_api(query_name, lambda geometry: AOI_CACHE.get(area).query_loss(geometry))
+    hist_names, cum_names, cmp_names = {}, {}, {}
+    if data.catalog.frames and data.catalog.same_grid():
+        n = len(data.catalog.frames)
+        for i in range(n):
+            cum_names[i] = f"{area_key}-cum-{version}-{i}"
+            LOCAL_SERVER.register_lazy(cum_names[i], lambda i=i: AOI_CACHE.get(area).derived().cumulative_image(i))
+        for a in range(n):
+            for b in range(a + 1, n):
+                cmp_names[a, b] = f"{area_key}-cmp-{version}-{a}-{b}"
+                LOCAL_SERVER.register_lazy(cmp_names[a, b],
+                                           lambda a=a, b=b: AOI_CACHE.get(area).derived().compare_image(a, b))
+        h, w = data.catalog.frames[0].shape
+        for by in range(-(-h // history.HISTORY_BLOCK)):
+            for bx in range(-(-w // history.HISTORY_BLOCK)):
+                hist_names[by, bx] = f"{area_key}-hist-{version}-{by}-{bx}"
+                LOCAL_SERVER.register_lazy(hist_names[by, bx],
+                                           lambda by=by, bx=bx: AOI_CACHE.get(area).history_block(by, bx))
+    export_names = {}
+    for e in data.catalog.entries:
+        export_names[e.label] = f"{area_key}-export-{e.name}-{e.version}"
+        LOCAL_SERVER.register_file(export_names[e.label], lambda e=e: (
+            AOI_CACHE.get(area).export(e.label), export.EXPORT_MIME, export.download_name(e)))
+    return {"frames": names, "cube": cube_name, "query": query_name, "history": hist_names,
+            "cumulative": cum_names, "compare": cmp_names, "exports": export_names}
+
+LOCAL_SERVER = get_local_server() if (USE_TILES or USE_ASSETS) else None
+TILE_SERVER = LOCAL_SERVER if USE_TILES else None
+
+def publish(data: bytes, mime: str) -> str:
+    """URL inmutable (asset direccionado por contenido) o, sin servidor, data URL."""
+    if LOCAL_SERVER and LOCAL_SERVER.assets:
+        return LOCAL_SERVER.asset_url(SERVER_PUBLIC_URL, LOCAL_SERVER.assets.put(data, mime))
+    return Encoded(data, mime).dataurl()
+
+
+# ================== PREPARACIÓN POR ÁREA (frame_store.py) ==================
+def build_store(area_key) -> frame_store.FrameStore:
     """
-    GeoTIFF → RGBA + bounds (S,W,N,E), reproyectado a EPSG:4326, submuestreo por stride.
-    1 banda → máscara >0 en rojo; 3/4 bandas → respeta RGB(A).
+    Todo lo que el visor sirve de un área, preparado una vez por proceso:
+    rutas del servidor local, land cover publicado, cubo/frames, historial,
+    capas derivadas, focos y las secciones JSON del mapa con sus hashes.
     """
-    with rasterio.open(path) as src:
-        if src.count >= 3:
-            r = src.read(1); g = src.read(2); b = src.read(3)
-            a = np.full_like(r, 255, dtype=np.uint8)
-            if src.count >= 4:
-                a = src.read(4).astype(np.uint8)
-            base = np.dstack([r, g, b, a]).astype(np.uint8)
+    area = AOIS[area_key]
+    data = AOI_CACHE.get(area)
+    catalog_ = data.catalog
+    entries = {e.label: e for e in catalog_.frames}
+    rasters_ = catalog_.rasters()   # {"2020 → 2021": ruta, ...} en orden cronológico
+    labels = list(rasters_.keys())
+    lc_version = watcher.file_version(area.landcover)
+    version = hashlib.sha1("|".join([e.version for e in catalog_.entries] + [lc_version]).encode()).hexdigest()[:16]
+    if not labels:
+        return frame_store.FrameStore(area_key, version, labels, catalog_.entries, {}, {})
+
+    routes, query_url = {}, None
+    if LOCAL_SERVER:
+        routes = register_area(area_key, tuple(e.version for e in catalog_.frames), lc_version)
+        query_url = LOCAL_SERVER.api_url(SERVER_PUBLIC_URL, routes["query"])
+
+    # === Land cover (opcional) ===
+    lc_tiles = lc_maxz = None
+    lc_codes = None
+    if data.landcover is not None:
+        lc_s, lc_w, lc_n, lc_e = data.landcover["bounds"]
+        lc_legend, lc_image = data.landcover["legend"], data.landcover["image"]
+        lc_codes = np.asarray(data.landcover["codes"])
+        if TILE_SERVER:
+            lc_layer = TILE_SERVER.layers[_layer_name(area.landcover, area_key)]
+            lc_tiles, lc_maxz = lc_layer.url_template(SERVER_PUBLIC_URL), lc_layer.max_zoom
+            lc_img = lc_tiles
         else:
-            m = src.read(1).astype(float)
-            if src.nodata is not None:
-                m[m == src.nodata] = np.nan
-            mask = ~np.isnan(m) & (m > 0)
-            base = np.zeros((m.shape[0], m.shape[1], 4), dtype=np.uint8)
-            base[..., 0][mask] = 255
-            base[..., 1][mask] = 59
-            base[..., 2][mask] = 48
-            base[..., 3][mask] = 255
-
-        if src.crs is None or (hasattr(src.crs, "is_geographic") and src.crs.is_geographic):
-            arr = base; transform = src.transform
+            lc_img = publish(lc_image.data, lc_image.mime)
+        lc_bounds = [lc_w, lc_s, lc_e, lc_n]  # [W,S,E,N] para JS
+        lc_h, lc_wid = lc_codes.shape
+        # Rejilla de códigos para el inspector: uint8 si cabe (mitad de bytes que uint16)
+        lc_codes_bytes = 1 if lc_codes.max(initial=0) < 256 else 2
+        lc_codes_url = publish(lc_codes.astype(np.uint8 if lc_codes_bytes == 1 else "<u2").tobytes(),
+                               "application/octet-stream")
+    else:
+        lc_img = None; lc_bounds = None; lc_legend = []; lc_codes_url = None; lc_codes_bytes = 2; lc_h = lc_wid = 0
+
+    # === Frames ===
+    # Con servidor local los píxeles se generan al pedirlos: el mapa se pinta sin esperar a ningún frame
+    lazy = LOCAL_SERVER is not None
+    cube_ = None
+    prepared = None
+    if LOSS_RENDER == "cube" and catalog_.same_grid():
+        if lazy:
+            e0 = catalog_.frames[0]
+            cube_ = cube.cube_header(len(labels), e0.shape[0], e0.shape[1], e0.bounds, labels)
+            cube_["url"] = LOCAL_SERVER.lazy_url(SERVER_PUBLIC_URL, routes["cube"])
         else:
-            dst_crs = "EPSG:4326"
-            T, w, h = calculate_default_transform(src.crs, dst_crs, src.width, src.height, *src.bounds)
-            arr = np.zeros((h, w, 4), dtype=np.uint8)
-            for i in range(4):
-                reproject(
-                    source=base[..., i], destination=arr[..., i],
-                    src_transform=src.transform, src_crs=src.crs,
-                    dst_transform=T, dst_crs=dst_crs,
-                    resampling=Resampling.nearest,
-                )
-            transform = T
-
-        H, W = arr.shape[:2]
-        step = int(np.ceil(np.sqrt((H * W) / max_pixels))) if H * W > max_pixels else 1
-        if step > 1:
-            arr = arr[::step, ::step, :].copy()
-            transform = rasterio.Affine(
-                transform.a * step, transform.b, transform.c,
-                transform.d, transform.e * step, transform.f
-            )
-
-        left, top = transform.c, transform.f
-        right = left + transform.a * arr.shape[1]
-        bottom = top + transform.e * arr.shape[0]
-        s, w, n, e = bottom, left, top, right
-        return arr, (s, w, n, e)
-
-@st.cache_data(show_spinner=False)
-def load_landcover_rgba_and_bounds(path, max_pixels=MAX_PIXELS):
+            cube_gz, header = data.cube(0)
+            cube_ = dict(header, url=publish(cube_gz, "application/octet-stream"))
+    elif LOSS_RENDER == "tiles" and TILE_SERVER:
+        pass   # píxeles por tesela
+    elif lazy:
+        data.frames.prefetch(0)   # el primer frame primero, luego los siguientes
+    else:
+        prepared = dict(zip(labels, data.frames.get_all(0)))
+
+    # Historial por píxel para el inspector (misma malla que el cubo): bloques perezosos o embebidos
+    hist = None
+    if catalog_.same_grid():
+        e0 = catalog_.frames[0]
+        count_scale, px_ha = history.cell_info(e0.path, data.max_pixels)
+        hist = history.history_header(e0.shape[0], e0.shape[1], e0.bounds, labels,
+                                      count_scale=count_scale, px_ha=px_ha)
+        if lazy:
+            hist["urls"] = [LOCAL_SERVER.lazy_url(SERVER_PUBLIC_URL, routes["history"][by, bx])
+                            for by in range(hist["rows"]) for bx in range(hist["cols"])]
+        else:
+            hist["urls"] = [publish(data.history_block(by, bx).data, "application/octet-stream")
+                            for by in range(hist["rows"]) for bx in range(hist["cols"])]
+
+    # Capas derivadas (acumulada hasta cada frame, A vs B): PNG generados al pedirlos o embebidos
+    derived_ = None
+    if catalog_.same_grid() and len(labels) > 1:
+        e0 = catalog_.frames[0]
+        pairs = [(a, b) for a in range(len(labels)) for b in range(a + 1, len(labels))]
+        if lazy:
+            cum_urls = [LOCAL_SERVER.lazy_url(SERVER_PUBLIC_URL, routes["cumulative"][i]) for i in range(len(labels))]
+            cmp_urls = {f"{a}-{b}": LOCAL_SERVER.lazy_url(SERVER_PUBLIC_URL, routes["compare"][a, b])
+                        for a, b in pairs}
+        else:
+            layers = data.derived()
+            cum_urls = [publish(enc.data, enc.mime) for enc in map(layers.cumulative_image, range(len(labels)))]
+            cmp_urls = {f"{a}-{b}": publish(enc.data, enc.mime)
+                        for (a, b), enc in zip(pairs, (layers.compare_image(a, b) for a, b in pairs))}
+        s_, w_, n_, e_ = e0.bounds
+        derived_ = {
+            "bounds": [w_, s_, e_, n_],
+            "cum": cum_urls,
+            "cumLabels": [f"{catalog_.frames[0].start} → {e.end}" for e in catalog_.frames],
+            "cmp": cmp_urls,
+            "legend": [{"color": c, "label": label} for _code, c, label in derived.COMPARE_CLASSES],
+        }
+
+    if LOSS_RENDER == "tiles" and TILE_SERVER and not cube_:
+        bounds = {k: TILE_SERVER.layers[_layer_name(rasters_[k], area_key)].bounds for k in labels}
+    else:
+        bounds = {k: entries[k].bounds for k in labels}   # de la cabecera (catalog.py)
+
+    # Envolvente global con frames y (si existe) land cover
+    bounds_list = [bounds[label] for label in labels]  # (S,W,N,E)
+    S = min(s for (s, w, n, e) in bounds_list)
+    W = min(w for (s, w, n, e) in bounds_list)
+    N = max(n for (s, w, n, e) in bounds_list)
+    E = max(e for (s, w, n, e) in bounds_list)
+    if lc_bounds:
+        W = min(W, lc_bounds[0]); S = min(S, lc_bounds[1])
+        E = max(E, lc_bounds[2]); N = max(N, lc_bounds[3])
+
+    # Frames para JS
+    frames = []
+    for i, label in enumerate(labels):
+        s_i, w_i, n_i, e_i = bounds[label]
+        frame = {"label": label, "bounds": [w_i, s_i, e_i, n_i]}  # [W,S,E,N]
+        if cube_:
+            frame["plane"] = i
+        elif LOSS_RENDER == "tiles" and TILE_SERVER:
+            layer = TILE_SERVER.layers[_layer_name(rasters_[label], area_key)]
+            frame["tiles"] = layer.url_template(SERVER_PUBLIC_URL)
+            frame["maxNativeZoom"] = layer.max_zoom
+        elif lazy:
+            frame["img"] = LOCAL_SERVER.lazy_url(SERVER_PUBLIC_URL, routes["frames"][label])
+        else:
+            image_i = prepared[label]["image"]
+            frame["img"] = publish(image_i.data, image_i.mime)
+            frame["bytes"] = image_i.nbytes
+        frames.append(frame)
+
+    # Secciones de datos del mapa: el frontend conserva las que ya tiene y solo se reenvían las que cambian
+    sections = {
+        "ui": {"icons": {k: ICONS[k] for k in ("prev", "play", "pause", "next")},
+               "viewDebounce": viewport.VIEWPORT_DEBOUNCE_MS},
+        "frames": {"frames": frames, "cube": cube_, "lossColor": [int(v) for v in area.palette.mask_color],
+                   "prefetchAhead": pipeline.PREFETCH_AHEAD, "globalBounds": [W, S, E, N]},
+        "landcover": {"img": lc_img, "tiles": lc_tiles, "maxz": lc_maxz, "bounds": lc_bounds, "legend": lc_legend,
+                      "codesUrl": lc_codes_url, "codesBytes": lc_codes_bytes,
+                      "gridW": lc_wid if lc_img else 0, "gridH": lc_h if lc_img else 0},
+        "history": hist,
+        "derived": derived_,
+        # Focos (componentes conexas a resolución nativa) por periodo, para la lista "ir al foco"
+        "hotspots": data.hotspots.top(hotspots.HOTSPOT_TOP),
+        "query": {"url": query_url},
+    }
+    hashes = {name: map_component.section_hash(value) for name, value in sections.items()}
+    return frame_store.FrameStore(area_key, version, labels, catalog_.entries, sections, hashes,
+                                  routes=routes, bounds=[W, S, E, N], legend=lc_legend, lc_codes=lc_codes)
+
+@st.cache_resource(show_spinner=False)
+def warm_up():
+    """
+    Hook de arranque (una vez por proceso): prepara el área pedida por la
+    primera sesión en primer plano y, con DARIEN_WARM_UP=all, las demás en un hilo.
+    """
+    keys = [AOI_KEY] + ([k for k in AOIS if k != AOI_KEY] if WARM_UP == "all" else [])
+    return frame_store.warm_up(build_store, keys)
+
+if WARM_UP != "0":
+    warm_up()
+STORE = frame_store.ensure(AOI_KEY, build_store)
+LABELS = list(STORE.labels)
+if not LABELS:
+    st.error(f"No hay máscaras de pérdida con periodo en el nombre en {AREA.loss_dir}")
+    st.stop()
+st.session_state.idx = min(st.session_state.idx, len(LABELS) - 1)   # tras una recarga puede haber menos frames
+
+# ================== RECARGA EN CALIENTE (watcher.py) ==================
+def reload_area(area_key, changes):
     """
-    TIFF categórico → RGBA por LUT + bounds (S,W,N,E) + arr códigos (H,W).
+    Aviso del watcher (en su hilo): si el área está cargada la recarga
+    reprocesando solo lo que cambió (si no, sigue sin cargarse) y marca su
+    store como viejo. El store nuevo lo construye la primera
+    sesión del área que lo note (follow_reloads), con su contexto de Streamlit.
     """
-    with rasterio.open(path) as src:
-        band = src.read(1); nodata = src.nodata
+    AOI_CACHE.refresh(AOIS[area_key], [p for paths in changes.values() for p in paths])
+    frame_store.invalidate(area_key)
 
-        if src.crs is None or (hasattr(src.crs, "is_geographic") and src.crs.is_geographic):
-            arr = band; transform = src.transform
-        else:
-            dst_crs = "EPSG:4326"
-            T, w, h = calculate_default_transform(src.crs, dst_crs, src.width, src.height, *src.bounds)
-            arr = np.empty((h, w), dtype=band.dtype)
-            reproject(
-                source=band, destination=arr,
-                src_transform=src.transform, src_crs=src.crs,
-                dst_transform=T, dst_crs=dst_crs,
-                resampling=Resampling.nearest,
-            )
-            transform = T
-
-        H, W = arr.shape
-        step = int(np.ceil(np.sqrt((H * W) / max_pixels))) if H * W > max_pixels else 1
-        if step > 1:
-            arr = arr[::step, ::step]
-            transform = rasterio.Affine(
-                transform.a * step, transform.b, transform.c,
-                transform.d, transform.e * step, transform.f
-            )
-
-        left, top = transform.c, transform.f
-        right = left + transform.a * arr.shape[1]
-        bottom = top + transform.e * arr.shape[0]
-        s, w, n, e = bottom, left, top, right
-
-        m = arr.astype(float)
-        if nodata is not None:
-            m[m == nodata] = np.nan
-        valid = ~np.isnan(m)
-
-        rgba = np.zeros((arr.shape[0], arr.shape[1], 4), dtype=np.uint8)
-        present_codes = set()
-        for code, hexcolor, _label in LANDCOVER_CLASSES:
-            mask = (arr == code) & valid
-            if np.any(mask):
-                r, g, b = _hex_to_rgb(hexcolor)
-                rgba[..., 0][mask] = r
-                rgba[..., 1][mask] = g
-                rgba[..., 2][mask] = b
-                rgba[..., 3][mask] = 255
-                present_codes.add(code)
-
-        legend_present = [
-            {"code": code, "label": label, "color": color}
-            for (code, color, label) in LANDCOVER_CLASSES
-            if code in present_codes
-        ]
-
-        return rgba, (s, w, n, e), legend_present, arr
-
-# === Land cover (opcional) ===
-if os.path.exists(LANDCOVER_PATH):
-    LC_rgba, (LC_s, LC_w, LC_n, LC_e), LC_LEGEND, LC_CODES = load_landcover_rgba_and_bounds(LANDCOVER_PATH)
-    LC_img = rgba_to_dataurl(LC_rgba)
-    LC_BOUNDS = [LC_w, LC_s, LC_e, LC_n]  # [W,S,E,N] para JS
-    LC_H, LC_WID = LC_CODES.shape
-    LC_CODES_B64 = base64.b64encode(LC_CODES.astype(np.uint16).tobytes()).decode("ascii")
-else:
-    LC_img = None; LC_BOUNDS = None; LC_LEGEND = []; LC_CODES_B64 = None; LC_H = LC_WID = 0
+@st.cache_resource(show_spinner=False)
+def start_watcher():
+    """Un watcher por proceso sobre las máscaras y el land cover de todas las áreas."""
+    return watcher.Watcher(AOIS, reload_area).start()
+
+if watcher.WATCH_INTERVAL > 0:
+    start_watcher()
+
+    @st.fragment(run_every=watcher.WATCH_INTERVAL)
+    def follow_reloads():
+        """
+        Cada sesión comprueba si su área tiene un store más nuevo (o invalidado
+        por el watcher, que se reconstruye en el rerun) y, si es así, se vuelve
+        a ejecutar: el mapa recibe solo las secciones que cambiaron.
+        """
+        latest = frame_store.get(AOI_KEY)
+        if frame_store.stale(AOI_KEY) or (latest is not None and latest.version != STORE.version):
+            st.rerun(scope="app")
+
+    follow_reloads()
 
 
 
@@ -339,496 +487,113 @@ st.markdown(
     f"""
     <div class="header-box">
       <div class="header-row">
-        <img src="{logo_data_uri}" alt="TDP Logo" />
-        <h1>Perdida de vegetación en Darién</h1>
+        <img src="{ICONS["logo"]}" alt="TDP Logo" />
+        <h1>Perdida de vegetación en {AREA.title}</h1>
       </div>
     </div>
     """,
     unsafe_allow_html=True
 )
 
-# if st.button("🔄 Refrescar land cover"):
-#     st.cache_data.clear()
-
-# ================== CARGA DE FRAMES ==================
-ALL = {}
-for k, p in RASTERS.items():
-    if not os.path.exists(p):
-        st.error(f"No existe el archivo: {p}")
-        st.stop()
-    ALL[k] = load_any_as_rgba_and_bounds(p)
-
-# Envolvente global con frames y (si existe) land cover
-bounds_list = [ALL[label][1] for label in LABELS]  # (S,W,N,E)
-S = min(s for (s, w, n, e) in bounds_list)
-W = min(w for (s, w, n, e) in bounds_list)
-N = max(n for (s, w, n, e) in bounds_list)
-E = max(e for (s, w, n, e) in bounds_list)
-if LC_BOUNDS:
-    W = min(W, LC_BOUNDS[0]); S = min(S, LC_BOUNDS[1])
-    E = max(E, LC_BOUNDS[2]); N = max(N, LC_BOUNDS[3])
-GLOBAL_BOUNDS = [[S, W], [N, E]]
-
-# Frames para JS
-frames = []
-for label in LABELS:
-    rgba_i, (s_i, w_i, n_i, e_i) = ALL[label]
-    frames.append({
-        "label": label,
-        "img": rgba_to_dataurl(rgba_i),
-        "bounds": [w_i, s_i, e_i, n_i],  # [W,S,E,N]
-    })
-
-html = f"""
-<style>
-  @font-face {{
-    font-family: 'PoppinsLocal';
-    src: local('Poppins'), url('https://fonts.gstatic.com/s/poppins/v20/pxiEyp8kv8JHgFVrFJA.ttf') format('truetype');
-    font-weight: 400;
-    font-style: normal;
-  }}
-  :root {{
-    --fs-base: clamp(12px, 2vh, 16px);
-    --fs-small: clamp(11px, 2vh, 14px);
-    --fs-h3: clamp(13px, 2vh, 16px);
-    --fs-h1: clamp(18px, 3.2vh, 28px);
-    --icon: clamp(16px, 2.2vh, 22px);
-  }}
-  html, body, #map {{
-    font-family: 'PoppinsLocal','Poppins',sans-serif !important;
-    font-size: 2vh;
-  }}
-
-  /* ===== Mapa + controles ===== */
-  .map-wrapper {{
-    display: flex; flex-direction: column; gap: 10px; width: 100%;
-  }}
-  #map {{
-    height: 100vh; width: 100%; border-radius: 12px; overflow: hidden;
-  }}
-  .controls {{
-    display:flex; align-items:center; gap:10px; flex-wrap:nowrap; width:100%;
-    position: relative; z-index: 1100; /* por encima del mapa */
-  }}
-  .controls input[type="range"] {{ flex: 1 1 auto; max-width: none; }}
-  #label {{
-    min-width: 120px; text-align: center; color: #fff;
-    font-size: 2.5vh; font-weight: 600;
-  }}
-  .player-btn {{
-    background:none;border:none;cursor:pointer;padding:4px 6px;
-    display:inline-flex;align-items:center;justify-content:center;
-    width:34px;height:34px;border-radius:8px;
-  }}
-  .player-btn:hover {{ background: rgba(255,255,255,.08); }}
-  .player-btn img {{ width:22px;height:22px;filter:invert(1);display:block; pointer-events: none; }}
-
-  /* Evitar suavizado al reamostrar */
-  .leaflet-image-layer, .leaflet-tile, .leaflet-overlay-pane img {{
-    image-rendering: pixelated !important;
-    image-rendering: crisp-edges !important;
-  }}
-
-  /* ===== Leyenda Land Cover ===== */
-  .leaflet-control.lc-legend, .leaflet-control.lc-legend * {{
-    font-family: 'PoppinsLocal','Poppins',sans-serif !important;
-    box-sizing: border-box;
-  }}
-  .leaflet-control.lc-legend {{
-    background: rgba(255,255,255,0.7) !important;
-    color: #1f2937 !important;
-    border: 1px solid rgba(0,0,0,.08);
-    border-radius: 12px;
-    padding: 10px 12px;
-    box-shadow: 0 6px 18px rgba(0,0,0,.18);
-    line-height: 1.25;
-    max-height: 300px;
-    max-width: min(50vw, 380px);
-    overflow-y: auto;
-    backdrop-filter: saturate(120%) blur(2px);
-  }}
-  .lc-legend .ttl {{
-    margin: 0 0 6px 0;
-    font-weight: 700;
-    font-size: 1.5vh !important;
-    color: #0f172a !important;
-  }}
-  .lc-legend .row {{
-    display: flex;
-    align-items: center;
-    gap: 8px;
-    margin: 4px 0;
-  }}
-  .lc-legend .swatch {{
-    width: 14px; height: 14px;
-    border-radius: 3px;
-    border: 1px solid rgba(0,0,0,.2);
-    flex-shrink: 0;
-  }}
-  .lc-legend .row span {{
-    font-size: 1.5vh !important;
-    color: #1f2937 !important;
-    white-space: nowrap;
-    overflow: hidden;
-    text-overflow: ellipsis;
-  }}
-  .lc-legend::-webkit-scrollbar {{ width: 6px; }}
-  .lc-legend::-webkit-scrollbar-thumb {{
-    background: rgba(0,0,0,.75);
-    border-radius: 3px;
-  }}
-
-  /* ===== Panel flotante dentro del mapa (Leaflet control) ===== */
-  .panel-control {{
-    background: rgba(255,255,255,0.7);
-    border: 1px solid rgba(0,0,0,.08);
-    border-radius: 12px;
-    padding: 12px;
-    box-shadow: 0 6px 18px rgba(0,0,0,.18);
-    min-width: 50vh;
-    font-size: 2.5vh;
-    backdrop-filter: saturate(120%) blur(2px);
-  }}
-  /* Estilo del número de opacidad */
-  #loss-opacity-val {{
-    font-size:2.5vh;     /* ← tamaño relativo; puedes usar 14px, 1.2em, etc. */
-    color: #0f172a;       /* color del texto */
-    display: inline-block;
-    margin-top: 4px;
-  }}
-  .panel-control h3 {{
-    margin: 0 0 8px 0;
-    font-size: 2.5vh;
-    font-weight: 600;
-    color: #1f2937;
-  }}
-  .panel-control .section {{ margin-bottom: 10px; }}
-  .panel-control .section:last-child {{ margin-bottom: 0; }}
-  .panel-control .control-row {{
-    display: flex;
-    align-items: center;
-    gap: 8px;
-    cursor: pointer;
-  }}
-  .panel-control input[type="range"] {{
-    width: 100%;
-  }}
-
-  /* Inspector LC centrado abajo */
-  .lc-info {{
-    background: rgba(255,255,255,0.7);
-    border: 1px solid rgba(0,0,0,.08);
-    border-radius: 10px;
-    padding: 6px 8px;
-    box-shadow: 0 2px 6px rgba(0,0,0,.15);
-    font-family: 'PoppinsLocal','Poppins',sans-serif;
-    font-size: 2.5vh;
-    pointer-events: none;
-    width: 100%;
-    display: flex;
-    justify-content: center;
-    margin-bottom: 8px;
-  }}
-  .lc-info .sw {{
-    display:inline-block; width:12px; height:12px;
-    border:1px solid rgba(0,0,0,.25);
-    border-radius: 3px; vertical-align: -2px; margin-right: 6px;
-  }}
-</style>
-
-<div class="map-wrapper">
-  <div id="map"></div>
-
-  <!-- Controles de animación (debajo del mapa) -->
-  <div class="controls">
-    <button class="player-btn" id="prev-btn" type="button" title="Anterior">
-      <img src="{icon_prev}" alt="Anterior" width="22" height="22">
-    </button>
-
-    <button class="player-btn" id="toggle-btn" type="button" title="Play/Pause">
-      <img id="toggle-icon" src="{icon_play}" alt="Play" width="22" height="22">
-    </button>
-
-    <button class="player-btn" id="next-btn" type="button" title="Siguiente">
-      <img src="{icon_next}" alt="Siguiente" width="22" height="22">
-    </button>
-
-    <input id="slider" type="range" min="0" max="{len(frames)-1}" step="1" value="{st.session_state.idx}" style="width:100%;">
-    <span id="label"></span>
-  </div>
-</div>
-
-<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
-<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
-<script>
-// === Datos desde Python ===
-const FRAMES = {json.dumps(frames, separators=(',',':'))};
-const GLOBAL_BOUNDS = [[{S}, {W}], [{N}, {E}]];
-const LC_IMG = {json.dumps(LC_img) if LC_img else 'null'};
-const LC_BOUNDS = {json.dumps(LC_BOUNDS) if LC_BOUNDS else 'null'};
-const LC_LEGEND = {json.dumps(LC_LEGEND, ensure_ascii=False)};
-const LC_CODES_B64 = {json.dumps(LC_CODES_B64) if LC_CODES_B64 else 'null'};
-const LC_GRID_W = {LC_WID if LC_img else 0};
-const LC_GRID_H = {LC_H if LC_img else 0};
-
-function bToLeaflet(b) {{ return [[b[1], b[0]], [b[3], b[2]]]; }}
-
-let idx = {st.session_state.idx};
-let playing = false;
-let timer = null;
-
-// Mapa
-const map = L.map('map', {{ preferCanvas: true, zoomSnap: 1, zoomDelta: 1 }});
-L.tileLayer('https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{{z}}/{{y}}/{{x}}', {{
-  maxZoom: 19, crossOrigin: true
-}}).addTo(map);
-map.createPane('labels');
-map.getPane('labels').style.zIndex = 650;
-map.getPane('labels').style.pointerEvents='none';
-L.tileLayer('https://services.arcgisonline.com/ArcGIS/rest/services/Reference/World_Boundaries_and_Places/MapServer/tile/{{z}}/{{y}}/{{x}}', {{
-  maxZoom:19, pane:'labels', crossOrigin:true
-}}).addTo(map);
-
-map.createPane('lcPane');   map.getPane('lcPane').style.zIndex = 350;
-map.createPane('lossPane'); map.getPane('lossPane').style.zIndex = 400;
-map.removeControl(map.attributionControl);
-
-// Overlays
-let overlay = L.imageOverlay(FRAMES[idx].img, bToLeaflet(FRAMES[idx].bounds), {{
-  opacity:1.0, interactive:false, crossOrigin:true, pane:'lossPane'
-}}).addTo(map);
-let rect = L.rectangle(bToLeaflet(FRAMES[idx].bounds), {{
-  color:'#fff', weight:3, fill:false, pane:'lossPane'
-}}).addTo(map);
-map.fitBounds(GLOBAL_BOUNDS, {{ padding:[10,10] }});
-
-let lcLayer = null;
-if (LC_IMG && LC_BOUNDS) {{
-  lcLayer = L.imageOverlay(LC_IMG, bToLeaflet(LC_BOUNDS), {{
-    opacity:1.0, interactive:false, crossOrigin:true, pane:'lcPane'
-  }});
-}}
+if len(AOIS) > 1:
+    keys = list(AOIS)
+    choice = st.selectbox("Área", keys, index=keys.index(AOI_KEY),
+                          format_func=lambda k: AOIS[k].title, label_visibility="collapsed")
+    if choice != AOI_KEY:
+        st.query_params["aoi"] = choice
+        st.rerun()
 
-// ===== Leyenda LC =====
-let lcLegendCtrl = null;
-function createLcLegend() {{
-  const ctrl = L.control({{ position: 'bottomright' }});
-  ctrl.onAdd = function () {{
-    const div = L.DomUtil.create('div', 'leaflet-control lc-legend');
-    const rows = (Array.isArray(LC_LEGEND) ? LC_LEGEND : []).map(item =>
-      `<div class="row"><span class="swatch" style="background:${{item.color}}"></span><span>${{item.code}} – ${{item.label}}</span></div>`
-    ).join('');
-    div.innerHTML = `<div class="ttl">Land cover</div>${{rows}}`;
-    return div;
-  }};
-  return ctrl;
-}}
-
-// ===== Inspector LC centrado abajo =====
-function decodeUint16FromBase64(b64) {{
-  if (!b64) return null;
-  const bin = atob(b64);
-  const buf = new ArrayBuffer(bin.length);
-  const view = new Uint8Array(buf);
-  for (let i = 0; i < bin.length; i++) view[i] = bin.charCodeAt(i);
-  return new Uint16Array(buf);
-}}
-const LC_CODES = decodeUint16FromBase64(LC_CODES_B64);
-const LC_LOOKUP = (() => {{
-  const m = {{}};
-  (Array.isArray(LC_LEGEND) ? LC_LEGEND : []).forEach(it => {{ m[it.code] = {{label: it.label, color: it.color}}; }});
-  return m;
-}})();
-function lcLatLngToRowCol(lat, lng) {{
-  if (!LC_BOUNDS || !LC_GRID_W || !LC_GRID_H) return null;
-  const W = LC_BOUNDS[0], S = LC_BOUNDS[1], E = LC_BOUNDS[2], N = LC_BOUNDS[3];
-  if (lng < W || lng > E || lat < S || lat > N) return null;
-  const col = Math.floor((lng - W) / (E - W) * LC_GRID_W);
-  const row = Math.floor((N - lat) / (N - S) * LC_GRID_H);
-  if (col < 0 || col >= LC_GRID_W || row < 0 || row >= LC_GRID_H) return null;
-  return {{row, col}};
-}}
-const LcInfo = L.Control.extend({{
-  options: {{ position: 'bottomleft' }},
-  onAdd: function(map) {{
-    const outer = L.DomUtil.create('div', 'lc-info-outer');
-    const inner = L.DomUtil.create('div', 'lc-info', outer);
-    inner.innerHTML = '<div class="lc-info-inner">Pasa el cursor sobre Land cover</div>';
-    L.DomEvent.disableClickPropagation(inner);
-    L.DomEvent.disableScrollPropagation(inner);
-    this._inner = inner;
-    return outer;
-  }},
-  getContainerEl: function() {{ return this._inner; }}
-}});
-const lcInfoCtrl = new LcInfo().addTo(map);
-let _lastShown = '';
-function updateLcInfo(latlng) {{
-  if (!LC_CODES) {{
-    lcInfoCtrl.getContainerEl().innerHTML = '<div class="lc-info-inner">Land cover no disponible</div>';
-    return;
-  }}
-  if (!lcLayer || !map.hasLayer(lcLayer)) {{
-    lcInfoCtrl.getContainerEl().innerHTML = '<div class="lc-info-inner">Land cover apagado</div>';
-    return;
-  }}
-  const rc = lcLatLngToRowCol(latlng.lat, latlng.lng);
-  if (!rc) {{
-    lcInfoCtrl.getContainerEl().innerHTML = '<div class="lc-info-inner">Fuera del Land cover</div>';
-    return;
-  }}
-  const idx1D = rc.row * LC_GRID_W + rc.col;
-  const code = LC_CODES[idx1D];
-  const meta = LC_LOOKUP[code];
-  const html = meta
-    ? `<div class="lc-info-inner"><span class="sw" style="background:${{meta.color}}"></span>${{code}} — ${{meta.label}}</div>`
-    : `<div class="lc-info-inner">Código ${{code}}</div>`;
-  if (html !== _lastShown) {{
-    lcInfoCtrl.getContainerEl().innerHTML = html;
-    _lastShown = html;
-  }}
-}}
-map.on('mousemove', (e) => updateLcInfo(e.latlng));
-
-// ===== Panel flotante dentro del mapa (Leaflet Control) =====
-let lossOpacityValEl = null;
-const PanelControl = L.Control.extend({{
-  options: {{ position: 'topright' }},
-  onAdd: function(map) {{
-    const div = L.DomUtil.create('div', 'panel-control');
-    div.innerHTML = `
-      <div class="section">
-        <h3>Capas</h3>
-        <label class="control-row">
-          <input id="lc-toggle" type="checkbox"> <span>Land cover</span>
-        </label>
-      </div>
-      <div class="section">
-        <h3>Opacidad pérdida de vegetación</h3>
-        <input id="loss-opacity" type="range" min="0" max="1" step="0.05" value="1">
-        <div><small id="loss-opacity-val">100%</small></div>
-      </div>
-    `;
-    L.DomEvent.disableClickPropagation(div);
-    L.DomEvent.disableScrollPropagation(div);
-
-    const lcToggle = div.querySelector('#lc-toggle');
-    const lossOpacityEl = div.querySelector('#loss-opacity');
-    lossOpacityValEl = div.querySelector('#loss-opacity-val');
-
-    if (lcToggle) {{
-      lcToggle.addEventListener('change', () => {{
-        if (!lcLayer) return;
-        if (lcToggle.checked) {{
-          lcLayer.addTo(map);
-          if (!lcLegendCtrl && Array.isArray(LC_LEGEND) && LC_LEGEND.length > 0) {{
-            lcLegendCtrl = createLcLegend();
-            lcLegendCtrl.addTo(map);
-          }}
-        }} else {{
-          map.removeLayer(lcLayer);
-          if (lcLegendCtrl) {{
-            map.removeControl(lcLegendCtrl);
-            lcLegendCtrl = null;
-          }}
-        }}
-      }});
-    }}
-
-    if (lossOpacityEl) {{
-      const setLossOpacity = (v) => {{
-        overlay.setOpacity(v);
-        if (rect) rect.setStyle({{opacity: Math.max(0.3, v)}});
-        if (lossOpacityValEl) lossOpacityValEl.textContent = Math.round(v*100) + '%';
-      }};
-      setLossOpacity(parseFloat(lossOpacityEl.value || '1'));
-      lossOpacityEl.addEventListener('input', (e) => setLossOpacity(parseFloat(e.target.value)));
-    }}
-
-    return div;
-  }}
-}});
-new PanelControl().addTo(map);
-
-// ===== Animación (controles debajo del mapa) =====
-const labelEl  = document.getElementById('label');
-const sliderEl = document.getElementById('slider');
-const prevBtn  = document.getElementById('prev-btn');
-const nextBtn  = document.getElementById('next-btn');
-const toggleBtn= document.getElementById('toggle-btn');
-const toggleIcon= document.getElementById('toggle-icon');
-
-
-function show(i) {{
-  idx = ((i % FRAMES.length) + FRAMES.length) % FRAMES.length;
-  overlay.setUrl(FRAMES[idx].img);
-  const bnds = bToLeaflet(FRAMES[idx].bounds);
-  overlay.setBounds(bnds);
-  rect.setBounds(bnds);
-  sliderEl.value = idx;
-  labelEl.textContent = FRAMES[idx].label;
-}}
-show(idx);
-
-function toggle() {{
-  if (!playing) {{
-    playing = true;
-    toggleIcon.src = "{icon_pause}";
-    timer = setInterval(() => show(idx + 1), {int(st.session_state.interval * 1000)});
-  }} else {{
-    playing = false;
-    toggleIcon.src = "{icon_play}";
-    clearInterval(timer);
-  }}
-}}
-prevBtn.onclick   = (e) => {{ e.preventDefault(); show(idx - 1); }};
-nextBtn.onclick   = (e) => {{ e.preventDefault(); show(idx + 1); }};
-sliderEl.oninput  = (e) => {{ show(parseInt(e.target.value)); }};
-toggleBtn.onclick = (e) => {{ e.preventDefault(); toggle(); }};  // ← ¡IMPRESCINDIBLE!
-
-// ===== Redimensionado fiable del iframe + mapa (un solo bloque) =====
-function totalOuterHeight(sel){{
-  const el = document.querySelector(sel);
-  if(!el) return 0;
-  const cs = getComputedStyle(el);
-  return el.offsetHeight + parseFloat(cs.marginTop||0) + parseFloat(cs.marginBottom||0);
-}}
-function setMapHeight(){{
-  const headerH  = totalOuterHeight('.header-row');
-  const controlsH= totalOuterHeight('.controls');
-  const padding  = 24;
-  const available = Math.max(380, window.innerHeight - (headerH + controlsH + padding));
-  const mapDiv = document.getElementById('map');
-  if (mapDiv) mapDiv.style.height = available + 'px';
-  if (typeof map !== 'undefined' && map.invalidateSize) map.invalidateSize(true);
-}}
-function getDocHeight(){{
-  const b = document.body, d = document.documentElement;
-  return Math.max(
-    b.scrollHeight, b.offsetHeight, b.getBoundingClientRect().height,
-    d.clientHeight, d.scrollHeight, d.offsetHeight, d.getBoundingClientRect().height
-  );
-}}
-function postResize(h){{
-  if (window.parent && window.parent.Streamlit && window.parent.Streamlit.setFrameHeight) {{
-    window.parent.Streamlit.setFrameHeight(h, {{ debounce: 0 }});
-  }}
-  if (window.parent && window.parent.postMessage) {{
-    window.parent.postMessage({{ type: 'streamlit:setFrameHeight', height: h }}, '*');
-  }}
-}}
-function resizeEverything(){{
-  setMapHeight();
-  requestAnimationFrame(()=>postResize(getDocHeight()));
-}}
-
-window.addEventListener('load',  resizeEverything);
-window.addEventListener('resize', resizeEverything);
-try {{ new ResizeObserver(()=>resizeEverything()).observe(document.body); }} catch(e) {{}}
-setTimeout(resizeEverything, 100);
-setTimeout(resizeEverything, 350);
-setTimeout(resizeEverything, 900);
-</script>
-"""
-
-components.html(html, height=600, scrolling=False)
+# if st.button("🔄 Refrescar land cover"):
+#     st.cache_data.clear()   # la caché en disco se invalida sola (clave = hash del fichero)
+
+def loss_chart(df, labels):
+    """Barras apiladas de hectáreas perdidas por periodo y clase de land cover."""
+    df = df[df["periodo"].isin(labels) & (df["hectareas"] > 0)]
+    order = df.groupby("clase")["hectareas"].sum().sort_values(ascending=False).index
+    fig = go.Figure()
+    for clase in order:
+        d = df[df["clase"] == clase].set_index("periodo").reindex(labels)
+        fig.add_trace(go.Bar(
+            x=labels, y=d["hectareas"].fillna(0), name=clase,
+            marker_color=d["color"].dropna().iloc[0],
+            hovertemplate="%{x}<br>" + clase + ": %{y:,.1f} ha<extra></extra>",
+        ))
+    fig.update_layout(
+        barmode="stack", height=520, margin=dict(l=0, r=0, t=30, b=0),
+        title=dict(text="Hectáreas perdidas por clase", font=dict(size=14, color="#fff")),
+        plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)",
+        font=dict(color="#fff", size=11),
+        legend=dict(orientation="h", yanchor="top", y=-0.15, font=dict(size=10)),
+        xaxis=dict(tickangle=-30), yaxis=dict(title=None, ticksuffix=" ha", gridcolor="rgba(255,255,255,.2)"),
+    )
+    return fig
+
+# ================== VISTA A RESOLUCIÓN NATIVA (viewport.py) ==================
+@st.cache_resource(show_spinner=False)
+def get_viewport_cache():
+    """Ventanas recientes a resolución nativa, compartidas por todas las sesiones."""
+    return viewport.ViewportCache()
+
+def viewport_section(view, idx):
+    """
+    Recortes nativos de la vista que devolvió el mapa (frame idx y land cover)
+    o None si las capas globales ya bastan. Las capas por teselas no lo necesitan.
+    """
+    if not view:
+        return None
+    cache = get_viewport_cache()
+    out = {"idx": idx, "loss": None, "lc": None}
+    layers = []
+    if "tiles" not in STORE.sections["frames"]["frames"][idx]:
+        layers.append(("loss", STORE.entry(LABELS[idx]).path, "mask"))
+    if STORE.lc_codes is not None and not STORE.sections["landcover"]["tiles"]:
+        layers.append(("lc", AREA.landcover, "landcover"))
+    for name, path, kind in layers:
+        item = cache.get(path, kind, view, AREA.palette)
+        if item is not None:
+            out[name] = {"img": publish(item["image"].data, item["image"].mime), "bounds": item["bounds"]}
+    return out if out["loss"] or out["lc"] else None
+
+VIEWPORT = viewport_section(_map_value.get("view") if _map_value.get("area") == AOI_KEY else None,
+                            min(st.session_state.idx, len(LABELS) - 1))
+
+# ================== MAPA (componente bidireccional, map_component.py) ==================
+MAP_STATE = {"area": AOI_KEY, "idx": st.session_state.idx, "interval": int(st.session_state.interval * 1000)}
+
+
+def render_map():
+    # La sección "viewport" cambia con la vista: el frontend la aplica sin reconstruir el mapa
+    sections = dict(STORE.sections, viewport=VIEWPORT)
+    hashes = dict(STORE.hashes, viewport=map_component.section_hash(VIEWPORT))
+    return map_component.leaflet_map(sections, MAP_STATE, key="map", hashes=hashes)
+
+
+if SHOW_STATS and STORE.lc_codes is not None:
+    col_map, col_stats = st.columns([3, 1])
+    with col_map:
+        render_map()
+    with col_stats:
+        with st.spinner("Calculando hectáreas…"):
+            fig = STORE.memo("loss_chart", lambda: loss_chart(AOI_CACHE.get(AREA).loss_stats(), LABELS))
+        st.plotly_chart(fig, config={"displayModeBar": False})
+else:
+    render_map()
+
+# ================== EXPORTACIÓN (polígonos) ==================
+with st.expander("Exportar pérdida como polígonos (GeoJSONSeq)"):
+    export_labels = [e.label for e in STORE.entries]
+    current = LABELS[st.session_state.idx] if st.session_state.idx < len(LABELS) else export_labels[0]
+    export_label = st.selectbox("Periodo", export_labels, index=export_labels.index(current), key="export_label")
+    export_entry = STORE.entry(export_label)
+    st.caption("Un polígono por línea (EPSG:4326) con periodo, clase de land cover dominante y hectáreas. "
+               "La primera descarga de cada periodo se genera al pedirla.")
+    if LOCAL_SERVER:
+        # Servida desde disco por trozos por el servidor local
+        st.link_button("Descargar", LOCAL_SERVER.file_url(SERVER_PUBLIC_URL, STORE.routes["exports"][export_label]))
+    else:
+        def export_bytes(label=export_label) -> bytes:
+            with open(AOI_CACHE.get(AREA).export(label), "rb") as f:
+                return f.read()
+
+        st.download_button("Descargar", data=export_bytes,
+                           file_name=export.download_name(export_entry), mime=export.EXPORT_MIME)
@@ -0,0 +1,72 @@
+# cube.py
+"""
+Cubo multianual de pérdida empaquetado en bits: un plano por periodo, un bit por
+píxel (np.packbits a lo largo de las columnas). El visor lo descarga una sola
+vez y pinta en un canvas cualquier frame o combinación de periodos, sin más
+peticiones ni decodificación de PNG al cambiar de frame.
+
+Formato del buffer (antes de gzip): uint8 (n_frames, H, ceil(W/8)), bit más
+significativo = columna más a la izquierda de cada grupo de 8.
+"""
+import gzip
+
+import numpy as np
+
+import pipeline
+from rasters import MAX_PIXELS
+
+
+def pack_cube(indices) -> np.ndarray:
+    """Lista de máscaras (H,W) sobre la misma malla → cubo (n, H, ceil(W/8)) uint8."""
+    shapes = {np.shape(m) for m in indices}
+    if len(shapes) != 1:
+        raise ValueError(f"Las máscaras no comparten malla: {sorted(shapes)}")
+    return np.packbits(np.stack([np.asarray(m, dtype=bool) for m in indices]), axis=-1)
+
+
+def unpack_frames(cube: np.ndarray, width: int, frames) -> np.ndarray:
+    """Máscara bool (H,W) con la unión (OR) de los periodos `frames` del cubo."""
+    packed = np.bitwise_or.reduce(cube[list(frames)], axis=0)
+    return np.unpackbits(packed, axis=-1, count=width).astype(bool)
+
+
+def load_loss_cube(paths, max_pixels: int = MAX_PIXELS, loader: "pipeline.FrameLoader" = None, start: int = 0):
+    """
+    Cubo de los frames `paths` (en orden) a partir de los índices cacheados,
+    preparados en paralelo (pipeline.py). Con loader se reutilizan sus frames
+    (loader.paths debe ser paths) y se encolan empezando por el frame start.
+    Devuelve (cube, bounds (S,W,N,E), ancho en píxeles).
+    """
+    if loader is not None:
+        arts = loader.get_all(start)
+    else:
+        arts, _report = pipeline.prepare_frames(paths, max_pixels)
+    if any(a["index"] is None for a in arts):
+        raise ValueError("El cubo solo admite máscaras de 1 banda")
+    bounds = {tuple(np.round(a["bounds"], 9)) for a in arts}
+    if len(bounds) != 1:
+        raise ValueError("Las máscaras no comparten bounds; no se pueden apilar")
+    cube = pack_cube([a["index"] for a in arts])
+    return cube, arts[0]["bounds"], arts[0]["index"].shape[1]
+
+
+def cube_header(n: int, height: int, width: int, bounds, labels) -> dict:
+    """
+    Cabecera JSON-serializable con la geometría necesaria para desempaquetar
+    el cubo en el navegador. bounds en (S,W,N,E).
+    """
+    s, w, nn, e = bounds
+    return {
+        "n": int(n), "h": int(height), "w": int(width), "rowBytes": -(-int(width) // 8),
+        "bounds": [w, s, e, nn],   # [W,S,E,N] como el resto de capas JS
+        "labels": list(labels),
+        "encoding": "gzip",
+    }
+
+
+def cube_payload(cube: np.ndarray, width: int, bounds, labels) -> tuple:
+    """(bytes gzip del cubo, cabecera) para el visor."""
+    n, h, _row_bytes = cube.shape
+    header = cube_header(n, h, width, bounds, labels)
+    return gzip.compress(np.ascontiguousarray(cube).tobytes(), compresslevel=6), header
+
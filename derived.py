@@ -0,0 +1,182 @@
+# derived.py
+"""
+Capas derivadas de los frames anuales, calculadas con álgebra de bits sobre el
+cubo empaquetado (cube.py) y entregadas ya codificadas como PNG de paleta:
+    acumulada   pérdida de cualquier periodo hasta el frame i: OR prefijo de
+                los planos (np.bitwise_or.accumulate), calculado una vez
+    comparación A vs B (A anterior a B), una imagen de 2 bits con
+                    nueva        pérdida en B y no en A
+                    persistente  pérdida en A y en B
+                    recuperada   pérdida en A y no en B
+                cada par se calcula y codifica una vez y queda en memoria
+Todas las operaciones trabajan sobre filas de bytes (8 píxeles por byte) y
+solo se desempaqueta el resultado que se codifica.
+
+check_composite compara la acumulada final con una máscara compuesta del
+mismo rango (p. ej. Mask_Loss_2020_2025_adaptive.tif) sobre la misma malla.
+
+Uso:
+    python derived.py [--composite mask_loss/Mask_Loss_2020_2025_adaptive.tif]
+"""
+import argparse
+import os
+import threading
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+import artifact_cache
+import catalog
+import cube
+import encoders
+import shared_store
+from rasters import DEFAULT_PALETTE, MAX_PIXELS, Palette
+
+if TYPE_CHECKING:
+    import pipeline
+
+COMPARE_NEW, COMPARE_PERSISTENT, COMPARE_RECOVERED = 1, 2, 3
+COMPARE_CLASSES = [
+    (COMPARE_NEW, "#ef4444", "Nueva"),
+    (COMPARE_PERSISTENT, "#f59e0b", "Persistente"),
+    (COMPARE_RECOVERED, "#22c55e", "Recuperada"),
+]
+
+
+def compare_palette() -> np.ndarray:
+    """Paleta RGBA (4,4): 0 transparente + las tres clases de comparación."""
+    pal = np.zeros((4, 4), dtype=np.uint8)
+    for code, hex_color, _label in COMPARE_CLASSES:
+        h = hex_color.lstrip("#")
+        pal[code] = [int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16), 255]
+    return pal
+
+
+def compare_planes(packed: np.ndarray, a: int, b: int) -> np.ndarray:
+    """Planos empaquetados (3, H, rowBytes): nueva, persistente, recuperada de A=a frente a B=b."""
+    pa, pb = packed[a], packed[b]
+    return np.stack([pb & ~pa, pa & pb, pa & ~pb])
+
+
+def compare_index(planes: np.ndarray, width: int) -> np.ndarray:
+    """Planos de compare_planes → índice uint8 (H,W) con los códigos COMPARE_* (0 sin pérdida)."""
+    bits = np.unpackbits(planes, axis=-1, count=width)
+    # Las tres clases son disjuntas: el código es la posición del bit encendido
+    return (bits[0] * COMPARE_NEW + bits[1] * COMPARE_PERSISTENT + bits[2] * COMPARE_RECOVERED).astype(np.uint8)
+
+
+class DerivedLayers:
+    """Acumuladas y comparaciones de un cubo de frames; cada imagen se codifica una sola vez."""
+
+    def __init__(self, packed: np.ndarray, width: int, bounds, entries,
+                 opts: "encoders.EncoderOptions" = encoders.DEFAULT_OPTIONS, palette: Palette = DEFAULT_PALETTE,
+                 cumulative: np.ndarray = None, shared: "shared_store.SharedStore" = None, shared_prefix: str = ""):
+        """cumulative: OR prefijo ya calculado; shared: las imágenes se publican en el almacén compartido."""
+        self.packed = packed
+        self.width = int(width)
+        self.bounds = tuple(bounds)
+        self.entries = list(entries)
+        self.opts = opts
+        self.palette = palette
+        if cumulative is None:
+            cumulative = np.bitwise_or.accumulate(packed, axis=0)   # OR prefijo, una vez
+        self.cumulative = cumulative
+        self.shared = shared
+        self.shared_prefix = shared_prefix
+        self._images = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frames(cls, entries, max_pixels: int = MAX_PIXELS, loader: "pipeline.FrameLoader" = None,
+                    palette: Palette = DEFAULT_PALETTE) -> "DerivedLayers":
+        """A partir de los índices cacheados de los frames (los de loader si se pasa)."""
+        packed, bounds, width = cube.load_loss_cube([e.path for e in entries], max_pixels, loader)
+        return cls(packed, width, bounds, entries, palette=palette)
+
+    def cumulative_label(self, i: int) -> str:
+        return f"{self.entries[0].start} → {self.entries[i].end}"
+
+    def cumulative_mask(self, i: int) -> np.ndarray:
+        return np.unpackbits(self.cumulative[i], axis=-1, count=self.width)
+
+    def _memo(self, key, build) -> "encoders.Encoded":
+        with self._lock:
+            enc = self._images.get(key)
+        if enc is None:
+            if self.shared is not None:
+                enc = self.shared.encoded("-".join(map(str, (self.shared_prefix,) + key)), build)
+            else:
+                enc = build()
+            with self._lock:
+                enc = self._images.setdefault(key, enc)
+        return enc
+
+    def cumulative_image(self, i: int) -> "encoders.Encoded":
+        """PNG de 1 bit con la pérdida acumulada hasta el frame i."""
+        return self._memo(("cum", i), lambda: encoders.encode_mask(self.cumulative_mask(i), self.opts, self.palette))
+
+    def compare_image(self, a: int, b: int) -> "encoders.Encoded":
+        """PNG de 2 bits de la comparación A=a vs B=b (a < b)."""
+        if not 0 <= a < b < len(self.entries):
+            raise ValueError(f"Comparación no válida: {a} vs {b} (A debe ser anterior a B)")
+        return self._memo(("cmp", a, b), lambda: encoders.encode_indexed(
+            compare_index(compare_planes(self.packed, a, b), self.width), compare_palette(), self.opts))
+
+    def compare_counts(self, a: int, b: int) -> dict:
+        """Píxeles de cada clase de la comparación (para la leyenda)."""
+        planes = compare_planes(self.packed, a, b)
+        return {label: int(np.unpackbits(p, axis=-1, count=self.width).sum(dtype=np.int64))
+                for p, (_code, _hex, label) in zip(planes, COMPARE_CLASSES)}
+
+    def nbytes(self) -> int:
+        """Bytes en RAM (lo adjuntado del almacén compartido no cuenta)."""
+        arrays = sum(a.nbytes for a in (self.packed, self.cumulative) if not isinstance(a, np.memmap))
+        return int(arrays + sum(shared_store.ram_bytes(enc.data) for enc in list(self._images.values())))
+
+
+def check_composite(layers: DerivedLayers, composite_path: str, max_pixels: int = MAX_PIXELS) -> dict:
+    """
+    Acumulada final frente a la máscara compuesta composite_path (misma malla):
+    píxeles de cada una, comunes, exclusivos, IoU y fracción de la compuesta
+    cubierta por la acumulada.
+    """
+    art = artifact_cache.load_frame(composite_path, max_pixels)
+    comp = np.asarray(art["index"], dtype=bool)
+    cum = layers.cumulative_mask(len(layers.entries) - 1).astype(bool)
+    if comp.shape != cum.shape or not np.allclose(art["bounds"], layers.bounds):
+        raise ValueError("La compuesta no comparte malla con los frames")
+    both = int((cum & comp).sum())
+    n_cum, n_comp = int(cum.sum()), int(comp.sum())
+    union = n_cum + n_comp - both
+    return {"acumulada": n_cum, "compuesta": n_comp, "comunes": both,
+            "solo_acumulada": n_cum - both, "solo_compuesta": n_comp - both,
+            "iou": both / union if union else 1.0, "cobertura": both / n_comp if n_comp else 1.0}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Capas acumuladas y comparaciones A vs B de los frames.")
+    ap.add_argument("root", nargs="?", default=catalog.LOSS_DIR)
+    ap.add_argument("--max-pixels", type=int, default=MAX_PIXELS)
+    ap.add_argument("--composite", help="máscara compuesta con la que contrastar la acumulada final")
+    args = ap.parse_args(argv)
+    cat = catalog.Catalog.scan(args.root, args.max_pixels)
+    layers = DerivedLayers.from_frames(cat.frames, args.max_pixels)
+    for i in range(len(layers.entries)):
+        enc = layers.cumulative_image(i)
+        print(f"acumulada {layers.cumulative_label(i):<14}{int(layers.cumulative_mask(i).sum()):>10} px  "
+              f"{len(enc.data) / 1024:8.1f} KB")
+    if len(layers.entries) > 1:
+        a, b = 0, len(layers.entries) - 1
+        enc = layers.compare_image(a, b)
+        print(f"{layers.entries[a].label} vs {layers.entries[b].label}: {layers.compare_counts(a, b)} "
+              f"({len(enc.data) / 1024:.1f} KB)")
+    composite = args.composite or next((e.path for e in cat.composites
+                                        if (e.start, e.end) == (cat.frames[0].start, cat.frames[-1].end)), None)
+    if composite and os.path.exists(composite):
+        r = check_composite(layers, composite, args.max_pixels)
+        print(f"acumulada final vs {os.path.basename(composite)}: IoU {r['iou']:.3f}, "
+              f"cobertura de la compuesta {r['cobertura']:.1%} ({r})")
+
+
+if __name__ == "__main__":
+    main()
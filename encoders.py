@@ -0,0 +1,186 @@
+# encoders.py
+"""
+Codificación compacta de las capas del visor. Cada capa se escribe con la
+representación más barata que la describe sin pérdida:
+    máscaras de pérdida → PNG de paleta de 1 bit (índice 0 transparente)
+    land cover          → PNG indexado (≤ 256 colores, índice 0 transparente)
+    RGB(A) genérico     → PNG RGBA
+WebP sin pérdida es opcional (DARIEN_IMAGE_FORMAT=webp).
+
+Uso (comparar bytes por frame antes/después):
+    python encoders.py [paths...]
+"""
+import argparse
+import base64
+import functools
+import glob
+import io
+import os
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+import rasters
+from rasters import DEFAULT_PALETTE, MASK_PALETTE, MAX_PIXELS, Palette, _hex_to_rgb, as_code_array, code_nodata
+
+IMAGE_FORMAT = os.environ.get("DARIEN_IMAGE_FORMAT", "png")          # png | webp
+PNG_COMPRESS_LEVEL = int(os.environ.get("DARIEN_PNG_LEVEL", "9"))    # zlib 0-9
+PNG_OPTIMIZE = os.environ.get("DARIEN_PNG_OPTIMIZE", "0") == "1"     # búsqueda extra de filtros/zlib
+WEBP_METHOD = int(os.environ.get("DARIEN_WEBP_METHOD", "4"))         # 0 rápido … 6 (≈20x más lento, <1% menos)
+
+MIMES = {"png": "image/png", "webp": "image/webp"}
+
+
+@dataclass(frozen=True)
+class EncoderOptions:
+    fmt: str = IMAGE_FORMAT
+    compress_level: int = PNG_COMPRESS_LEVEL
+    optimize: bool = PNG_OPTIMIZE
+    webp_method: int = WEBP_METHOD
+
+    def __post_init__(self):
+        if self.fmt not in MIMES:
+            raise ValueError(f"Formato de imagen no soportado: {self.fmt}")
+
+
+DEFAULT_OPTIONS = EncoderOptions()
+
+
+@dataclass(frozen=True)
+class Encoded:
+    data: bytes
+    mime: str
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+    def dataurl(self) -> str:
+        return f"data:{self.mime};base64," + base64.b64encode(self.data).decode("ascii")
+
+
+# ================== PALETAS ==================
+@functools.lru_cache(maxsize=8)
+def landcover_palette(palette: Palette = DEFAULT_PALETTE) -> np.ndarray:
+    """Paleta RGBA indexada: 0 transparente, i+1 → i-ésima clase de palette."""
+    classes = palette.landcover_classes
+    if len(classes) > 255:
+        raise ValueError("Una paleta PNG admite como máximo 255 clases (más el transparente)")
+    pal = np.zeros((len(classes) + 1, 4), dtype=np.uint8)
+    for i, (_code, hexcolor, _label) in enumerate(classes, start=1):
+        pal[i] = (*_hex_to_rgb(hexcolor), 255)
+    pal.setflags(write=False)
+    return pal
+
+
+LANDCOVER_PALETTE = landcover_palette()
+
+
+def landcover_index_lut(size: int = 256, nodata=None, palette: Palette = DEFAULT_PALETTE) -> np.ndarray:
+    """LUT código → índice de landcover_palette(palette) (0 para nodata y códigos sin clase)."""
+    lut = np.zeros(size, dtype=np.uint8)
+    for i, (code, _hex, _label) in enumerate(palette.landcover_classes, start=1):
+        if code < size:
+            lut[code] = i
+    nd = code_nodata(nodata)
+    if nd is not None and nd < size:
+        lut[nd] = 0
+    return lut
+
+
+def _bits_for(n_colors: int) -> int:
+    for bits in (1, 2, 4, 8):
+        if n_colors <= (1 << bits):
+            return bits
+    raise ValueError("Una paleta PNG admite como máximo 256 colores")
+
+
+# ================== ENCODERS ==================
+def _save(im: Image.Image, opts: EncoderOptions, **png_kwargs) -> Encoded:
+    buf = io.BytesIO()
+    if opts.fmt == "webp":
+        if im.mode == "P":
+            im = im.convert("RGBA")
+        im.save(buf, format="WEBP", lossless=True, quality=100, method=opts.webp_method)
+    else:
+        im.save(buf, format="PNG", compress_level=opts.compress_level, optimize=opts.optimize, **png_kwargs)
+    return Encoded(buf.getvalue(), MIMES[opts.fmt])
+
+
+def encode_indexed(index: np.ndarray, palette_rgba: np.ndarray, opts: EncoderOptions = DEFAULT_OPTIONS) -> Encoded:
+    """
+    Índices uint8 (H,W) + paleta RGBA (N,4) → PNG en modo "P" con tRNS y la
+    profundidad de bits mínima (1/2/4/8) que admite la paleta.
+    """
+    n = len(palette_rgba)
+    im = Image.fromarray(np.ascontiguousarray(index, dtype=np.uint8), mode="P")
+    im.putpalette(palette_rgba[:, :3].tobytes(), rawmode="RGB")
+    alpha = palette_rgba[:, 3].tobytes()
+    if opts.fmt == "webp":
+        im.info["transparency"] = alpha
+        return _save(im, opts)
+    return _save(im, opts, transparency=alpha, bits=_bits_for(n))
+
+
+def encode_mask(index: np.ndarray, opts: EncoderOptions = DEFAULT_OPTIONS,
+                palette: Palette = DEFAULT_PALETTE) -> Encoded:
+    """Máscara (0 vacío, 1 pérdida) → PNG de paleta de 1 bit."""
+    return encode_indexed(index, palette.mask_palette, opts)
+
+
+def encode_landcover(codes: np.ndarray, nodata=None, valid=None, opts: EncoderOptions = DEFAULT_OPTIONS,
+                     palette: Palette = DEFAULT_PALETTE) -> Encoded:
+    """Códigos land cover → PNG indexado con landcover_palette(palette)."""
+    codes = as_code_array(codes, nodata)
+    lut = landcover_index_lut(256 if codes.dtype == np.uint8 else 65536, nodata, palette)
+    index = lut[codes]
+    if valid is not None:
+        index[~valid] = 0
+    return encode_indexed(index, landcover_palette(palette), opts)
+
+
+def encode_rgba(rgba: np.ndarray, opts: EncoderOptions = DEFAULT_OPTIONS) -> Encoded:
+    """RGBA (H,W,4) genérico, sin paleta."""
+    return _save(Image.fromarray(np.ascontiguousarray(rgba), mode="RGBA"), opts)
+
+
+# ================== INFORME ==================
+def payload_report(paths=None, max_pixels: int = MAX_PIXELS):
+    """
+    Bytes por frame: PNG RGBA de referencia (lo que enviaba rgba_to_dataurl) frente
+    a las codificaciones compactas. Devuelve una lista de dicts (una fila por frame).
+    """
+    rows = []
+    for p in paths or sorted(glob.glob("mask_loss/*.tif")) + ["landcover_darien.tif"]:
+        if "landcover" in os.path.basename(p).lower():
+            rgba, _b, _legend, codes = rasters.load_landcover_rgba_and_bounds(p, max_pixels)
+            compact = lambda o: encode_landcover(codes, opts=o)
+        else:
+            index, _b = rasters.load_mask_index_and_bounds(p, max_pixels)
+            rgba = MASK_PALETTE[index]
+            compact = lambda o: encode_mask(index, o)
+        row = {"frame": os.path.basename(p), "rgba_png": len(rasters.rgba_to_png(rgba))}
+        row["palette_png"] = compact(EncoderOptions(fmt="png")).nbytes
+        row["webp_lossless"] = compact(EncoderOptions(fmt="webp")).nbytes
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bytes por frame según codificación.")
+    ap.add_argument("paths", nargs="*")
+    ap.add_argument("--max-pixels", type=int, default=MAX_PIXELS)
+    args = ap.parse_args(argv)
+    rows = payload_report(args.paths or None, args.max_pixels)
+    cols = ["rgba_png", "palette_png", "webp_lossless"]
+    print("frame".ljust(40) + "".join(c.rjust(16) for c in cols))
+    for r in rows:
+        print(r["frame"].ljust(40) + "".join(f"{r[c]:>16,}" for c in cols))
+    tot = {c: sum(r[c] for r in rows) for c in cols}
+    print("TOTAL".ljust(40) + "".join(f"{tot[c]:>16,}" for c in cols))
+    print("base64 añade ~33% al incrustarlo como data URL.")
+
+
+if __name__ == "__main__":
+    main()
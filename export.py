@@ -0,0 +1,220 @@
+# export.py
+"""
+Exportación vectorial de la pérdida: cada máscara se poligoniza a resolución
+nativa ventana a ventana (rasterio.features.shapes, 8-conectividad), los
+polígonos se simplifican (Douglas-Peucker, tolerancia en píxeles) y se
+etiquetan con el periodo, la clase de land cover dominante y su superficie.
+
+La salida es GeoJSON delimitado por líneas (GeoJSONSeq: un Feature por línea,
+EPSG:4326), que QGIS/GDAL abren directamente. Se escribe feature a feature en
+un fichero temporal (nunca se tiene la lista entera en memoria) y se publica
+con un rename atómico; queda en caché por frame (hash de máscara y land
+cover + parámetros).
+
+Los parches que cruzan el borde de una ventana salen partidos en varios
+features con el mismo periodo; la propiedad "bloque" permite disolverlos.
+
+Uso:
+    python export.py [máscaras...] [--landcover landcover_darien.tif] [--tolerance 0.5]
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+import rasterio
+from rasterio import features
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform as warp_transform
+from rasterio.windows import Window
+
+import artifact_cache
+import catalog
+from rasters import DEFAULT_PALETTE, DST_CRS, Palette, mask_index
+from stats import row_areas_ha
+
+EXPORT_DIR = os.environ.get("DARIEN_EXPORT_DIR", ".cache/exports")
+EXPORT_BLOCK = int(os.environ.get("DARIEN_EXPORT_BLOCK", "2048"))                # lado de ventana (px)
+EXPORT_TOLERANCE = float(os.environ.get("DARIEN_EXPORT_TOLERANCE", "0.5"))      # píxeles
+EXPORT_VERSION = 1   # subir si cambia el formato (invalida la caché)
+EXPORT_MIME = "application/geo+json-seq"
+
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+
+
+# ================== SIMPLIFICACIÓN ==================
+def _dp_keep(pts: np.ndarray, tol: float) -> np.ndarray:
+    """Máscara de vértices que conserva Douglas-Peucker en la polilínea abierta pts (N,2)."""
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        a, b = pts[i], pts[j]
+        seg = pts[i + 1:j] - a
+        d = b - a
+        norm = np.hypot(d[0], d[1])
+        dist = np.abs(seg[:, 0] * d[1] - seg[:, 1] * d[0]) / norm if norm else np.hypot(seg[:, 0], seg[:, 1])
+        k = int(dist.argmax())
+        if dist[k] > tol:
+            keep[i + 1 + k] = True
+            stack.append((i, i + 1 + k))
+            stack.append((i + 1 + k, j))
+    return keep
+
+
+def simplify_ring(ring: np.ndarray, tol: float) -> np.ndarray:
+    """
+    Anillo cerrado (N,2) simplificado con tolerancia tol. Se parte en el vértice
+    más lejano al primero para que los dos extremos fijos queden en el contorno.
+    Si quedaría degenerado (< 4 vértices) se devuelve el original.
+    """
+    if tol <= 0 or len(ring) <= 5:
+        return ring
+    pts = ring[:-1]
+    far = int(np.hypot(*(pts - pts[0]).T).argmax())
+    first = _dp_keep(pts[:far + 1], tol)
+    second = _dp_keep(np.vstack([pts[far:], pts[:1]]), tol)[:-1]
+    keep = np.concatenate([first[:-1], second])
+    out = pts[keep]
+    if len(out) < 3:
+        return ring
+    return np.vstack([out, out[:1]])
+
+
+# ================== POLIGONIZACIÓN ==================
+def _landcover_reader(landcover_path: str, src):
+    """WarpedVRT del land cover sobre la malla de la máscara (nearest), o None."""
+    if not landcover_path:
+        return None
+    lc_src = rasterio.open(landcover_path)
+    return lc_src, WarpedVRT(lc_src, crs=src.crs, transform=src.transform, width=src.width, height=src.height,
+                             resampling=Resampling.nearest, nodata=lc_src.nodata)
+
+
+def iter_features(path: str, landcover_path: str = None, palette: Palette = DEFAULT_PALETTE,
+                  tolerance: float = EXPORT_TOLERANCE, block: int = EXPORT_BLOCK):
+    """
+    Genera los Features GeoJSON (dict, EPSG:4326) de la pérdida de path, ventana
+    a ventana. Propiedades: periodo, inicio, fin, code/clase dominante, pixeles,
+    hectareas y bloque ("fila_col" de la ventana).
+    """
+    entry = catalog.read_entry(path)
+    classes = {code: label for code, _hex, label in palette.landcover_classes}
+    with rasterio.open(path) as src:
+        lc = _landcover_reader(landcover_path, src)
+        geographic = src.crs is None or src.crs.is_geographic
+        try:
+            for r0 in range(0, src.height, block):
+                h = min(block, src.height - r0)
+                row_ha = row_areas_ha(src.transform, src.crs, r0, h)
+                for c0 in range(0, src.width, block):
+                    win = Window(c0, r0, min(block, src.width - c0), h)
+                    loss = mask_index(src.read(1, window=win), src.nodata).view(bool)
+                    if not loss.any():
+                        continue
+                    codes = lc[1].read(1, window=win) if lc else None
+                    T = src.window_transform(win)
+                    # Polígonos en coordenadas de píxel de la ventana: el bbox indexa codes/loss
+                    for geom, _v in features.shapes(loss.view(np.uint8), mask=loss, connectivity=8,
+                                                    transform=Affine.identity()):
+                        rings = [np.asarray(r, dtype=np.float64) for r in geom["coordinates"]]
+                        x0, y0 = rings[0].min(axis=0).astype(int)
+                        x1, y1 = np.ceil(rings[0].max(axis=0)).astype(int)
+                        inside = features.geometry_mask([geom], (y1 - y0, x1 - x0),
+                                                        Affine.translation(x0, y0), invert=True)
+                        inside &= loss[y0:y1, x0:x1]
+                        pixels = int(inside.sum())
+                        ha = float((inside * row_ha[y0:y1, None]).sum())
+                        code = None
+                        if codes is not None:
+                            vals, counts = np.unique(codes[y0:y1, x0:x1][inside], return_counts=True)
+                            code = int(vals[counts.argmax()])
+                        coords = []
+                        for ring in rings:
+                            ring = simplify_ring(ring, tolerance)
+                            xs, ys = T * (ring[:, 0], ring[:, 1])
+                            if not geographic:
+                                xs, ys = warp_transform(src.crs, DST_CRS, xs, ys)
+                            coords.append(np.round(np.column_stack([xs, ys]), 7).tolist())
+                        yield {
+                            "type": "Feature",
+                            "geometry": {"type": "Polygon", "coordinates": coords},
+                            "properties": {
+                                "periodo": entry.label if entry else os.path.basename(path),
+                                "inicio": entry.start if entry else None,
+                                "fin": entry.end if entry else None,
+                                "code": code, "clase": classes.get(code) if code is not None else None,
+                                "pixeles": pixels, "hectareas": round(ha, 4),
+                                "bloque": f"{r0 // block}_{c0 // block}",
+                            },
+                        }
+        finally:
+            if lc:
+                lc[1].close()
+                lc[0].close()
+
+
+# ================== CACHÉ EN DISCO ==================
+def export_key(path: str, landcover_path: str = None, palette: Palette = DEFAULT_PALETTE,
+               tolerance: float = EXPORT_TOLERANCE, block: int = EXPORT_BLOCK) -> str:
+    lc_hash = artifact_cache.file_hash(landcover_path) if landcover_path else "-"
+    raw = f"{EXPORT_VERSION}|{artifact_cache.file_hash(path)}|{lc_hash}|{palette.key}|{tolerance}|{block}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def export_frame(path: str, landcover_path: str = None, palette: Palette = DEFAULT_PALETTE,
+                 tolerance: float = EXPORT_TOLERANCE, block: int = EXPORT_BLOCK,
+                 root: str = EXPORT_DIR) -> str:
+    """
+    Ruta del GeoJSONSeq de path (se genera la primera vez, una sola vez aunque lo
+    pidan varios hilos). Los features se escriben según salen de iter_features.
+    """
+    os.makedirs(root, exist_ok=True)
+    key = export_key(path, landcover_path, palette, tolerance, block)
+    out = os.path.join(root, f"{os.path.splitext(os.path.basename(path))[0]}-{key}.geojsonl")
+    if os.path.exists(out):
+        return out
+    with _LOCKS_LOCK:
+        lock = _LOCKS.setdefault(key, threading.Lock())
+    with lock:
+        if not os.path.exists(out):
+            tmp = f"{out}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for feat in iter_features(path, landcover_path, palette, tolerance, block):
+                    f.write(json.dumps(feat, ensure_ascii=False, separators=(",", ":")))
+                    f.write("\n")
+            os.replace(tmp, out)
+    return out
+
+
+def download_name(entry: "catalog.RasterEntry") -> str:
+    return f"perdida_{entry.start}_{entry.end}.geojsonl"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Exporta la pérdida como polígonos (GeoJSONSeq).")
+    ap.add_argument("paths", nargs="*")
+    ap.add_argument("--landcover", default="landcover_darien.tif")
+    ap.add_argument("--tolerance", type=float, default=EXPORT_TOLERANCE, help="píxeles")
+    ap.add_argument("--out", default=EXPORT_DIR)
+    args = ap.parse_args(argv)
+    paths = args.paths or sorted(glob.glob(os.path.join(catalog.LOSS_DIR, "*.tif")))
+    lc = args.landcover if os.path.exists(args.landcover) else None
+    for p in paths:
+        out = export_frame(p, lc, tolerance=args.tolerance, root=args.out)
+        with open(out, encoding="utf-8") as f:
+            n = sum(1 for _ in f)
+        print(f"{p} → {out} ({n} polígonos, {os.path.getsize(out) / 2**20:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# frame_store.py
+"""
+Registro de proceso con lo que el visor sirve de cada área ya preparado:
+secciones JSON del mapa (URLs o data URLs de frames, cubo, land cover,
+historial, capas derivadas, focos) con sus hashes, rutas del servidor local,
+bounds, leyenda y la rejilla de códigos land cover (de solo lectura).
+
+Se llena una vez por proceso con warm_up() al arrancar (el área por defecto
+en primer plano, el resto en un hilo) y cada rerun de una sesión solo hace
+una consulta al diccionario: nada se vuelve a leer, colorear, codificar ni
+serializar. Un FrameStore es inmutable salvo por memo(), que guarda valores
+calculados la primera vez que se piden (p. ej. la figura de estadísticas).
+Al recargar un área, invalidate() marca su store como viejo y la siguiente
+sesión que llama a ensure() lo reconstruye.
+"""
+import threading
+import time
+import warnings
+from types import MappingProxyType
+
+import numpy as np
+
+_STORES = {}
+_LOCK = threading.Lock()
+_STALE = {}    # área → marca de invalidate() aún sin reconstruir
+_BUILDING = {}   # área → lock de ensure() (una sola construcción por área)
+_WARMUP = {}   # área → segundos de construcción (o excepción) en warm_up
+
+
+class FrameStore:
+    """Datos preparados de un área en una versión concreta de sus ficheros."""
+
+    def __init__(self, area: str, version: str, labels, entries, sections: dict, hashes: dict,
+                 routes: dict = None, bounds=None, legend=None, lc_codes: np.ndarray = None):
+        self.area = area
+        self.version = version
+        self.labels = tuple(labels)
+        self.entries = tuple(entries)
+        self.sections = MappingProxyType(dict(sections))
+        self.hashes = MappingProxyType(dict(hashes))
+        self.routes = MappingProxyType(dict(routes or {}))
+        self.bounds = tuple(bounds) if bounds is not None else None   # [W,S,E,N] global
+        self.legend = tuple(legend or ())
+        if lc_codes is not None:
+            lc_codes = np.asarray(lc_codes).view()
+            lc_codes.flags.writeable = False
+        self.lc_codes = lc_codes
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    def memo(self, name: str, build):
+        """build() una sola vez por store (las demás llamadas esperan y reutilizan el valor)."""
+        with self._memo_lock:
+            if name not in self._memo:
+                self._memo[name] = build()
+            return self._memo[name]
+
+    def entry(self, label: str):
+        for e in self.entries:
+            if e.label == label:
+                return e
+        raise KeyError(label)
+
+
+def put(store: FrameStore) -> FrameStore:
+    with _LOCK:
+        _STORES[store.area] = store
+    return store
+
+
+def get(area: str, version: str = None):
+    """FrameStore del área (None si no existe o si version no coincide)."""
+    store = _STORES.get(area)
+    if store is None or (version is not None and store.version != version):
+        return None
+    return store
+
+
+def invalidate(area: str):
+    """Marca el store del área como viejo; se sigue sirviendo hasta que ensure() lo reconstruya."""
+    with _LOCK:
+        _STALE[area] = object()
+
+
+def stale(area: str) -> bool:
+    return area in _STALE
+
+
+def ensure(area: str, build) -> FrameStore:
+    """
+    Store del área; si falta o está invalidado lo construye build(área) una
+    sola vez aunque lo pidan varias sesiones a la vez (las demás esperan).
+    Una invalidación que llegue durante la construcción la deja pendiente.
+    """
+    store = _STORES.get(area)
+    if store is not None and area not in _STALE:
+        return store
+    with _LOCK:
+        building = _BUILDING.setdefault(area, threading.Lock())
+    with building:
+        with _LOCK:
+            store, mark = _STORES.get(area), _STALE.get(area)
+        if store is not None and mark is None:
+            return store
+        store = build(area)
+        with _LOCK:
+            _STORES[area] = store
+            if _STALE.get(area) is mark:
+                _STALE.pop(area, None)
+    return store
+
+
+def drop(area: str):
+    with _LOCK:
+        _STORES.pop(area, None)
+
+
+def areas():
+    with _LOCK:
+        return list(_STORES)
+
+
+def warm_up(build, keys, background: bool = True) -> dict:
+    """
+    Hook de arranque: build(área) → FrameStore para cada área de keys, en orden.
+    La primera se construye en primer plano (la que va a pedir la primera
+    sesión); con background las demás siguen en un hilo daemon. Devuelve el
+    diccionario de tiempos, que se va completando.
+    """
+    keys = list(keys)
+
+    def run(subset):
+        for key in subset:
+            t0 = time.perf_counter()
+            try:
+                ensure(key, build)
+                _WARMUP[key] = time.perf_counter() - t0
+            except Exception as exc:  # noqa: BLE001 — un área rota no impide servir las demás
+                _WARMUP[key] = exc
+                warnings.warn(f"warm-up de {key} falló: {exc}")
+
+    if keys:
+        run(keys[:1])
+        if background:
+            threading.Thread(target=run, args=(keys[1:],), daemon=True, name="darien-warm-up").start()
+        else:
+            run(keys[1:])
+    return _WARMUP
@@ -0,0 +1,127 @@
+# history.py
+"""
+Índice por píxel del historial de pérdida sobre la malla de visualización de
+los frames (la del cubo):
+    bits   máscara de los periodos con pérdida (bit i = frame i); uint8 hasta
+           8 periodos, uint16 hasta 16
+    first  posición del primer periodo con pérdida (NO_LOSS si nunca)
+    counts (n, H, W) uint8: píxeles nativos con pérdida de cada celda en cada
+           periodo, divididos por count_scale (redondeo hacia arriba); el
+           navegador los multiplica por el área de un píxel nativo (px_ha), de
+           modo que el área que muestra no cuenta entera una celda con un solo
+           píxel perdido
+Se construye una vez a partir de las máscaras nativas (rasters, counts=True) y
+se guarda en la caché persistente. El navegador lo recibe por bloques
+cuadrados de HISTORY_BLOCK píxeles (gzip de los planos), que pide al pasar el
+cursor: una malla pequeña es un único bloque y en una grande solo se descarga
+la zona que se explora. Cada consulta es un acceso directo al array del bloque.
+"""
+import gzip
+import hashlib
+import os
+
+import numpy as np
+
+import rasterio
+
+import artifact_cache
+from rasters import DEFAULT_PALETTE, MAX_PIXELS, Palette, decimation_step, load_mask_index_and_bounds
+from stats import row_areas_ha
+
+HISTORY_BLOCK = int(os.environ.get("DARIEN_HISTORY_BLOCK", "2048"))   # lado del bloque (px)
+HISTORY_VERSION = 2   # subir si cambia el formato (invalida la caché)
+NO_LOSS = 255
+
+
+def build_history(indices):
+    """Máscaras (H,W) de los frames en orden → (bits, first)."""
+    n = len(indices)
+    if n > 16:
+        raise ValueError(f"El historial admite hasta 16 periodos ({n})")
+    bits = np.zeros(np.shape(indices[0]), dtype=np.uint8 if n <= 8 else np.uint16)
+    first = np.full(bits.shape, NO_LOSS, dtype=np.uint8)
+    for i in reversed(range(n)):   # de atrás adelante: el último en escribir es el primer periodo
+        loss = np.asarray(indices[i], dtype=bool)
+        bits[loss] |= bits.dtype.type(1 << i)
+        first[loss] = i
+    return bits, first
+
+
+def cell_info(path: str, max_pixels: int = MAX_PIXELS):
+    """
+    (count_scale, px_ha) de la máscara path: divisor de los conteos para que
+    quepan en uint8 y área media (ha) de un píxel nativo (stats.row_areas_ha).
+    Solo lee metadatos.
+    """
+    with rasterio.open(path) as src:
+        h, w = src.height, src.width
+        step = decimation_step(h, w, max_pixels)
+        out_h, out_w = -(-h // step), -(-w // step)
+        cell_px = -(-h // out_h) * -(-w // out_w)   # celda más grande de la agrupación
+        px_ha = float(row_areas_ha(src.transform, src.crs, 0, h).mean())
+    return max(1, -(-cell_px // 255)), px_ha
+
+
+def load_history(paths, max_pixels: int = MAX_PIXELS, palette: Palette = DEFAULT_PALETTE,
+                 cache: "artifact_cache.ArtifactCache" = None) -> dict:
+    """
+    {"bits", "first", "counts", "bounds" (S,W,N,E), "count_scale", "px_ha"} de
+    los frames paths (en orden), desde la caché persistente o contando los
+    píxeles nativos con pérdida de cada celda de la malla de visualización.
+    """
+    cache = cache or artifact_cache.default_cache()
+    paths = list(paths)
+    deps = hashlib.sha1("|".join(artifact_cache.file_hash(p) for p in paths).encode()).hexdigest()[:16]
+    key = cache.key(paths[0], "history", max_pixels, palette=palette, extra=f"history{HISTORY_VERSION}|{deps}")
+    scale, px_ha = cell_info(paths[0], max_pixels)
+    hit = cache.get(key)
+    if hit is not None:
+        return {"bits": hit["arrays"]["bits"], "first": hit["arrays"]["first"], "counts": hit["arrays"]["counts"],
+                "bounds": tuple(hit["meta"]["bounds"]), "count_scale": scale, "px_ha": px_ha}
+    counts, bounds = None, set()
+    for i, p in enumerate(paths):
+        c, b = load_mask_index_and_bounds(p, max_pixels, counts=True)
+        bounds.add(tuple(np.round(b, 9)))
+        if len(bounds) != 1:
+            raise ValueError("Las máscaras no comparten bounds; no hay historial por píxel")
+        if counts is None:
+            counts = np.zeros((len(paths),) + c.shape, dtype=np.uint8)
+        counts[i] = (c + (scale - 1)) // scale
+        del c
+    bits, first = build_history(counts)
+    bounds = tuple(b)
+    cache.put(key, {"kind": "history", "sources": paths, "bounds": list(bounds)},
+              {"bits": bits, "first": first, "counts": counts})
+    return {"bits": bits, "first": first, "counts": counts, "bounds": bounds, "count_scale": scale, "px_ha": px_ha}
+
+
+def history_header(height: int, width: int, bounds, labels, block: int = HISTORY_BLOCK,
+                   count_scale: int = 1, px_ha: float = None) -> dict:
+    """
+    Cabecera JSON-serializable para el navegador (se calcula con el catálogo y
+    cell_info). bounds en (S,W,N,E); sin px_ha el navegador no muestra áreas.
+    """
+    s, w, n, e = bounds
+    return {
+        "h": int(height), "w": int(width), "block": int(block),
+        "rows": -(-int(height) // block), "cols": -(-int(width) // block),
+        "bytes": 1 if len(labels) <= 8 else 2,
+        "bounds": [w, s, e, n],   # [W,S,E,N]
+        "labels": list(labels), "noLoss": NO_LOSS, "encoding": "gzip",
+        "countScale": int(count_scale), "pxHa": px_ha,
+    }
+
+
+def history_block(hist: dict, by: int, bx: int, block: int = HISTORY_BLOCK) -> bytes:
+    """
+    gzip del bloque (by, bx): plano bits (little-endian), plano first y los n
+    planos de counts (uint8), todos (bh, bw) en orden de filas; los bloques
+    del borde son más pequeños.
+    """
+    rows = slice(by * block, (by + 1) * block)
+    cols = slice(bx * block, (bx + 1) * block)
+    bits = np.ascontiguousarray(hist["bits"][rows, cols])
+    first = np.ascontiguousarray(hist["first"][rows, cols])
+    counts = np.ascontiguousarray(hist["counts"][:, rows, cols])
+    return gzip.compress(bits.astype(bits.dtype.newbyteorder("<")).tobytes() + first.tobytes() + counts.tobytes(),
+                         compresslevel=6)
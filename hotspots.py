@@ -0,0 +1,196 @@
+# hotspots.py
+"""
+Focos de pérdida: componentes conexas (8-conectividad) de cada máscara a
+resolución nativa, con superficie, centroide y bbox, ordenadas por hectáreas.
+
+El etiquetado trabaja sobre tramos horizontales (run-lengths) en vez de
+píxeles: la máscara se lee por bloques de filas, cada fila se reduce a sus
+tramos (inicio, fin) y dos tramos de filas consecutivas se unen si se solapan
+o tocan en diagonal. Los pares se buscan con searchsorted sobre todos los
+tramos a la vez y las uniones se resuelven con un union-find vectorizado
+(enganche al mínimo + compresión de caminos), así que el coste es
+proporcional al número de tramos y no al de píxeles.
+
+Los focos de cada frame se guardan en la caché persistente (todos, ordenados
+de mayor a menor); el visor muestra los HOTSPOT_TOP primeros.
+
+Uso:
+    python hotspots.py [máscaras...] [--top 10]
+"""
+import argparse
+import glob
+import os
+import threading
+import time
+
+import numpy as np
+import rasterio
+from rasterio.warp import transform as warp_transform
+from rasterio.windows import Window
+
+import artifact_cache
+import catalog
+from rasters import DEFAULT_PALETTE, DST_CRS, Palette, mask_index
+from stats import STATS_BLOCK_ROWS, row_areas_ha
+
+HOTSPOT_TOP = int(os.environ.get("DARIEN_HOTSPOT_TOP", "10"))   # focos por periodo en el visor
+HOTSPOT_VERSION = 1   # subir si cambia el formato (invalida la caché)
+
+
+# ================== ETIQUETADO ==================
+def _runs(loss: np.ndarray):
+    """Tramos de una máscara (h, W) → (fila, inicio, fin) con fin exclusivo, en orden de filas."""
+    h, w = loss.shape
+    padded = np.zeros((h, w + 2), dtype=np.int8)
+    padded[:, 1:-1] = loss
+    d = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(d == 1)
+    _, ends = np.nonzero(d == -1)
+    return rows, starts, ends
+
+
+def _union_find(n: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Raíz de cada uno de los n nodos tras unir los pares (a[k], b[k])."""
+    parent = np.arange(n)
+    while True:
+        ra, rb = parent[a], parent[b]
+        pending = ra != rb
+        if not pending.any():
+            return parent
+        ra, rb = ra[pending], rb[pending]
+        # Cada raíz mayor se engancha a la menor de sus vecinas: nunca hay ciclos
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+
+def label_runs(rows: np.ndarray, starts: np.ndarray, ends: np.ndarray, width: int) -> np.ndarray:
+    """Etiqueta 0..K-1 de la componente (8-conectividad) de cada tramo."""
+    n = len(rows)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    stride = width + 2
+    gs = rows.astype(np.int64) * stride + starts   # claves globales crecientes
+    ge = rows.astype(np.int64) * stride + ends
+    # Tramos de la fila anterior que tocan a cada tramo (s, e): fin ≥ s y inicio ≤ e (diagonal incluida)
+    prev = (rows.astype(np.int64) - 1) * stride
+    lo = np.searchsorted(ge, prev + starts, side="left")
+    hi = np.searchsorted(gs, prev + ends, side="right")
+    counts = np.maximum(hi - lo, 0)
+    b = np.repeat(np.arange(n), counts)
+    a = np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    roots = _union_find(n, a, b)
+    return np.unique(roots, return_inverse=True)[1]
+
+
+def find_hotspots(path: str, block_rows: int = STATS_BLOCK_ROWS) -> dict:
+    """
+    Focos de la máscara path ordenados por superficie: {"ha", "pixels", "lon",
+    "lat" (centroide), "bbox" (K,4: W,S,E,N en EPSG:4326)}.
+    """
+    with rasterio.open(path) as src:
+        parts = []
+        for r0 in range(0, src.height, block_rows):
+            h = min(block_rows, src.height - r0)
+            loss = mask_index(src.read(1, window=Window(0, r0, src.width, h)), src.nodata).view(bool)
+            rows, starts, ends = _runs(loss)
+            parts.append((rows + r0, starts, ends))
+        rows, starts, ends = (np.concatenate(p) for p in zip(*parts))
+        labels = label_runs(rows, starts, ends, src.width)
+        k = int(labels.max()) + 1 if len(labels) else 0
+        length = (ends - starts).astype(np.float64)
+        row_ha = row_areas_ha(src.transform, src.crs, 0, src.height)
+        pixels = np.bincount(labels, weights=length, minlength=k)
+        ha = np.bincount(labels, weights=length * row_ha[rows], minlength=k)
+        # Centroide de los centros de píxel: la media de las columnas de un tramo es (s + e) / 2
+        cx = np.bincount(labels, weights=length * (starts + ends) / 2, minlength=k) / np.maximum(pixels, 1)
+        cy = np.bincount(labels, weights=length * (rows + 0.5), minlength=k) / np.maximum(pixels, 1)
+        r0 = np.full(k, src.height, dtype=np.int64)
+        c0 = np.full(k, src.width, dtype=np.int64)
+        r1 = np.zeros(k, dtype=np.int64)
+        c1 = np.zeros(k, dtype=np.int64)
+        np.minimum.at(r0, labels, rows)
+        np.minimum.at(c0, labels, starts)
+        np.maximum.at(r1, labels, rows + 1)
+        np.maximum.at(c1, labels, ends)
+
+        T = src.transform
+        lon, lat = T * (cx, cy)
+        xs = np.concatenate([c0, c1, c0, c1]).astype(np.float64)
+        ys = np.concatenate([r0, r0, r1, r1]).astype(np.float64)
+        cxs, cys = T * (xs, ys)
+        if src.crs is not None and not src.crs.is_geographic:
+            lon, lat = (np.asarray(v) for v in warp_transform(src.crs, DST_CRS, lon, lat))
+            cxs, cys = (np.asarray(v) for v in warp_transform(src.crs, DST_CRS, cxs, cys))
+        cxs, cys = cxs.reshape(4, k), cys.reshape(4, k)
+        bbox = np.stack([cxs.min(axis=0), cys.min(axis=0), cxs.max(axis=0), cys.max(axis=0)], axis=1)
+
+    order = np.argsort(-ha, kind="stable")
+    return {"ha": ha[order], "pixels": pixels[order].astype(np.int64), "lon": np.asarray(lon)[order],
+            "lat": np.asarray(lat)[order], "bbox": bbox[order]}
+
+
+# ================== CACHÉ ==================
+def load_hotspots(path: str, palette: Palette = DEFAULT_PALETTE,
+                  cache: "artifact_cache.ArtifactCache" = None) -> dict:
+    """Focos del frame path desde la caché persistente (se calculan la primera vez)."""
+    cache = cache or artifact_cache.default_cache()
+    key = cache.key(path, "hotspots", 0, palette=palette, extra=f"hotspots{HOTSPOT_VERSION}")
+    hit = cache.get(key)
+    if hit is not None:
+        return hit["arrays"]
+    spots = find_hotspots(path)
+    cache.put(key, {"kind": "hotspots", "source": path, "count": int(len(spots["ha"]))}, spots)
+    return spots
+
+
+def top_hotspots(spots: dict, n: int = HOTSPOT_TOP) -> list:
+    """Los n mayores focos como dicts JSON-serializables (rank, ha, pixels, lon, lat, bbox)."""
+    return [
+        {"rank": i + 1, "ha": round(float(spots["ha"][i]), 2), "pixels": int(spots["pixels"][i]),
+         "lon": round(float(spots["lon"][i]), 6), "lat": round(float(spots["lat"][i]), 6),
+         "bbox": [round(float(v), 6) for v in spots["bbox"][i]]}
+        for i in range(min(n, len(spots["ha"])))
+    ]
+
+
+class HotspotSet:
+    """Focos de todos los frames de un área, calculados una vez (en disco) y servidos juntos."""
+
+    def __init__(self, entries, palette: Palette = DEFAULT_PALETTE):
+        self.entries = list(entries)
+        self.palette = palette
+        self._spots = None
+        self._lock = threading.Lock()
+
+    def spots(self):
+        with self._lock:
+            if self._spots is None:
+                self._spots = [load_hotspots(e.path, self.palette) for e in self.entries]
+            return self._spots
+
+    def top(self, n: int = HOTSPOT_TOP) -> dict:
+        """{label: [foco, ...]} con los n mayores focos de cada frame."""
+        return {e.label: top_hotspots(s, n) for e, s in zip(self.entries, self.spots())}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Focos de pérdida (componentes conexas) por periodo.")
+    ap.add_argument("paths", nargs="*")
+    ap.add_argument("--top", type=int, default=HOTSPOT_TOP)
+    args = ap.parse_args(argv)
+    paths = args.paths or sorted(glob.glob(os.path.join(catalog.LOSS_DIR, "*.tif")))
+    for p in paths:
+        t0 = time.perf_counter()
+        spots = load_hotspots(p)
+        print(f"{os.path.basename(p)}: {len(spots['ha'])} focos, {float(np.sum(spots['ha'])):,.1f} ha "
+              f"({time.perf_counter() - t0:.2f}s)")
+        for s in top_hotspots(spots, args.top):
+            print(f"  #{s['rank']:<3}{s['ha']:>10,.2f} ha  {s['pixels']:>8} px  ({s['lat']:.5f}, {s['lon']:.5f})")
+
+
+if __name__ == "__main__":
+    main()
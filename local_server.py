@@ -0,0 +1,233 @@
+# local_server.py
+"""
+Servidor HTTP local (hilo en segundo plano) que sirve teselas y assets a Leaflet.
+Streamlit no permite registrar rutas propias, así que se publican en un puerto
+aparte:
+    GET /tiles/<capa>/<z>/<x>/<y>.png   teselas XYZ (tiles.py)
+    GET /assets/<sha>.<ext>             assets inmutables (assets.py)
+    GET /lazy/<nombre>                  blobs generados al pedirlos (frames perezosos, cubo)
+    POST /api/<nombre>                  consultas JSON desde el mapa (cuerpo y respuesta JSON)
+    GET /files/<nombre>                 descargas grandes servidas desde disco por trozos
+"""
+import json
+import os
+import re
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from assets import AssetStore
+from tiles import TileLayer
+
+_TILE_RE = re.compile(r"^/tiles/([\w\-]+)/(\d+)/(\d+)/(\d+)\.png$")
+_ASSET_RE = re.compile(r"^/assets/([\w\-]+\.\w+)$")
+_LAZY_RE = re.compile(r"^/lazy/([\w\-]+)$")
+_API_RE = re.compile(r"^/api/([\w\-]+)$")
+_FILE_RE = re.compile(r"^/files/([\w\-]+)$")
+API_MAX_BODY = 1 << 20   # 1 MiB: de sobra para un polígono dibujado a mano
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class LocalServer:
+    """Registro de capas y assets + ThreadingHTTPServer en un hilo daemon."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8502, assets: AssetStore = None):
+        self.host = host
+        self.port = port
+        self.layers = {}
+        self.assets = assets
+        self.lazy = {}
+        self.api = {}
+        self.files = {}
+        self._lock = threading.Lock()
+        self._httpd = None
+
+    def register(self, layer: TileLayer) -> TileLayer:
+        with self._lock:
+            self.layers[layer.name] = layer
+        return layer
+
+    def register_lazy(self, name: str, fn):
+        """Publica /lazy/<name>; fn() → encoders.Encoded se llama en cada petición (debe cachear)."""
+        with self._lock:
+            self.lazy[name] = fn
+
+    def register_api(self, name: str, fn):
+        """Publica POST /api/<name>; fn(dict) → dict (JSON de entrada y salida)."""
+        with self._lock:
+            self.api[name] = fn
+
+    def register_file(self, name: str, fn):
+        """
+        Publica GET /files/<name>; fn() → (ruta, mime, nombre de descarga). La ruta
+        puede generarse en la primera petición; se envía por trozos desde disco.
+        """
+        with self._lock:
+            self.files[name] = fn
+
+    def file_url(self, base_url: str, name: str) -> str:
+        return f"{base_url.rstrip('/')}/files/{name}"
+
+    def api_url(self, base_url: str, name: str) -> str:
+        return f"{base_url.rstrip('/')}/api/{name}"
+
+    def asset_url(self, base_url: str, name: str) -> str:
+        return f"{base_url.rstrip('/')}/assets/{name}"
+
+    def lazy_url(self, base_url: str, name: str) -> str:
+        return f"{base_url.rstrip('/')}/lazy/{name}"
+
+    def start(self):
+        if self._httpd is not None:
+            return self
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path.startswith("/assets/"):
+                    self._asset(path)
+                    return
+                if path.startswith("/lazy/"):
+                    self._lazy(path)
+                    return
+                if path.startswith("/files/"):
+                    self._file(path)
+                    return
+                m = _TILE_RE.match(path)
+                layer = server.layers.get(m.group(1)) if m else None
+                if layer is None:
+                    self.send_error(404)
+                    return
+                z, x, y = (int(g) for g in m.groups()[1:])
+                try:
+                    body = layer.tile(z, x, y)
+                except Exception as exc:  # noqa: BLE001 — un fallo de tesela no tumba el servidor
+                    self.send_error(500, str(exc))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "public, max-age=86400")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_OPTIONS(self):
+                self.send_response(204)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+                self.send_header("Access-Control-Allow-Headers", "Content-Type")
+                self.send_header("Access-Control-Max-Age", "86400")
+                self.end_headers()
+
+            def do_POST(self):
+                m = _API_RE.match(urlsplit(self.path).path)
+                fn = server.api.get(m.group(1)) if m else None
+                if fn is None:
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > API_MAX_BODY:
+                    self.send_error(413)
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self.send_error(400, "JSON inválido")
+                    return
+                try:
+                    result = fn(payload)
+                except (KeyError, TypeError, ValueError) as exc:
+                    self.send_error(400, str(exc))
+                    return
+                except Exception as exc:  # noqa: BLE001
+                    self.send_error(500, str(exc))
+                    return
+                body = json.dumps(result, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-store")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _asset(self, path):
+                m = _ASSET_RE.match(path)
+                fp = server.assets.path(m.group(1)) if (m and server.assets) else None
+                if fp is None:
+                    self.send_error(404)
+                    return
+                etag = f'"{m.group(1)}"'   # el nombre es el hash del contenido
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", IMMUTABLE)
+                    self.end_headers()
+                    return
+                with open(fp, "rb") as f:
+                    body = f.read()
+                self.send_response(200)
+                self.send_header("Content-Type", AssetStore.mime(fp))
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", IMMUTABLE)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _lazy(self, path):
+                m = _LAZY_RE.match(path)
+                fn = server.lazy.get(m.group(1)) if m else None
+                if fn is None:
+                    self.send_error(404)
+                    return
+                try:
+                    enc = fn()
+                except Exception as exc:  # noqa: BLE001
+                    self.send_error(500, str(exc))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", enc.mime)
+                self.send_header("Content-Length", str(len(enc.data)))
+                self.send_header("Cache-Control", "public, max-age=86400")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(enc.data)
+
+            def _file(self, path):
+                m = _FILE_RE.match(path)
+                fn = server.files.get(m.group(1)) if m else None
+                if fn is None:
+                    self.send_error(404)
+                    return
+                try:
+                    fp, mime, filename = fn()
+                except Exception as exc:  # noqa: BLE001
+                    self.send_error(500, str(exc))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", mime)
+                self.send_header("Content-Length", str(os.path.getsize(fp)))
+                self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                with open(fp, "rb") as f:
+                    shutil.copyfileobj(f, self.wfile, 1 << 16)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True, name="darien-local-server").start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
@@ -0,0 +1,48 @@
+# map_component.py
+"""
+Componente bidireccional del mapa Leaflet. El frontend es estático
+(map_frontend/: index.html, map.js, map.css) y se declara una vez con
+components.declare_component, así que el iframe y el mapa sobreviven a los
+reruns: Streamlit solo le manda los argumentos nuevos por postMessage.
+
+Los datos van en secciones JSON con hash; el frontend devuelve en su valor
+los hashes que ya tiene ("have") y en cada rerun solo se reenvían las
+secciones que cambiaron (o todas si el iframe se acaba de montar). El
+estado pequeño (área, frame, intervalo) viaja siempre.
+
+Valor devuelto (None hasta el primer mensaje del frontend):
+    {"have": {sección: hash}, "area", "idx", "view": {"bounds" [W,S,E,N],
+     "center" [lat, lon], "zoom"}, "mode", "compare" [a, b],
+     "event": {"type", "seq", ...}}
+"""
+import hashlib
+import json
+import os
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_frontend")
+_component = components.declare_component("darien_map", path=FRONTEND_DIR)
+
+
+def section_hash(data) -> str:
+    """Hash estable del JSON de una sección."""
+    raw = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=float)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def leaflet_map(sections: dict, state: dict, key: str = "map", hashes: dict = None):
+    """
+    Pinta (o actualiza) el mapa y devuelve su valor. sections: {nombre: datos
+    JSON-serializables}; hashes opcional si el llamador ya los tiene calculados.
+    """
+    hashes = hashes or {name: section_hash(data) for name, data in sections.items()}
+    have = (st.session_state.get(key) or {}).get("have") or {}
+    changed = {name: sections[name] for name, h in hashes.items() if have.get(name) != h}
+    return _component(hashes=hashes, sections=changed, state=state, key=key, default=None)
+
+
+def map_value(key: str = "map") -> dict:
+    """Último valor devuelto por el mapa (disponible antes de pintarlo en el rerun)."""
+    return st.session_state.get(key) or {}
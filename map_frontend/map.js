@@ -0,0 +1,703 @@
+// map.js
+// Frontend estático del componente bidireccional del mapa (map_component.py).
+// Habla el protocolo de componentes de Streamlit directamente (postMessage),
+// sin paquete npm: componentReady → render(args) → setComponentValue/setFrameHeight.
+//
+// Python manda los datos en secciones con hash ("ui", "frames", "landcover",
+// "history", "derived", "hotspots", "query") y solo reenvía las que este
+// iframe no tiene (value.have); el estado pequeño (área, frame, intervalo)
+// viaje en cada render. El mapa Leaflet se crea una vez y solo se reconstruye
+// si cambia alguna sección de datos; el frame, la vista y los eventos vuelven
+// a Python como valor del componente. Las secciones "vivas" (LIVE: el recorte
+// nativo de la vista, "viewport") se aplican sobre la instancia sin reconstruirla.
+'use strict';
+
+// ===== Protocolo de componentes de Streamlit =====
+function sendToStreamlit(type, data) {
+  window.parent.postMessage(Object.assign({ isStreamlitMessage: true, apiVersion: 1, type: type }, data), '*');
+}
+
+const SECTIONS = {};   // sección → datos (se conservan entre renders)
+const HAVE = {};       // sección → hash de lo recibido
+const LIVE = new Set(['viewport']);   // secciones que no obligan a reconstruir el mapa
+const VALUE = { have: HAVE, idx: 0, view: null, mode: 'period', compare: null, event: null };
+let valueTimer = null, eventSeq = 0;
+// Devuelve el estado a Python (cada envío provoca un rerun: se agrupan con un debounce)
+function report(patch, delay) {
+  Object.assign(VALUE, patch || {});
+  clearTimeout(valueTimer);
+  valueTimer = setTimeout(() => sendToStreamlit('streamlit:setComponentValue', {
+    value: Object.assign({}, VALUE, { have: Object.assign({}, HAVE) }), dataType: 'json'
+  }), delay || 0);
+}
+function reportEvent(type, detail) {
+  report({ event: Object.assign({ type: type, seq: ++eventSeq }, detail) }, 0);
+}
+
+function bToLeaflet(b) { return [[b[1], b[0]], [b[3], b[2]]]; }
+
+let currentMap = null;   // instancia Leaflet actual
+let app = null;          // API de la instancia (show, setInterval, stop)
+let lastState = {};  // último estado recibido de Python
+
+// Crea el mapa y sus controles con las secciones actuales; devuelve su API
+function start(state, view) {
+  const UI = SECTIONS.ui;
+  const FRAMES = SECTIONS.frames.frames;
+  const CUBE = SECTIONS.frames.cube;
+  const LOSS_COLOR = SECTIONS.frames.lossColor;
+  const PREFETCH_AHEAD = SECTIONS.frames.prefetchAhead;
+  const GLOBAL_BOUNDS = bToLeaflet(SECTIONS.frames.globalBounds);
+  const QUERY_URL = SECTIONS.query.url;
+  const HIST = SECTIONS.history;
+  const DERIVED = SECTIONS.derived;
+  const HOTSPOTS = SECTIONS.hotspots || {};
+  const LCD = SECTIONS.landcover;
+  const LC_IMG = LCD.img;
+  const LC_TILES = LCD.tiles;
+  const LC_MAXZ = LCD.maxz;
+  const LC_BOUNDS = LCD.bounds;
+  const LC_LEGEND = LCD.legend;
+  const LC_CODES_URL = LCD.codesUrl;
+  const LC_CODES_BYTES = LCD.codesBytes;
+  const LC_GRID_W = LCD.gridW;
+  const LC_GRID_H = LCD.gridH;
+
+  const VIEW_DEBOUNCE = UI.viewDebounce || 400;
+
+  let idx = Math.min(state.idx || 0, FRAMES.length - 1);
+  let playing = false;
+  let timer = null;
+  let interval = state.interval || 600;
+
+  // Mapa
+  const map = currentMap = L.map('map', { preferCanvas: true, zoomSnap: 1, zoomDelta: 1 });
+  L.tileLayer('https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}', {
+    maxZoom: 19, crossOrigin: true
+  }).addTo(map);
+  map.createPane('labels');
+  map.getPane('labels').style.zIndex = 650;
+  map.getPane('labels').style.pointerEvents='none';
+  L.tileLayer('https://services.arcgisonline.com/ArcGIS/rest/services/Reference/World_Boundaries_and_Places/MapServer/tile/{z}/{y}/{x}', {
+    maxZoom:19, pane:'labels', crossOrigin:true
+  }).addTo(map);
+
+  map.createPane('lcPane');   map.getPane('lcPane').style.zIndex = 350;
+  map.createPane('lossPane'); map.getPane('lossPane').style.zIndex = 400;
+  map.removeControl(map.attributionControl);
+
+  // Overlays: pirámide XYZ si hay servidor de teselas, si no imagen completa
+  function rasterLayer(url, tiled, bounds, maxNativeZoom, pane) {
+    const opts = { opacity:1.0, interactive:false, crossOrigin:true, pane:pane };
+    if (!tiled) return L.imageOverlay(url, bToLeaflet(bounds), opts);
+    return L.tileLayer(url, Object.assign(opts, {
+      bounds: bToLeaflet(bounds), maxNativeZoom: maxNativeZoom, maxZoom: 19, keepBuffer: 1
+    }));
+  }
+  function frameUrl(f) { return f.tiles || f.img; }
+
+  // Precarga en la caché del navegador las imágenes de los frames siguientes
+  const prefetched = new Map();
+  function prefetchAhead(i) {
+    for (let k = 1; k <= PREFETCH_AHEAD; k++) {
+      const f = FRAMES[(i + k) % FRAMES.length];
+      if (!f.img || prefetched.has(f.img)) continue;
+      const im = new Image();
+      im.src = f.img;
+      prefetched.set(f.img, im);
+    }
+  }
+
+  // Capa canvas: ImageOverlay cuyo elemento es un <canvas> (como L.SVGOverlay con <svg>)
+  const CanvasOverlay = L.ImageOverlay.extend({
+    _initImage: function () {
+      const el = this._image = this._url;
+      L.DomUtil.addClass(el, 'leaflet-image-layer');
+      if (this._zoomAnimated) L.DomUtil.addClass(el, 'leaflet-zoom-animated');
+      el.onselectstart = L.Util.falseFn;
+      el.onmousemove = L.Util.falseFn;
+    }
+  });
+
+  // ===== Cubo de bits: se descarga una vez y cada frame se pinta en local =====
+  let cubeBits = null, cubeCanvas = null, cubeCtx = null, cubeImg = null, cubePx = null;
+  const LOSS_PX = ((LOSS_COLOR[3] << 24) | (LOSS_COLOR[2] << 16) | (LOSS_COLOR[1] << 8) | LOSS_COLOR[0]) >>> 0;
+  if (CUBE) {
+    cubeCanvas = document.createElement('canvas');
+    cubeCanvas.width = CUBE.w; cubeCanvas.height = CUBE.h;
+    cubeCtx = cubeCanvas.getContext('2d');
+    cubeImg = cubeCtx.createImageData(CUBE.w, CUBE.h);
+    cubePx = new Uint32Array(cubeImg.data.buffer);
+  }
+  async function loadCube() {
+    const resp = await fetch(CUBE.url);
+    const body = CUBE.encoding === 'gzip' ? resp.body.pipeThrough(new DecompressionStream('gzip')) : resp.body;
+    cubeBits = new Uint8Array(await new Response(body).arrayBuffer());
+    show(idx);
+  }
+  // Pinta la unión (OR) de los planos `planes` del cubo en el canvas
+  function renderCube(planes) {
+    cubePx.fill(0);
+    if (cubeBits) {
+      const rb = CUBE.rowBytes, w = CUBE.w, plane = CUBE.h * rb;
+      for (let y = 0; y < CUBE.h; y++) {
+        const rowOff = y * rb, pxRow = y * w;
+        for (let xb = 0; xb < rb; xb++) {
+          let byte = 0;
+          for (let k = 0; k < planes.length; k++) byte |= cubeBits[planes[k] * plane + rowOff + xb];
+          if (!byte) continue;
+          const x0 = xb * 8;
+          for (let bit = 0; bit < 8; bit++) {
+            if ((byte & (0x80 >> bit)) && x0 + bit < w) cubePx[pxRow + x0 + bit] = LOSS_PX;
+          }
+        }
+      }
+    }
+    cubeCtx.putImageData(cubeImg, 0, 0);
+  }
+
+  let overlay = CUBE
+    ? new CanvasOverlay(cubeCanvas, bToLeaflet(CUBE.bounds), { opacity:1.0, interactive:false, pane:'lossPane' }).addTo(map)
+    : rasterLayer(frameUrl(FRAMES[idx]), !!FRAMES[idx].tiles, FRAMES[idx].bounds,
+                  FRAMES[idx].maxNativeZoom, 'lossPane').addTo(map);
+  if (CUBE) loadCube();
+  let rect = L.rectangle(bToLeaflet(FRAMES[idx].bounds), {
+    color:'#fff', weight:3, fill:false, pane:'lossPane'
+  }).addTo(map);
+  if (view) map.setView(view.center, view.zoom, { animate: false });
+  else map.fitBounds(GLOBAL_BOUNDS, { padding:[10,10] });
+
+  let lcLayer = null;
+  if (LC_IMG && LC_BOUNDS) {
+    lcLayer = rasterLayer(LC_IMG, !!LC_TILES, LC_BOUNDS, LC_MAXZ, 'lcPane');
+  }
+
+  // ===== Leyenda LC =====
+  let lcLegendCtrl = null;
+  function createLcLegend() {
+    const ctrl = L.control({ position: 'bottomright' });
+    ctrl.onAdd = function () {
+      const div = L.DomUtil.create('div', 'leaflet-control lc-legend');
+      const rows = (Array.isArray(LC_LEGEND) ? LC_LEGEND : []).map(item =>
+        `<div class="row"><span class="swatch" style="background:${item.color}"></span><span>${item.code} – ${item.label}</span></div>`
+      ).join('');
+      div.innerHTML = `<div class="ttl">Land cover</div>${rows}`;
+      return div;
+    };
+    return ctrl;
+  }
+
+  // ===== Inspector LC centrado abajo =====
+  // Rejilla de códigos: asset binario cacheable (fetch también acepta data: URLs)
+  let LC_CODES = null;
+  if (LC_CODES_URL) {
+    fetch(LC_CODES_URL).then(r => r.arrayBuffer()).then(buf => {
+      LC_CODES = LC_CODES_BYTES === 1 ? new Uint8Array(buf) : new Uint16Array(buf);
+    }).catch(() => {});
+  }
+  const LC_LOOKUP = (() => {
+    const m = {};
+    (Array.isArray(LC_LEGEND) ? LC_LEGEND : []).forEach(it => { m[it.code] = {label: it.label, color: it.color}; });
+    return m;
+  })();
+  function lcLatLngToRowCol(lat, lng) {
+    if (!LC_BOUNDS || !LC_GRID_W || !LC_GRID_H) return null;
+    const W = LC_BOUNDS[0], S = LC_BOUNDS[1], E = LC_BOUNDS[2], N = LC_BOUNDS[3];
+    if (lng < W || lng > E || lat < S || lat > N) return null;
+    const col = Math.floor((lng - W) / (E - W) * LC_GRID_W);
+    const row = Math.floor((N - lat) / (N - S) * LC_GRID_H);
+    if (col < 0 || col >= LC_GRID_W || row < 0 || row >= LC_GRID_H) return null;
+    return {row, col};
+  }
+  const LcInfo = L.Control.extend({
+    options: { position: 'bottomleft' },
+    onAdd: function(map) {
+      const outer = L.DomUtil.create('div', 'lc-info-outer');
+      const inner = L.DomUtil.create('div', 'lc-info', outer);
+      inner.innerHTML = '<div class="lc-info-inner">Pasa el cursor sobre el mapa</div>';
+      L.DomEvent.disableClickPropagation(inner);
+      L.DomEvent.disableScrollPropagation(inner);
+      this._inner = inner;
+      return outer;
+    },
+    getContainerEl: function() { return this._inner; }
+  });
+  const lcInfoCtrl = new LcInfo().addTo(map);
+  // ===== Historial de pérdida por píxel: bloques (history.py) pedidos al pasar el cursor =====
+  const histBlocks = new Map();   // bloque → {bits, first, counts, bw} | {pending} | {failed}
+  let lastLatLng = null;
+  async function loadHistBlock(k, by, bx) {
+    histBlocks.set(k, { pending: true });
+    try {
+      const resp = await fetch(HIST.urls[k]);
+      const body = HIST.encoding === 'gzip' ? resp.body.pipeThrough(new DecompressionStream('gzip')) : resp.body;
+      const buf = await new Response(body).arrayBuffer();
+      const bw = Math.min(HIST.block, HIST.w - bx * HIST.block);
+      const n = Math.min(HIST.block, HIST.h - by * HIST.block) * bw;
+      histBlocks.set(k, {
+        bits: HIST.bytes === 1 ? new Uint8Array(buf, 0, n) : new Uint16Array(buf, 0, n),
+        first: new Uint8Array(buf, HIST.bytes * n, n),
+        counts: new Uint8Array(buf, (HIST.bytes + 1) * n, HIST.labels.length * n), n: n, bw: bw
+      });
+    } catch (err) {
+      histBlocks.set(k, { failed: true });
+    }
+    if (lastLatLng) updateLcInfo(lastLatLng);
+  }
+  function histLookup(lat, lng) {
+    if (!HIST) return null;
+    const b = HIST.bounds;   // [W,S,E,N]
+    const col = Math.floor((lng - b[0]) / (b[2] - b[0]) * HIST.w);
+    const row = Math.floor((b[3] - lat) / (b[3] - b[1]) * HIST.h);
+    if (col < 0 || col >= HIST.w || row < 0 || row >= HIST.h) return null;
+    const by = Math.floor(row / HIST.block), bx = Math.floor(col / HIST.block), k = by * HIST.cols + bx;
+    const blk = histBlocks.get(k);
+    if (!blk) { loadHistBlock(k, by, bx); return { loading: true }; }
+    if (blk.pending) return { loading: true };
+    if (blk.failed) return null;
+    const i = (row - by * HIST.block) * blk.bw + (col - bx * HIST.block);
+    // píxeles nativos con pérdida de la celda en cada periodo (plano p del bloque)
+    const px = HIST.labels.map((_, p) => blk.counts[p * blk.n + i] * HIST.countScale);
+    return { bits: blk.bits[i], first: blk.first[i], px: px };
+  }
+  function joinEs(items) {
+    return items.length < 2 ? items.join('') : items.slice(0, -1).join(', ') + ' y ' + items[items.length - 1];
+  }
+  function histInfoHtml(latlng) {
+    const h = histLookup(latlng.lat, latlng.lng);
+    if (!h) return '';
+    if (h.loading) return 'Cargando historial…';
+    if (h.first === HIST.noLoss) return 'Sin pérdida registrada';
+    const periods = HIST.labels
+      .map((label, i) => (h.bits >> i) & 1 ? (i === idx ? `<b>${label}</b>` : label) +
+        (HIST.pxHa ? ` (${fmtHa(h.px[i] * HIST.pxHa)})` : '') : null)
+      .filter(p => p !== null);
+    return `Perdido en ${joinEs(periods)}`;
+  }
+  function lcInfoHtml(latlng) {
+    if (!LC_CODES) return LC_CODES_URL ? 'Cargando land cover…' : '';
+    if (!lcLayer || !map.hasLayer(lcLayer)) return '';
+    const rc = lcLatLngToRowCol(latlng.lat, latlng.lng);
+    if (!rc) return '';
+    const code = LC_CODES[rc.row * LC_GRID_W + rc.col];
+    const meta = LC_LOOKUP[code];
+    return meta
+      ? `<span class="sw" style="background:${meta.color}"></span>${code} — ${meta.label}`
+      : `Código ${code}`;
+  }
+  let _lastShown = '';
+  function updateLcInfo(latlng) {
+    lastLatLng = latlng;
+    const parts = [lcInfoHtml(latlng), histInfoHtml(latlng)].filter(p => p);
+    const html = `<div class="lc-info-inner">${parts.length ? parts.join(' · ') : 'Fuera del área'}</div>`;
+    if (html !== _lastShown) {
+      lcInfoCtrl.getContainerEl().innerHTML = html;
+      _lastShown = html;
+    }
+  }
+  map.on('mousemove', (e) => updateLcInfo(e.latlng));
+
+  // ===== Modos: periodo, acumulada hasta el frame, A vs B (PNG derivados en Python, derived.py) =====
+  // El modo sobrevive a la reconstrucción del mapa (va en VALUE)
+  let mode = DERIVED && VALUE.mode ? VALUE.mode : 'period', derivedLayer = null, lossOpacity = 1;
+  // Recorte nativo de la vista (viewport.py; ver updateViewport)
+  let VP = SECTIONS.viewport || null, vpLoss = null, vpLc = null;
+  let [cmpA, cmpB] = VALUE.compare && VALUE.compare[1] < FRAMES.length ? VALUE.compare : [0, FRAMES.length - 1];
+  function derivedUrl() {
+    if (mode === 'cum') return DERIVED.cum[idx];
+    return cmpA < cmpB ? DERIVED.cmp[`${cmpA}-${cmpB}`] : null;   // A debe ser anterior a B
+  }
+  function renderMode() {
+    if (!DERIVED) return;
+    if (mode === 'period') {
+      if (derivedLayer) { map.removeLayer(derivedLayer); derivedLayer = null; }
+      if (!map.hasLayer(overlay)) overlay.addTo(map);
+      return;
+    }
+    if (map.hasLayer(overlay)) map.removeLayer(overlay);
+    const url = derivedUrl();
+    if (!url) {
+      if (derivedLayer) { map.removeLayer(derivedLayer); derivedLayer = null; }
+      return;
+    }
+    if (!derivedLayer) {
+      derivedLayer = L.imageOverlay(url, bToLeaflet(DERIVED.bounds),
+                                    { opacity: lossOpacity, interactive: false, pane: 'lossPane' }).addTo(map);
+    } else {
+      derivedLayer.setUrl(url);
+    }
+  }
+  function modeLabel() {
+    if (mode === 'cum') return DERIVED.cumLabels[idx] + ' (acumulada)';
+    if (mode === 'cmp') return cmpA < cmpB ? `${FRAMES[cmpA].label} vs ${FRAMES[cmpB].label}` : 'A debe ser anterior a B';
+    return FRAMES[idx].label;
+  }
+
+  // ===== Panel flotante dentro del mapa (Leaflet Control) =====
+  let lossOpacityValEl = null;
+  const PanelControl = L.Control.extend({
+    options: { position: 'topright' },
+    onAdd: function(map) {
+      const div = L.DomUtil.create('div', 'panel-control');
+      div.innerHTML = `
+        <div class="section">
+          <h3>Capas</h3>
+          <label class="control-row">
+            <input id="lc-toggle" type="checkbox"> <span>Land cover</span>
+          </label>
+        </div>
+        <div class="section">
+          <h3>Opacidad pérdida de vegetación</h3>
+          <input id="loss-opacity" type="range" min="0" max="1" step="0.05" value="1">
+          <div><small id="loss-opacity-val">100%</small></div>
+        </div>
+        ${DERIVED ? `
+        <div class="section">
+          <h3>Modo</h3>
+          <select id="mode-select">
+            <option value="period">Periodo</option>
+            <option value="cum">Acumulada</option>
+            <option value="cmp">A vs B</option>
+          </select>
+          <div id="cmp-controls" style="display:none; margin-top:6px;">
+            <select id="cmp-a"></select> vs <select id="cmp-b"></select>
+            <div>${DERIVED.legend.map(c =>
+              `<div><span class="swatch" style="background:${c.color}"></span>${c.label}</div>`).join('')}</div>
+          </div>
+        </div>` : ''}
+      `;
+      L.DomEvent.disableClickPropagation(div);
+      L.DomEvent.disableScrollPropagation(div);
+
+      const lcToggle = div.querySelector('#lc-toggle');
+      const lossOpacityEl = div.querySelector('#loss-opacity');
+      lossOpacityValEl = div.querySelector('#loss-opacity-val');
+
+      if (lcToggle) {
+        lcToggle.addEventListener('change', () => {
+          if (!lcLayer) return;
+          if (lcToggle.checked) {
+            lcLayer.addTo(map);
+            if (!lcLegendCtrl && Array.isArray(LC_LEGEND) && LC_LEGEND.length > 0) {
+              lcLegendCtrl = createLcLegend();
+              lcLegendCtrl.addTo(map);
+            }
+          } else {
+            map.removeLayer(lcLayer);
+            if (lcLegendCtrl) {
+              map.removeControl(lcLegendCtrl);
+              lcLegendCtrl = null;
+            }
+          }
+          updateViewport();
+        });
+      }
+
+      if (lossOpacityEl) {
+        const setLossOpacity = (v) => {
+          lossOpacity = v;
+          overlay.setOpacity(v);
+          if (derivedLayer) derivedLayer.setOpacity(v);
+          updateViewport();
+          if (rect) rect.setStyle({opacity: Math.max(0.3, v)});
+          if (lossOpacityValEl) lossOpacityValEl.textContent = Math.round(v*100) + '%';
+        };
+        setLossOpacity(parseFloat(lossOpacityEl.value || '1'));
+        lossOpacityEl.addEventListener('input', (e) => setLossOpacity(parseFloat(e.target.value)));
+      }
+
+      const modeEl = div.querySelector('#mode-select');
+      if (modeEl) {
+        const cmpControls = div.querySelector('#cmp-controls');
+        const aEl = div.querySelector('#cmp-a'), bEl = div.querySelector('#cmp-b');
+        const opts = FRAMES.map((f, i) => `<option value="${i}">${f.label}</option>`).join('');
+        aEl.innerHTML = opts; bEl.innerHTML = opts;
+        aEl.value = cmpA; bEl.value = cmpB; modeEl.value = mode;
+        cmpControls.style.display = mode === 'cmp' ? '' : 'none';
+        const changeMode = () => { show(idx); report({ mode: mode, compare: [cmpA, cmpB] }, 300); };
+        modeEl.addEventListener('change', () => {
+          mode = modeEl.value;
+          cmpControls.style.display = mode === 'cmp' ? '' : 'none';
+          changeMode();
+        });
+        aEl.addEventListener('change', () => { cmpA = parseInt(aEl.value); changeMode(); });
+        bEl.addEventListener('change', () => { cmpB = parseInt(bEl.value); changeMode(); });
+      }
+
+      return div;
+    }
+  });
+  new PanelControl().addTo(map);
+
+  // ===== Consulta por forma dibujada: rectángulo/polígono → /api/ (tablas SAT en Python) =====
+  let queryResult = null, queryCtrl = null;
+  const drawnItems = new L.FeatureGroup().addTo(map);
+  function fmtHa(v) { return v.toLocaleString('es', { maximumFractionDigits: v < 10 ? 2 : 0 }) + ' ha'; }
+  function renderQuery() {
+    if (!queryCtrl) return;
+    const el = queryCtrl.getContainer();
+    if (!queryResult) { el.style.display = 'none'; return; }
+    el.style.display = '';
+    if (queryResult.error) { el.innerHTML = `<div class="ttl">Pérdida en la forma</div>${queryResult.error}`; return; }
+    const cur = FRAMES[idx].label;
+    const rows = queryResult.frames.map(f =>
+      `<div class="row${f.label === cur ? ' cur' : ''}"><span>${f.label}</span><span>${fmtHa(f.ha)}</span></div>`
+    ).join('');
+    const fc = queryResult.frames.find(f => f.label === cur);
+    const cls = fc ? fc.classes.slice(0, 3).map(c =>
+      `<div><span class="sw" style="background:${c.color}"></span>${c.label}: ${fmtHa(c.ha)}</div>`
+    ).join('') : '';
+    el.innerHTML = `<div class="ttl">Pérdida en la forma</div>${rows}${cls ? `<div class="cls">${cls}</div>` : ''}`;
+  }
+  async function runQuery(layer) {
+    const body = layer instanceof L.Rectangle
+      ? (b => ({ bbox: [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()] }))(layer.getBounds())
+      : layer.toGeoJSON().geometry;
+    reportEvent('query', { shape: body });
+    queryResult = { error: 'Calculando…' };
+    renderQuery();
+    try {
+      // text/plain: petición "simple", sin preflight CORS
+      const resp = await fetch(QUERY_URL, { method: 'POST', headers: { 'Content-Type': 'text/plain' }, body: JSON.stringify(body) });
+      queryResult = resp.ok ? await resp.json() : { error: 'Error ' + resp.status };
+    } catch (err) {
+      queryResult = { error: 'Sin conexión con el servidor' };
+    }
+    renderQuery();
+  }
+  if (QUERY_URL && L.Control.Draw) {
+    const shape = { color: '#38bdf8', weight: 2, fillOpacity: 0.08 };
+    map.addControl(new L.Control.Draw({
+      position: 'topleft',
+      draw: { rectangle: { shapeOptions: shape }, polygon: { shapeOptions: shape, allowIntersection: false },
+               polyline: false, circle: false, circlemarker: false, marker: false },
+      edit: { featureGroup: drawnItems, edit: false }
+    }));
+    const QueryPanel = L.Control.extend({
+      options: { position: 'topleft' },
+      onAdd: function() {
+        const div = L.DomUtil.create('div', 'query-panel');
+        div.style.display = 'none';
+        L.DomEvent.disableClickPropagation(div);
+        L.DomEvent.disableScrollPropagation(div);
+        return div;
+      }
+    });
+    queryCtrl = new QueryPanel().addTo(map);
+    map.on(L.Draw.Event.CREATED, (e) => {
+      drawnItems.clearLayers();   // una forma a la vez
+      drawnItems.addLayer(e.layer);
+      runQuery(e.layer);
+    });
+    map.on(L.Draw.Event.DELETED, () => { if (!drawnItems.getLayers().length) { queryResult = null; renderQuery(); } });
+  }
+
+  // ===== Focos: los mayores parches de pérdida del periodo (hotspots.py) =====
+  let hotspotCtrl = null, hotspotMark = null;
+  function renderHotspots() {
+    if (!hotspotCtrl) return;
+    if (hotspotMark) { map.removeLayer(hotspotMark); hotspotMark = null; }
+    const list = HOTSPOTS[FRAMES[idx].label] || [];
+    hotspotCtrl.getContainer().querySelector('.hs-list').innerHTML = list.length
+      ? list.map((h, k) => `<div class="row" data-k="${k}"><span>#${h.rank}</span><span>${fmtHa(h.ha)}</span></div>`).join('')
+      : '<div>Sin pérdida en este periodo</div>';
+  }
+  function jumpToHotspot(h) {
+    const b = bToLeaflet(h.bbox);
+    map.fitBounds(b, { padding: [40, 40], maxZoom: 17 });
+    if (hotspotMark) map.removeLayer(hotspotMark);
+    hotspotMark = L.rectangle(b, { color: '#facc15', weight: 2, fill: false, dashArray: '4 4', pane: 'lossPane' }).addTo(map);
+    reportEvent('hotspot', { label: FRAMES[idx].label, rank: h.rank, bbox: h.bbox });
+  }
+  if (Object.keys(HOTSPOTS).length) {
+    const HotspotPanel = L.Control.extend({
+      options: { position: 'topright' },
+      onAdd: function() {
+        const div = L.DomUtil.create('div', 'hotspot-panel');
+        div.innerHTML = '<details><summary>Focos de pérdida</summary><div class="hs-list"></div></details>';
+        L.DomEvent.disableClickPropagation(div);
+        L.DomEvent.disableScrollPropagation(div);
+        div.querySelector('.hs-list').addEventListener('click', (e) => {
+          const row = e.target.closest('[data-k]');
+          if (row) jumpToHotspot(HOTSPOTS[FRAMES[idx].label][parseInt(row.dataset.k)]);
+        });
+        return div;
+      }
+    });
+    hotspotCtrl = new HotspotPanel().addTo(map);
+  }
+
+  // ===== Animación (controles debajo del mapa) =====
+  const labelEl  = document.getElementById('label');
+  const sliderEl = document.getElementById('slider');
+  const prevBtn  = document.getElementById('prev-btn');
+  const nextBtn  = document.getElementById('next-btn');
+  const toggleBtn= document.getElementById('toggle-btn');
+  const toggleIcon= document.getElementById('toggle-icon');
+  document.getElementById('prev-icon').src = UI.icons.prev;
+  document.getElementById('next-icon').src = UI.icons.next;
+  toggleIcon.src = UI.icons.play;
+  sliderEl.max = FRAMES.length - 1;
+
+
+  function show(i) {
+    idx = ((i % FRAMES.length) + FRAMES.length) % FRAMES.length;
+    const bnds = bToLeaflet(FRAMES[idx].bounds);
+    if (CUBE) {
+      renderCube([FRAMES[idx].plane]);
+    } else {
+      overlay.setUrl(frameUrl(FRAMES[idx]));
+      if (overlay.setBounds) overlay.setBounds(bnds);
+      prefetchAhead(idx);
+    }
+    rect.setBounds(bnds);
+    sliderEl.value = idx;
+    labelEl.textContent = DERIVED ? modeLabel() : FRAMES[idx].label;
+    renderMode();
+    renderQuery();
+    renderHotspots();
+    updateViewport();
+    VALUE.idx = idx;   // se envía con el próximo report (no en cada paso de la animación)
+  }
+  // ===== Recorte nativo de la vista (viewport.py) =====
+  // Python lo manda tras cada moveend si la capa global se ve más gruesa que la
+  // pantalla; cubre la vista con margen, así que mientras la vista quede dentro
+  // sustituye a la capa global (que se oculta con opacidad 0, sin quitarla).
+  function vpCovers(part) {
+    return part && L.latLngBounds(bToLeaflet(part.bounds)).contains(map.getBounds());
+  }
+  function vpLayer(layer, part, on, pane, opacity) {
+    if (!on) { if (layer) map.removeLayer(layer); return null; }
+    if (!layer) {
+      return L.imageOverlay(part.img, bToLeaflet(part.bounds),
+                            { opacity: opacity, interactive: false, pane: pane }).addTo(map);
+    }
+    if (layer._url !== part.img) { layer.setUrl(part.img); layer.setBounds(bToLeaflet(part.bounds)); }
+    layer.setOpacity(opacity);
+    return layer;
+  }
+  function updateViewport() {
+    const lossOn = !!(VP && VP.idx === idx && mode === 'period' && vpCovers(VP.loss));
+    vpLoss = vpLayer(vpLoss, lossOn && VP.loss, lossOn, 'lossPane', lossOpacity);
+    if (mode === 'period') overlay.setOpacity(lossOn ? 0 : lossOpacity);
+    const lcOn = !!(VP && lcLayer && map.hasLayer(lcLayer) && vpCovers(VP.lc));
+    vpLc = vpLayer(vpLc, lcOn && VP.lc, lcOn, 'lcPane', 1);
+    if (lcLayer) lcLayer.setOpacity(lcOn ? 0 : 1);
+  }
+
+  show(idx);
+
+  function toggle() {
+    if (!playing) {
+      playing = true;
+      toggleIcon.src = UI.icons.pause;
+      timer = setInterval(() => show(idx + 1), interval);
+    } else {
+      playing = false;
+      toggleIcon.src = UI.icons.play;
+      clearInterval(timer);
+      report({}, 0);   // al pausar, Python recibe el frame en pantalla
+    }
+  }
+  prevBtn.onclick   = (e) => { e.preventDefault(); show(idx - 1); report({}, 300); };
+  nextBtn.onclick   = (e) => { e.preventDefault(); show(idx + 1); report({}, 300); };
+  sliderEl.oninput  = (e) => { show(parseInt(e.target.value)); report({}, 300); };
+  toggleBtn.onclick = (e) => { e.preventDefault(); toggle(); };  // ← ¡IMPRESCINDIBLE!
+
+  // Vista y frame de vuelta a Python (con debounce: arrastrar el mapa no lanza un rerun por píxel)
+  map.on('moveend', () => {
+    const b = map.getBounds(), c = map.getCenter();
+    updateViewport();   // si la vista sale del recorte vuelve la capa global hasta que llegue el nuevo
+    report({ view: { bounds: [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()],
+                     center: [c.lat, c.lng], zoom: map.getZoom() } }, VIEW_DEBOUNCE);
+  });
+
+  return {
+    show: (i) => show(i),
+    setViewport: (vp) => { VP = vp; updateViewport(); },
+    setInterval: (ms) => {
+      interval = ms;
+      if (playing) { clearInterval(timer); timer = setInterval(() => show(idx + 1), interval); }
+    },
+    stop: () => { clearInterval(timer); map.remove(); if (currentMap === map) currentMap = null; }
+  };
+}
+
+// ===== Render desde Python =====
+window.addEventListener('message', (ev) => {
+  const msg = ev.data;
+  if (!msg || msg.type !== 'streamlit:render') return;
+  const args = msg.args || {};
+  const hashes = args.hashes || {};
+  let changed = false, liveChanged = false;
+  for (const [name, data] of Object.entries(args.sections || {})) {
+    SECTIONS[name] = data;
+    HAVE[name] = hashes[name];
+    if (LIVE.has(name)) liveChanged = true; else changed = true;
+  }
+  for (const name of Object.keys(HAVE)) {
+    if (!(name in hashes)) { delete HAVE[name]; delete SECTIONS[name]; changed = true; }
+  }
+  const state = args.state || {};
+  if (!Object.keys(hashes).every(n => HAVE[n] === hashes[n])) {
+    report({}, 0);   // faltan secciones (iframe recién montado): Python las reenvía
+    return;
+  }
+  if (changed || !app) {
+    // Datos nuevos: se reconstruye la instancia conservando la vista si es la misma área
+    const view = currentMap && lastState.area === state.area
+      ? { center: currentMap.getCenter(), zoom: currentMap.getZoom() } : null;
+    if (app) app.stop();
+    const sameArea = app && lastState.area === state.area;
+    app = start(Object.assign({}, state, { idx: sameArea ? VALUE.idx : state.idx }), view);
+    VALUE.area = state.area;
+    report({ idx: VALUE.idx }, 0);   // acuse de las secciones recibidas
+    resizeEverything();
+  } else {
+    if (state.idx !== lastState.idx && state.idx !== VALUE.idx) app.show(state.idx);
+    if (state.interval !== lastState.interval) app.setInterval(state.interval);
+    // Sin acuse: el "have" nuevo viaja con el próximo report (un rerun menos por movimiento)
+    if (liveChanged) app.setViewport(SECTIONS.viewport || null);
+  }
+  lastState = state;
+});
+
+// ===== Redimensionado fiable del iframe + mapa (un solo bloque) =====
+function totalOuterHeight(sel){
+  const el = document.querySelector(sel);
+  if(!el) return 0;
+  const cs = getComputedStyle(el);
+  return el.offsetHeight + parseFloat(cs.marginTop||0) + parseFloat(cs.marginBottom||0);
+}
+function setMapHeight(){
+  const headerH  = totalOuterHeight('.header-row');
+  const controlsH= totalOuterHeight('.controls');
+  const padding  = 24;
+  const available = Math.max(380, window.innerHeight - (headerH + controlsH + padding));
+  const mapDiv = document.getElementById('map');
+  if (mapDiv) mapDiv.style.height = available + 'px';
+  if (currentMap) currentMap.invalidateSize(true);
+}
+function getDocHeight(){
+  const b = document.body, d = document.documentElement;
+  return Math.max(
+    b.scrollHeight, b.offsetHeight, b.getBoundingClientRect().height,
+    d.clientHeight, d.scrollHeight, d.offsetHeight, d.getBoundingClientRect().height
+  );
+}
+function postResize(h){
+  sendToStreamlit('streamlit:setFrameHeight', { height: h });
+}
+function resizeEverything(){
+  setMapHeight();
+  requestAnimationFrame(()=>postResize(getDocHeight()));
+}
+
+window.addEventListener('load',  resizeEverything);
+window.addEventListener('resize', resizeEverything);
+try { new ResizeObserver(()=>resizeEverything()).observe(document.body); } catch(e) {}
+setTimeout(resizeEverything, 100);
+setTimeout(resizeEverything, 350);
+setTimeout(resizeEverything, 900);
+
+sendToStreamlit('streamlit:componentReady', {});
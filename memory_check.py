@@ -0,0 +1,122 @@
+# memory_check.py
+"""
+Comprueba que los loaders respetan el presupuesto de memoria: genera un GeoTIFF
+sintético grande (escrito por bloques, sin tenerlo nunca entero en RAM) y
+carga su índice de máscara en un subproceso limpio con el presupuesto dado,
+midiendo el pico de RSS por encima de la línea base tras los imports.
+Compara la lectura en memoria (presupuesto infinito) con la lectura por bloques.
+Sale con código 1 si el pico supera salida + presupuesto + holgura o si las
+dos lecturas no dan los mismos píxeles de pérdida.
+
+Uso:
+    python memory_check.py --size 16000 --budget-mb 32
+    python memory_check.py --size 12000 --crs EPSG:32617   # con reproyección
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+SLACK_MB = 48   # GDAL (caché de bloques, VRT), fragmentación del heap
+
+
+def write_synthetic(path: str, size: int, crs: str = "EPSG:4326", seed: int = 0):
+    """Máscara uint8 size×size (teselada, deflate) con manchas de pérdida, escrita por franjas."""
+    rng = np.random.default_rng(seed)
+    if crs == "EPSG:4326":
+        transform = from_origin(-78.3, 8.8, 0.6 / size, 0.6 / size)
+    else:
+        transform = from_origin(200_000, 970_000, 60_000 / size, 60_000 / size)
+    profile = dict(driver="GTiff", width=size, height=size, count=1, dtype="uint8", crs=crs,
+                   transform=transform, nodata=255, tiled=True, blockxsize=512, blockysize=512,
+                   compress="deflate")
+    with rasterio.open(path, "w", **profile) as dst:
+        for r0 in range(0, size, 512):
+            h = min(512, size - r0)
+            band = (rng.random((h, size), dtype=np.float32) > 0.97).astype(np.uint8)
+            band[:, :8] = 255   # algo de nodata
+            dst.write(band, 1, window=Window(0, r0, size, h))
+
+
+def _rss_kb() -> int:
+    """RSS actual (kB); sin /proc se usa el pico, que sobrestima la línea base."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _child(path: str, max_pixels: int, budget: int):
+    """Se ejecuta en el subproceso: carga el índice y devuelve pico y salida (bytes)."""
+    import rasters
+    base = _rss_kb()
+    t0 = time.perf_counter()
+    idx, _bounds = rasters.load_mask_index_and_bounds(path, max_pixels, budget=budget)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"peak": (peak - base) * 1024, "output": int(idx.nbytes), "shape": list(idx.shape),
+                      "loss": int(idx.sum(dtype=np.int64)), "seconds": time.perf_counter() - t0}))
+
+
+def measure(path: str, max_pixels: int, budget: int) -> dict:
+    env = dict(os.environ, GDAL_CACHEMAX=str(max(8, budget // 2**21)) if budget < 2**40 else "64")
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", path, str(max_pixels), str(budget)],
+        env=env, check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    if argv is None and len(sys.argv) > 1 and sys.argv[1] == "--child":
+        _child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        return 0
+    ap = argparse.ArgumentParser(description="Pico de memoria de los loaders con y sin presupuesto.")
+    ap.add_argument("--size", type=int, default=16000, help="lado del ráster sintético (px)")
+    ap.add_argument("--crs", default="EPSG:4326")
+    ap.add_argument("--budget-mb", type=float, default=32)
+    ap.add_argument("--max-pixels", type=int, default=64_000_000)
+    ap.add_argument("--path", help="usar este GeoTIFF en vez de generar uno")
+    args = ap.parse_args(argv)
+    budget = int(args.budget_mb * 2**20)
+
+    with tempfile.TemporaryDirectory(prefix="darien-mem-") as tmp:
+        path = args.path
+        if path is None:
+            path = os.path.join(tmp, "synthetic.tif")
+            t0 = time.perf_counter()
+            write_synthetic(path, args.size, args.crs)
+            print(f"sintético {args.size}x{args.size} {args.crs} ({os.path.getsize(path) / 2**20:.1f} MB en disco, "
+                  f"{time.perf_counter() - t0:.1f}s)")
+        full = measure(path, args.max_pixels, 2**62)
+        streamed = measure(path, args.max_pixels, budget)
+
+    mb = 2**20
+    for name, r in (("en memoria", full), (f"bloques ({args.budget_mb:g} MB)", streamed)):
+        print(f"{name:>20}: pico {r['peak'] / mb:8.1f} MB  salida {r['output'] / mb:7.1f} MB  "
+              f"{r['shape'][0]}x{r['shape'][1]}  {r['seconds']:.2f}s")
+    same = full["loss"] == streamed["loss"] and full["shape"] == streamed["shape"]
+    if not same:
+        print(f"FALLO: la lectura por bloques no coincide con la lectura en memoria "
+              f"({full['loss']} vs {streamed['loss']} píxeles de pérdida)")
+    limit = streamed["output"] + budget + SLACK_MB * mb
+    ok = streamed["peak"] <= limit
+    print(f"{'OK' if ok else 'FALLO'}: pico por bloques {streamed['peak'] / mb:.1f} MB "
+          f"{'≤' if ok else '>'} salida + presupuesto + {SLACK_MB} MB = {limit / mb:.1f} MB")
+    return 0 if ok and same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
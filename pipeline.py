@@ -0,0 +1,214 @@
+# pipeline.py
+"""
+Preparación en paralelo de los frames de pérdida (leer, reproyectar, colorizar,
+codificar). GDAL y Pillow sueltan el GIL en lo caro, así que un pool de hilos
+escala con los núcleos; con DARIEN_FRAME_EXECUTOR=process se usan procesos.
+El orden de salida es siempre el de la entrada (el de LABELS en el visor) y se
+registran los segundos por etapa y por frame.
+
+FrameLoader es la variante perezosa del visor: carga un frame cuando se pide
+(el actual primero) y deja en cola los siguientes en orden de reproducción.
+
+Uso (medir el arranque en frío con N workers):
+    python pipeline.py --cold --workers 4
+"""
+import argparse
+import glob
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import artifact_cache
+from rasters import DEFAULT_PALETTE, MAX_PIXELS, Palette
+
+FRAME_WORKERS = int(os.environ.get("DARIEN_FRAME_WORKERS", "0")) or min(8, os.cpu_count() or 1)
+FRAME_EXECUTOR = os.environ.get("DARIEN_FRAME_EXECUTOR", "thread")   # thread | process
+PREFETCH_AHEAD = int(os.environ.get("DARIEN_PREFETCH_AHEAD", "2"))    # frames por delante del actual
+
+STAGES = ("cache", "read", "warp", "colorize", "encode", "store")
+
+
+def _prepare(path: str, max_pixels: int, cache_root=None, palette: Palette = DEFAULT_PALETTE):
+    """Un frame + sus tiempos por etapa. Función de módulo para poder enviarla a procesos."""
+    cache = artifact_cache.ArtifactCache(cache_root) if cache_root else None
+    timings = {}
+    t0 = time.perf_counter()
+    art = artifact_cache.load_frame(path, max_pixels, cache, timings=timings, palette=palette)
+    timings["total"] = time.perf_counter() - t0
+    return art, timings
+
+
+def prepare_frames(paths, max_pixels: int = MAX_PIXELS, workers: int = FRAME_WORKERS,
+                   executor: str = FRAME_EXECUTOR, cache_root: str = None, palette: Palette = DEFAULT_PALETTE):
+    """
+    Frames de paths (en el mismo orden) preparados en un pool.
+    Devuelve (lista de artefactos de artifact_cache.load_frame, informe) donde el
+    informe es {"frames": [{"path", etapa: s, "total": s}, ...], "wall": s, "workers", "executor"}.
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError(f"Executor no soportado: {executor}")
+    paths = list(paths)
+    workers = max(1, min(workers, len(paths) or 1))
+    pool_cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+    t0 = time.perf_counter()
+    if workers == 1:
+        results = [_prepare(p, max_pixels, cache_root, palette) for p in paths]
+    else:
+        n = len(paths)
+        with pool_cls(max_workers=workers) as pool:
+            results = list(pool.map(_prepare, paths, [max_pixels] * n, [cache_root] * n, [palette] * n))
+    report = {
+        "frames": [dict(timings, path=p) for p, (_art, timings) in zip(paths, results)],
+        "wall": time.perf_counter() - t0,
+        "workers": workers,
+        "executor": executor,
+    }
+    return [art for art, _timings in results], report
+
+
+class FrameLoader:
+    """
+    Frames bajo demanda sobre un pool de hilos compartido. get(i) devuelve el
+    frame i (esperando si hace falta) y encola los PREFETCH_AHEAD siguientes en
+    orden de reproducción (con vuelta al inicio, como el player).
+    Solo guarda lo que sirve el visor (bounds, imagen codificada e índice).
+    """
+
+    def __init__(self, paths, max_pixels: int = MAX_PIXELS, workers: int = FRAME_WORKERS,
+                 ahead: int = PREFETCH_AHEAD, palette: Palette = DEFAULT_PALETTE):
+        self.paths = list(paths)
+        self.max_pixels = max_pixels
+        self.palette = palette
+        self.ahead = ahead
+        self.timings = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="darien-frames")
+
+    def _load(self, path):
+        art, timings = _prepare(path, self.max_pixels, palette=self.palette)
+        self.timings[path] = timings
+        return {"bounds": art["bounds"], "image": art["image"], "index": art["index"]}
+
+    def submit(self, i: int):
+        path = self.paths[i % len(self.paths)]
+        with self._lock:
+            fut = self._futures.get(path)
+            new = fut is None
+            if new and not self._closed:
+                fut = self._futures[path] = self._pool.submit(self._load, path)
+        if fut is None:   # loader cerrado: se carga en el hilo que lo pide, sin guardarlo
+            fut = Future()
+            try:
+                fut.set_result(self._load(path))
+            except Exception as exc:  # noqa: BLE001 — lo recibe quien llame a result()
+                fut.set_exception(exc)
+            return fut
+        if new:   # fuera del lock: si ya terminó, el callback corre aquí mismo
+            fut.add_done_callback(lambda f, path=path: self._forget_failed(path, f))
+        return fut
+
+    def _forget_failed(self, path, fut):
+        """Un frame que falló no se queda en _futures: el siguiente get lo reintenta."""
+        if fut.cancelled() or fut.exception() is not None:
+            with self._lock:
+                if self._futures.get(path) is fut:
+                    del self._futures[path]
+
+    def prefetch(self, i: int, ahead: int = None):
+        """Encola el frame i y los `ahead` siguientes sin esperar (nada si el loader está cerrado)."""
+        if self._closed:
+            return
+        for k in range((self.ahead if ahead is None else ahead) + 1):
+            self.submit(i + k)
+
+    def get(self, i: int) -> dict:
+        fut = self.submit(i)
+        self.prefetch(i + 1, self.ahead - 1)
+        return fut.result()
+
+    def get_all(self, start: int = 0) -> list:
+        """Todos los frames (orden de paths), encolados empezando por start."""
+        n = len(self.paths)
+        futs = {(start + k) % n: self.submit(start + k) for k in range(n)}
+        return [futs[i].result() for i in range(n)]
+
+    def adopt(self, other: "FrameLoader", paths):
+        """Reutiliza los frames de paths que other ya cargó (al recargar un área, los que no cambiaron)."""
+        paths = set(paths)
+        with other._lock:
+            done = {p: f for p, f in other._futures.items() if p in paths and f.done() and not f.exception()}
+        with self._lock:
+            for p, f in done.items():
+                self._futures.setdefault(p, f)
+
+    def loaded(self) -> int:
+        with self._lock:
+            return sum(f.done() for f in self._futures.values())
+
+    def nbytes(self) -> int:
+        """Bytes en memoria de los frames ya cargados (imagen + índice; los memmap no cuentan)."""
+        with self._lock:
+            done = [f.result() for f in self._futures.values() if f.done() and not f.exception()]
+        total = 0
+        for art in done:
+            total += art["image"].nbytes
+            index = art["index"]
+            if index is not None and not isinstance(index, np.memmap):
+                total += index.nbytes
+        return total
+
+    def close(self):
+        """
+        Descarta lo cargado y cierra el pool (sin esperar a lo que esté en
+        curso). Quien aún tenga este loader puede seguir pidiendo frames: se
+        cargan en su propio hilo y no se guardan.
+        """
+        with self._lock:
+            self._closed = True
+            self._futures.clear()
+        self._pool.shutdown(wait=False)
+
+
+def stage_totals(report) -> dict:
+    """Segundos acumulados por etapa (suma de todos los frames)."""
+    keys = [s for s in STAGES + ("total",) if any(s in f for f in report["frames"])]
+    return {s: sum(f.get(s, 0.0) for f in report["frames"]) for s in keys}
+
+
+def format_report(report) -> str:
+    cols = [s for s in STAGES + ("total",) if any(s in f for f in report["frames"])]
+    lines = ["frame".ljust(40) + "".join(c.rjust(10) for c in cols)]
+    for f in report["frames"]:
+        lines.append(os.path.basename(f["path"]).ljust(40) + "".join(f"{f.get(c, 0.0):>10.3f}" for c in cols))
+    tot = stage_totals(report)
+    lines.append("SUMA".ljust(40) + "".join(f"{tot[c]:>10.3f}" for c in cols))
+    lines.append(f"pared {report['wall']:.3f}s con {report['workers']} workers ({report['executor']})")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Prepara los frames en paralelo y muestra tiempos por etapa.")
+    ap.add_argument("paths", nargs="*")
+    ap.add_argument("--max-pixels", type=int, default=MAX_PIXELS)
+    ap.add_argument("--workers", type=int, default=FRAME_WORKERS)
+    ap.add_argument("--executor", choices=("thread", "process"), default=FRAME_EXECUTOR)
+    ap.add_argument("--cold", action="store_true", help="usar una caché vacía temporal (arranque en frío)")
+    args = ap.parse_args(argv)
+
+    paths = args.paths or sorted(glob.glob("mask_loss/*.tif"))
+    if args.cold:
+        with tempfile.TemporaryDirectory(prefix="darien-cold-") as root:
+            _arts, report = prepare_frames(paths, args.max_pixels, args.workers, args.executor, root)
+    else:
+        _arts, report = prepare_frames(paths, args.max_pixels, args.workers, args.executor)
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,816 @@
+# rasters.py
+"""
+Utilidades ráster compartidas por el visor (code.py) y los módulos auxiliares:
+paleta de land cover, color de las máscaras de pérdida, colorizado a RGBA y
+lectura diezmada/por ventana de GeoTIFF (aprovecha overviews internas).
+No importa streamlit para poder usarse desde scripts y servidores auxiliares.
+"""
+import contextlib
+import functools
+import hashlib
+import io
+import math
+import os
+import threading
+import time
+import warnings
+from dataclasses import dataclass
+
+import numpy as np
+import rasterio
+from rasterio.warp import (
+    calculate_default_transform,
+    reproject,
+    Resampling,
+    transform,
+    transform_bounds,
+)
+from rasterio.transform import array_bounds
+from rasterio.windows import Window, from_bounds
+from PIL import Image
+
+MAX_PIXELS = 5_000_000  # controla submuestreo para fluidez
+DST_CRS = "EPSG:4326"
+# Memoria de trabajo de los loaders (aparte de la salida): por encima se lee por bloques
+MEMORY_BUDGET = int(float(os.environ.get("DARIEN_MEMORY_BUDGET_MB", "256")) * 2**20)
+# Submuestreo: "aggregate" (máscaras: OR por celda; land cover: clase mayoritaria) o "nearest"
+DOWNSAMPLE = os.environ.get("DARIEN_DOWNSAMPLE", "aggregate")
+
+# Color de la pérdida de vegetación (RGBA)
+MASK_COLOR = (255, 59, 48, 255)
+# Paleta índice → RGBA de las máscaras: 0 transparente, 1 pérdida
+MASK_PALETTE = np.array([(0, 0, 0, 0), MASK_COLOR], dtype=np.uint8)
+
+# Paleta Copernicus + utilidades
+LANDCOVER_CLASSES = [
+    (0,   "#282828", "Desconocido"),
+    (20,  "#ffbb22", "Arbustos"),
+    (30,  "#84F58C", "Vegetación herbácea"),
+    (40,  "#EBEB86", "Cultivos / agricultura"),
+    (50,  "#b727f5", "Urbano / construido"),
+    (60,  "#b4b4b4", "Desnudo / vegetación escasa"),
+    (70,  "#f0f0f0", "Nieve y hielo"),
+    (80,  "#0032c8", "Cuerpos de agua permanentes"),
+    (90,  "#0096a0", "Humedal herbáceo"),
+    (100, "#fae6a0", "Musgo y líquenes"),
+    (111, "#58481f", "Bosque cerrado, coníferas perennes"),
+    (112, "#009900", "Bosque cerrado, hoja perenne de amplio espectro"),
+    (113, "#70663e", "Bosque cerrado, hoja caduca de aguja"),
+    (114, "#00cc00", "Bosque cerrado, hoja caduca de amplio espectro"),
+    (115, "#4e751f", "Bosque cerrado, mixto"),
+    (116, "#007800", "Bosque cerrado, otro"),
+    (121, "#666000", "Bosque abierto, coníferas perennes"),
+    (122, "#8db400", "Bosque abierto, hoja perenne de amplio espectro"),
+    (123, "#8d7400", "Bosque abierto, hoja caduca de aguja"),
+    (124, "#a0dc00", "Bosque abierto, hoja caduca de amplio espectro"),
+    (125, "#929900", "Bosque abierto, mixto"),
+    (126, "#648c00", "Bosque abierto, otro"),
+    (200, "#000080", "Océanos, mares"),
+]
+
+
+def _hex_to_rgb(h: str):
+    h = h.strip()
+    if not h.startswith("#"):
+        h = "#" + h
+    return tuple(int(h[i:i+2], 16) for i in (1, 3, 5))
+
+
+@dataclass(frozen=True)
+class Palette:
+    """
+    Colores de un área: color de la pérdida (RGBA) y clases land cover
+    ((code, hex, label), ...). Inmutable y hashable: forma parte de las claves
+    de caché (LUTs, artefactos en disco, teselas).
+    """
+    mask_color: tuple = MASK_COLOR
+    landcover_classes: tuple = tuple(LANDCOVER_CLASSES)
+
+    @functools.cached_property
+    def key(self) -> str:
+        return hashlib.sha1(repr((self.mask_color, self.landcover_classes)).encode("utf-8")).hexdigest()[:10]
+
+    @functools.cached_property
+    def mask_palette(self) -> np.ndarray:
+        """Índice → RGBA de las máscaras: 0 transparente, 1 pérdida."""
+        pal = np.array([(0, 0, 0, 0), self.mask_color], dtype=np.uint8)
+        pal.setflags(write=False)
+        return pal
+
+
+DEFAULT_PALETTE = Palette()
+
+
+def valid_mask(band: np.ndarray, nodata=None) -> np.ndarray:
+    """Píxeles válidos: distintos de nodata y, si la banda es flotante, no NaN."""
+    valid = np.ones(band.shape, dtype=bool)
+    if np.issubdtype(band.dtype, np.floating):
+        valid &= ~np.isnan(band)
+    if nodata is not None:
+        valid &= band != nodata
+    return valid
+
+
+def mask_index(band: np.ndarray, nodata=None) -> np.ndarray:
+    """Máscara 1 banda → índice uint8 de MASK_PALETTE (1 donde >0 y válido)."""
+    return (valid_mask(band, nodata) & (band > 0)).view(np.uint8)
+
+
+def colorize_mask(band: np.ndarray, valid: np.ndarray, palette: Palette = DEFAULT_PALETTE) -> np.ndarray:
+    """Máscara 1 banda → RGBA: >0 con el color de pérdida, resto transparente."""
+    return palette.mask_palette[(valid & (band > 0)).view(np.uint8)]
+
+
+NO_CODE = 65535   # código sin clase en los arrays de as_code_array
+
+
+def code_nodata(nodata):
+    """
+    Valor de nodata en un array de as_code_array: el propio si es un código
+    representable (entero 0..65534) y NO_CODE si no (negativo, decimal, NaN).
+    None si no hay nodata.
+    """
+    if nodata is None:
+        return None
+    if float(nodata).is_integer() and 0 <= nodata < NO_CODE:
+        return int(nodata)
+    return NO_CODE
+
+
+def as_code_array(codes: np.ndarray, nodata=None) -> np.ndarray:
+    """
+    Códigos categóricos como uint8/uint16. Otros tipos (enteros con signo, flotantes)
+    se llevan a uint16 y lo que no es un código representable (NaN, negativos,
+    decimales) cae en NO_CODE, que no tiene clase. nodata pasa a code_nodata(nodata):
+    quien compare con nodata después debe hacerlo con ese valor.
+    """
+    if codes.dtype in (np.uint8, np.uint16):
+        return codes
+    ok = (codes >= 0) & (codes < NO_CODE)
+    if np.issubdtype(codes.dtype, np.floating):
+        ok &= codes == np.floor(codes)
+    out = np.where(ok, codes, NO_CODE).astype(np.uint16)
+    if nodata is not None:
+        out[codes == nodata] = code_nodata(nodata)   # NaN nunca es igual: ya cae en NO_CODE
+    return out
+
+
+@functools.lru_cache(maxsize=8)
+def landcover_lut(size: int = 256, nodata=None, palette: Palette = DEFAULT_PALETTE) -> np.ndarray:
+    """
+    LUT RGBA (size, 4) compilada desde las clases de palette: lut[código] = color.
+    Los códigos sin clase y el valor nodata quedan transparentes. Solo lectura.
+    """
+    lut = np.zeros((size, 4), dtype=np.uint8)
+    for code, hexcolor, _label in palette.landcover_classes:
+        if code < size:
+            lut[code] = (*_hex_to_rgb(hexcolor), 255)
+    nd = code_nodata(nodata)
+    if nd is not None and nd < size:
+        lut[nd] = 0
+    lut.setflags(write=False)
+    return lut
+
+
+def colorize_landcover(codes: np.ndarray, nodata=None, valid=None, palette: Palette = DEFAULT_PALETTE):
+    """
+    Códigos land cover → (RGBA, set de códigos presentes) en una pasada:
+    color con un gather lut[codes] y leyenda con un único bincount.
+    valid (bool, opcional) apaga píxeles extra (p. ej. fuera de la huella).
+    """
+    codes = as_code_array(codes, nodata)
+    size = 256 if codes.dtype == np.uint8 else 65536
+    lut = landcover_lut(size, nodata, palette)
+    rgba = lut[codes]
+    counts = np.bincount((codes if valid is None else codes[valid]).ravel(), minlength=size)
+    counts[lut[:, 3] == 0] = 0
+    if valid is not None:
+        rgba[~valid] = 0
+    return rgba, {int(c) for c in np.flatnonzero(counts)}
+
+
+def landcover_legend(codes: np.ndarray, nodata=None, palette: Palette = DEFAULT_PALETTE):
+    """Leyenda (legend_for) de los códigos con clase presentes en codes, sin colorizar."""
+    codes = as_code_array(codes, nodata)
+    size = 256 if codes.dtype == np.uint8 else 65536
+    counts = np.bincount(codes.ravel(), minlength=size)
+    counts[landcover_lut(size, nodata, palette)[:, 3] == 0] = 0
+    return legend_for({int(c) for c in np.flatnonzero(counts)}, palette)
+
+
+def legend_for(present_codes, palette: Palette = DEFAULT_PALETTE):
+    """Entradas de leyenda (code, label, color) para los códigos presentes."""
+    return [
+        {"code": code, "label": label, "color": color}
+        for (code, color, label) in palette.landcover_classes
+        if code in present_codes
+    ]
+
+
+def rgba_to_png(rgba: np.ndarray) -> bytes:
+    """RGBA (H,W,4) uint8 → bytes PNG."""
+    buf = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(rgba), mode="RGBA").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+# ================== LECTURA DIEZMADA / POR VENTANA ==================
+def decimation_step(height: int, width: int, max_pixels: int = MAX_PIXELS) -> int:
+    """Paso de submuestreo para que height*width quepa en max_pixels."""
+    if height * width <= max_pixels:
+        return 1
+    return int(math.ceil(math.sqrt((height * width) / max_pixels)))
+
+
+def read_window(src, bounds=None) -> Window:
+    """
+    Ventana de src recortada a bounds (W,S,E,N en EPSG:4326); None → ráster completo.
+    """
+    full = Window(0, 0, src.width, src.height)
+    if bounds is None:
+        return full
+    w, s, e, n = bounds
+    if src.crs is not None and not src.crs.is_geographic:
+        w, s, e, n = transform_bounds(DST_CRS, src.crs, w, s, e, n)
+    win = from_bounds(w, s, e, n, transform=src.transform)
+    win = win.round_offsets(op="floor").round_lengths(op="ceil")
+    return win.intersection(full)
+
+
+def read_decimated(src, indexes=1, max_pixels: int = MAX_PIXELS, bounds=None, window=None):
+    """
+    Lee la ventana pedida directamente al tamaño final (≤ max_pixels).
+    GDAL resuelve el `out_shape` con las overviews internas si existen, así que
+    nunca se lee ni se reproyecta la resolución completa para luego descartarla.
+    Devuelve (datos, transform de la ventana diezmada).
+    """
+    win = window if window is not None else read_window(src, bounds)
+    h, w = int(win.height), int(win.width)
+    step = decimation_step(h, w, max_pixels)
+    out_h, out_w = -(-h // step), -(-w // step)
+    shape = (out_h, out_w) if isinstance(indexes, int) else (len(indexes), out_h, out_w)
+    data = src.read(indexes, window=win, out_shape=shape, resampling=Resampling.nearest)
+    transform = src.window_transform(win) * rasterio.Affine.scale(w / out_w, h / out_h)
+    return data, transform
+
+
+# ================== SUBMUESTREO POR AGREGACIÓN ==================
+def group_starts(n_src: int, n_out: int) -> np.ndarray:
+    """Inicio de cada grupo: la celda i de salida agrupa [⌊i·n_src/n_out⌋, ⌊(i+1)·n_src/n_out⌋)."""
+    return (np.arange(n_out, dtype=np.int64) * n_src) // n_out
+
+
+def _group_ids(starts: np.ndarray, n: int) -> np.ndarray:
+    """Celda de salida de cada una de las n posiciones fuente."""
+    ids = np.zeros(n, dtype=np.int64)
+    ids[starts[1:]] = 1
+    return np.cumsum(ids)
+
+
+def aggregate_any(index: np.ndarray, row_starts: np.ndarray, col_starts: np.ndarray) -> np.ndarray:
+    """
+    Índice uint8 (h, w) → (len(row_starts), len(col_starts)) con 1 si algún píxel
+    de la celda vale 1: un tramo de deforestación de un píxel sobrevive al diezmado.
+    Con paso exacto es un reshape; si no, maximum.reduceat por filas y columnas.
+    """
+    h, w = index.shape
+    ky, kx = h // len(row_starts), w // len(col_starts)
+    if ky * len(row_starts) == h and kx * len(col_starts) == w:
+        return index.reshape(len(row_starts), ky, len(col_starts), kx).max(axis=(1, 3))
+    return np.maximum.reduceat(np.maximum.reduceat(index, row_starts, axis=0), col_starts, axis=1)
+
+
+def aggregate_count(index: np.ndarray, row_starts: np.ndarray, col_starts: np.ndarray) -> np.ndarray:
+    """
+    Índice uint8 (h, w) → píxeles a 1 de cada celda (uint16; uint32 si una celda
+    puede superar 65535 píxeles). Misma agrupación que aggregate_any.
+    """
+    h, w = index.shape
+    oh, ow = len(row_starts), len(col_starts)
+    cell_px = int(np.diff(np.append(row_starts, h)).max(initial=1)) * int(np.diff(np.append(col_starts, w)).max(initial=1))
+    dtype = np.uint16 if cell_px < 65536 else np.uint32
+    ky, kx = h // oh, w // ow
+    if ky * oh == h and kx * ow == w:
+        return index.reshape(oh, ky, ow, kx).sum(axis=(1, 3), dtype=dtype)
+    return np.add.reduceat(np.add.reduceat(index, row_starts, axis=0, dtype=dtype), col_starts, axis=1, dtype=dtype)
+
+
+def aggregate_mode(codes: np.ndarray, row_starts: np.ndarray, col_starts: np.ndarray, nodata=None) -> np.ndarray:
+    """
+    Códigos categóricos (h, w) → clase mayoritaria de cada celda con un único
+    bincount sobre claves celda·K + clase (K = clases presentes en el bloque).
+    nodata y lo que no es un código (NaN, negativos…) no votan; una celda sin
+    votos queda en nodata (sin nodata: NaN en flotantes, -1 en enteros con
+    signo). La salida conserva el dtype de codes. Empates: código menor.
+    """
+    dtype = codes.dtype
+    converted = dtype not in (np.uint8, np.uint16)
+    codes = as_code_array(codes, nodata)
+    h, w = codes.shape
+    oh, ow = len(row_starts), len(col_starts)
+    size = 256 if codes.dtype == np.uint8 else 65536
+    present = np.flatnonzero(np.bincount(codes.ravel(), minlength=size))
+    lut = np.zeros(size, dtype=np.int64)
+    lut[present] = np.arange(present.size)
+    K = present.size
+    cell = _group_ids(row_starts, h)[:, None] * ow + _group_ids(col_starts, w)[None, :]
+    counts = np.bincount((cell * K + lut[codes]).ravel(), minlength=oh * ow * K).reshape(oh * ow, K)
+    del cell
+    excluded = {code_nodata(nodata), NO_CODE if converted else None} - {None}
+    for code in excluded:
+        if code < size and present[lut[code]] == code:
+            counts[:, lut[code]] = 0
+    out = present[counts.argmax(axis=1)].astype(dtype)
+    if excluded:
+        fill = nodata if nodata is not None else (np.nan if np.issubdtype(dtype, np.floating) else -1)
+        out[counts.max(axis=1) == 0] = fill
+    return out.reshape(oh, ow)
+
+
+class _GridRows:
+    """
+    Filas de la malla diezmada de src (la de read_decimated) calculadas bajo
+    demanda: agg="any" → OR por celda de fn(bloque) a resolución completa,
+    "count" → píxeles a 1 por celda (aggregate_count), "mode" → clase
+    mayoritaria de fn(bloque), None → muestreo nearest con
+    out_shape sobre una ventana fraccionaria. Las filas salen como (n, W, ...),
+    con lo que devuelva fn.
+    """
+
+    def __init__(self, src, fn=None, indexes=1, max_pixels: int = MAX_PIXELS, bounds=None, agg: str = None):
+        self.src, self.fn, self.indexes, self.agg = src, fn, indexes, agg
+        self.win = win = read_window(src, bounds)
+        self.h, self.w = h, w = int(win.height), int(win.width)
+        step = decimation_step(h, w, max_pixels)
+        out_h, out_w = -(-h // step), -(-w // step)
+        self.shape = (out_h, out_w)
+        self.transform = src.window_transform(win) * rasterio.Affine.scale(w / out_w, h / out_h)
+        self.rs, self.cs = group_starts(h, out_h), group_starts(w, out_w)
+        self.nodata = src.nodata
+        band_bytes = (1 if isinstance(indexes, int) else len(indexes)) * np.dtype(src.dtypes[0]).itemsize
+        if agg is None:
+            self.row_bytes = out_w * (band_bytes + STREAM_OVERHEAD)
+        else:   # temporales a resolución completa; mode: claves int64 + celda
+            self.row_bytes = -(-h // out_h) * w * (band_bytes + {"any": 3, "count": 7}.get(agg, 18))
+
+    def rows(self, a: int, b: int) -> np.ndarray:
+        """Filas [a, b) de la malla diezmada."""
+        win, w = self.win, self.w
+        out_h, out_w = self.shape
+        if self.agg is None:
+            sy = self.h / out_h
+            block = self.src.read(
+                self.indexes, window=Window(win.col_off, win.row_off + a * sy, w, (b - a) * sy),
+                out_shape=(b - a, out_w) if isinstance(self.indexes, int) else (len(self.indexes), b - a, out_w),
+                resampling=Resampling.nearest,
+            )
+            return self.fn(block) if self.fn is not None else block
+        s0, s1 = self.rs[a], (self.rs[b] if b < out_h else self.h)
+        block = self.src.read(self.indexes, window=Window(win.col_off, win.row_off + s0, w, s1 - s0))
+        if self.fn is not None:
+            block = self.fn(block)
+        if self.agg == "any":
+            return aggregate_any(block, self.rs[a:b] - s0, self.cs)
+        if self.agg == "count":
+            return aggregate_count(block, self.rs[a:b] - s0, self.cs)
+        return aggregate_mode(block, self.rs[a:b] - s0, self.cs, self.nodata)
+
+
+def read_aggregated(src, agg: str, max_pixels: int = MAX_PIXELS, bounds=None,
+                    budget: int = MEMORY_BUDGET, timings=None):
+    """
+    Banda 1 de src reducida a la malla de read_decimated agregando cada celda
+    a resolución completa: agg="any" → índice de máscara (OR), "count" →
+    píxeles con pérdida por celda, "mode" → clase mayoritaria. Se lee por bloques de filas de celdas que caben en budget.
+    Devuelve (datos, transform).
+    """
+    nodata = src.nodata
+    grid = _GridRows(src, (lambda b: mask_index(b, nodata)) if agg in ("any", "count") else None,
+                     1, max_pixels, bounds, agg)
+    out_h, out_w = grid.shape
+    rows = max(1, int(budget // grid.row_bytes))
+    out = None
+    for r0 in range(0, out_h, rows):
+        n = min(rows, out_h - r0)
+        with timed(timings, "read"):
+            res = grid.rows(r0, r0 + n)
+        if out is None:
+            out = np.empty((out_h, out_w), dtype=res.dtype)
+        out[r0:r0 + n] = res
+        del res
+    return out, grid.transform
+
+
+def bounds_of(transform, shape):
+    """(S, W, N, E) de una malla norte-arriba con transform y shape (H, W)."""
+    left, top = transform.c, transform.f
+    right = left + transform.a * shape[1]
+    bottom = top + transform.e * shape[0]
+    return bottom, left, top, right
+
+
+def _needs_warp(src) -> bool:
+    return not (src.crs is None or (hasattr(src.crs, "is_geographic") and src.crs.is_geographic))
+
+
+def warp_grid(src_crs, width, height, src_transform, max_pixels=MAX_PIXELS):
+    """
+    Malla EPSG:4326 (transform, ancho, alto) para reproyectar una malla fuente,
+    acotada a max_pixels: la salida de calculate_default_transform puede crecer
+    un poco respecto a la entrada ya diezmada.
+    """
+    bounds = array_bounds(height, width, src_transform)
+    T, dw, dh = calculate_default_transform(src_crs, DST_CRS, width, height, *bounds)
+    if dw * dh > max_pixels:
+        f = math.sqrt((dw * dh) / max_pixels)
+        T, dw, dh = calculate_default_transform(
+            src_crs, DST_CRS, width, height, *bounds,
+            dst_width=max(1, int(dw / f)), dst_height=max(1, int(dh / f)),
+        )
+    return T, dw, dh
+
+
+def display_grid(src, max_pixels: int = MAX_PIXELS):
+    """
+    (transform, (H, W)) en EPSG:4326 que producirán los loaders para src, calculado
+    solo con la cabecera (mismo diezmado que read_decimated y misma malla que warp_grid).
+    """
+    step = decimation_step(src.height, src.width, max_pixels)
+    out_h, out_w = -(-src.height // step), -(-src.width // step)
+    transform = src.transform * rasterio.Affine.scale(src.width / out_w, src.height / out_h)
+    if _needs_warp(src):
+        transform, dw, dh = warp_grid(src.crs, out_w, out_h, transform, max_pixels)
+        return transform, (dh, dw)
+    return transform, (out_h, out_w)
+
+
+# ================== LOADERS ==================
+def warp_to_4326(data, src_transform, src_crs, max_pixels=MAX_PIXELS, nodata=0):
+    """
+    Reproyecta (nearest) una banda (H,W) o un bloque multibanda (B,H,W) a
+    EPSG:4326 en una sola llamada a reproject. Devuelve (datos, transform).
+    """
+    h, w = data.shape[-2:]
+    T, dw, dh = warp_grid(src_crs, w, h, src_transform, max_pixels)
+    out = np.full(data.shape[:-2] + (dh, dw), nodata, dtype=data.dtype)
+    reproject(
+        source=data, destination=out,
+        src_transform=src_transform, src_crs=src_crs,
+        dst_transform=T, dst_crs=DST_CRS,
+        dst_nodata=nodata,
+        resampling=Resampling.nearest,
+    )
+    return out, T
+
+
+# ================== PLAN DE REPROYECCIÓN COMPARTIDO ==================
+WARP_PLAN_TOLERANCE = 1e-4   # fracción máx. de píxeles que pueden diferir de reproject
+GDAL_APPROX_PX = 0.125       # error del transformador aproximado de GDAL (px)
+
+
+class WarpPlan:
+    """
+    Reproyección nearest precalculada para una malla fuente concreta: para cada
+    píxel destino guarda el índice plano del píxel fuente (o -1 si cae fuera).
+    Todos los frames sobre la misma malla se reproyectan con un único gather.
+    """
+
+    def __init__(self, src_crs, src_transform, src_shape, max_pixels=MAX_PIXELS, chunk_rows=256,
+                 materialize=True):
+        """materialize=False no guarda el índice: rows() lo calcula por bloques (stream_read)."""
+        H, W = src_shape
+        self.src_crs = src_crs
+        self.src_transform = src_transform
+        self.src_shape = (H, W)
+        self.transform, dw, dh = warp_grid(src_crs, W, H, src_transform, max_pixels)
+        self.shape = (dh, dw)
+        self.checked = False
+        self.usable = True
+        self.lock = threading.Lock()   # check() una sola vez aunque haya varios hilos
+        self.index = self.outside = None
+        if not materialize:
+            return
+
+        index = np.empty((dh, dw), dtype=np.int64)
+        for r0 in range(0, dh, chunk_rows):
+            r1 = min(dh, r0 + chunk_rows)
+            index[r0:r1] = self.rows(r0, r1)
+        self.outside = index < 0
+        index[self.outside] = 0
+        self.index = index
+
+    def rows(self, r0: int, r1: int) -> np.ndarray:
+        """Índice plano del píxel fuente de las filas destino [r0, r1) (-1 fuera de la malla)."""
+        H, W = self.src_shape
+        dw = self.shape[1]
+        R, C = np.meshgrid(np.arange(r0, r1), np.arange(dw), indexing="ij")
+        sc, sr = self._src_coords(R.ravel(), C.ravel())
+        col = np.floor(sc).astype(np.int64)
+        row = np.floor(sr).astype(np.int64)
+        inside = (row >= 0) & (row < H) & (col >= 0) & (col < W)
+        return np.where(inside, row * W + col, -1).reshape(r1 - r0, dw)
+
+    def _src_coords(self, rows, cols):
+        """Coordenadas (col, fila) fraccionarias en la malla fuente de centros destino."""
+        T, inv = self.transform, ~self.src_transform
+        x = T.c + T.a * (cols + 0.5)
+        y = T.f + T.e * (rows + 0.5)
+        sx, sy = transform(DST_CRS, self.src_crs, x, y)
+        sx, sy = np.asarray(sx), np.asarray(sy)
+        return inv.a * sx + inv.b * sy + inv.c, inv.d * sx + inv.e * sy + inv.f
+
+    def apply(self, band: np.ndarray, fill=0) -> np.ndarray:
+        """Reproyecta band (malla fuente) con el gather precalculado."""
+        out = np.take(band.ravel(), self.index)
+        out[self.outside] = fill
+        return out
+
+    def check(self, band: np.ndarray, fill=0) -> float:
+        """
+        Compara apply() con rasterio.warp.reproject sobre band; devuelve la fracción
+        de píxeles distintos. Si supera WARP_PLAN_TOLERANCE el plan se desactiva.
+        """
+        ref = np.full(self.shape, fill, dtype=band.dtype)
+        reproject(
+            source=band, destination=ref,
+            src_transform=self.src_transform, src_crs=self.src_crs,
+            dst_transform=self.transform, dst_crs=DST_CRS,
+            dst_nodata=fill, resampling=Resampling.nearest,
+        )
+        bad = np.flatnonzero(ref != self.apply(band, fill))
+        if bad.size:
+            # reproject usa un transformador aproximado (error ≤ 0.125 px): las
+            # discrepancias pegadas a un borde de píxel fuente no son errores del plan.
+            r, c = np.divmod(bad, self.shape[1])
+            sc, sr = self._src_coords(r, c)
+            edge = np.minimum(np.abs(sc - np.round(sc)), np.abs(sr - np.round(sr)))
+            bad = bad[edge > GDAL_APPROX_PX]
+        diff = float(bad.size) / ref.size
+        if diff > WARP_PLAN_TOLERANCE:
+            self.usable = False
+            warnings.warn(f"WarpPlan descartado: {diff:.4%} de píxeles difieren de reproject")
+        self.checked = True
+        return diff
+
+
+_WARP_PLANS = {}
+_WARP_PLANS_LOCK = threading.Lock()
+_WARP_PLANS_BUILD_LOCK = threading.Lock()   # frames en paralelo sobre la misma malla: un solo build
+WARP_PLANS_MAX = 8
+
+
+def get_warp_plan(src_crs, src_transform, src_shape, step=1, max_pixels=MAX_PIXELS) -> WarpPlan:
+    """
+    Plan cacheado por (CRS fuente, transform, shape, CRS destino, paso).
+    transform/shape son los de la malla ya diezmada que se va a reproyectar.
+    """
+    key = (src_crs.to_wkt(), tuple(src_transform)[:6], tuple(src_shape), DST_CRS, step, max_pixels)
+    with _WARP_PLANS_LOCK:
+        plan = _WARP_PLANS.get(key)
+    if plan is None:
+        with _WARP_PLANS_BUILD_LOCK:
+            with _WARP_PLANS_LOCK:
+                plan = _WARP_PLANS.get(key)
+            if plan is None:
+                plan = WarpPlan(src_crs, src_transform, src_shape, max_pixels)
+                with _WARP_PLANS_LOCK:
+                    if len(_WARP_PLANS) >= WARP_PLANS_MAX:
+                        _WARP_PLANS.pop(next(iter(_WARP_PLANS)))
+                    _WARP_PLANS[key] = plan
+    return plan
+
+
+def warp_with_plan(band, src_transform, src_crs, step=1, max_pixels=MAX_PIXELS, fill=0):
+    """
+    Reproyecta band con el plan compartido de su malla. La primera vez se valida
+    contra reproject; si no coincide se sigue usando reproject para esa malla.
+    """
+    plan = get_warp_plan(src_crs, src_transform, band.shape, step, max_pixels)
+    if not plan.checked:
+        with plan.lock:
+            if not plan.checked:
+                plan.check(band, fill)
+    if not plan.usable:
+        return warp_to_4326(band, src_transform, src_crs, max_pixels, fill)
+    return plan.apply(band, fill), plan.transform
+
+
+@contextlib.contextmanager
+def timed(timings, stage: str):
+    """Suma a timings[stage] los segundos del bloque (no hace nada si timings es None)."""
+    if timings is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - t0
+
+
+# ================== LECTURA POR BLOQUES (PRESUPUESTO DE MEMORIA) ==================
+STREAM_OVERHEAD = 4   # bytes por píxel de temporales al procesar un bloque (máscaras bool…)
+
+
+def in_memory_bytes(src, indexes=1, max_pixels: int = MAX_PIXELS, bounds=None) -> int:
+    """
+    Memoria de trabajo estimada (sin contar la salida) de leer src entero en
+    memoria: banda(s) diezmadas + temporales y, si hay que reproyectar, el plan
+    (índice int64 + máscara) y la copia reproyectada.
+    """
+    win = read_window(src, bounds)
+    h, w = int(win.height), int(win.width)
+    step = decimation_step(h, w, max_pixels)
+    px = -(-h // step) * -(-w // step)
+    band_bytes = (1 if isinstance(indexes, int) else len(indexes)) * np.dtype(src.dtypes[0]).itemsize
+    total = px * (band_bytes + STREAM_OVERHEAD)
+    if _needs_warp(src):
+        total += px * (9 + band_bytes)
+    return total
+
+
+WARP_ROW_BYTES = 100   # temporales por píxel destino al calcular el plan por bloques (coordenadas, índices)
+
+
+def _row_span(index: np.ndarray, width: int) -> int:
+    """Filas fuente distintas que abarca un bloque del plan (índices planos, -1 fuera)."""
+    rows = index[index >= 0] // width
+    return int(rows.max() - rows.min() + 1) if rows.size else 0
+
+
+def stream_read(src, fn, indexes=1, max_pixels: int = MAX_PIXELS, bounds=None,
+                budget: int = MEMORY_BUDGET, timings=None, agg: str = None, fill=0):
+    """
+    Lee src sobre su malla de visualización (la de read_decimated + warp_grid)
+    por bloques de filas y copia los bloques en una salida preasignada.
+    fn recibe el bloque crudo (h, W) o (B, h, W) y devuelve (h, W, ...); la
+    salida toma su dtype y forma del primer bloque. La memoria de trabajo queda
+    acotada por budget además de la salida.
+    Cada bloque pasa por los mismos pasos que la lectura en memoria: reducción
+    a la malla diezmada (agg="any"/"count"/"mode" como read_aggregated, None como
+    read_decimated) y, si hay que reproyectar, el vecino más cercano del
+    WarpPlan de esa malla, calculado por bloques de filas destino sin guardar
+    el plan entero (fill fuera de la huella). El resultado coincide con el de
+    la lectura en memoria salvo si el plan de esa malla se descartó frente a
+    reproject: entonces difieren como mucho en WARP_PLAN_TOLERANCE de píxeles.
+    Devuelve (salida, transform).
+    """
+    grid = _GridRows(src, fn, indexes, max_pixels, bounds, agg)
+    out_h, out_w = grid.shape
+    if not _needs_warp(src):
+        rows = max(1, int(budget // grid.row_bytes))
+        out = None
+        for r0 in range(0, out_h, rows):
+            n = min(rows, out_h - r0)
+            with timed(timings, "read"):
+                res = grid.rows(r0, r0 + n)
+            if out is None:
+                out = np.empty((out_h,) + res.shape[1:], dtype=res.dtype)
+            out[r0:r0 + n] = res
+            del res
+        return out, grid.transform
+
+    plan = WarpPlan(src.crs, grid.transform, grid.shape, max_pixels, materialize=False)
+    dh, dw = plan.shape
+    # Mitad del presupuesto para las filas fuente (un bloque de filas destino
+    # abarca además las filas que cruza una sola fila destino, por la rotación
+    # entre mallas) y mitad para los temporales del plan (~WARP_ROW_BYTES por píxel).
+    skew = max(_row_span(plan.rows(r, r + 1), out_w) for r in {0, dh // 2, dh - 1})
+    rows = max(1, min(int(budget // 2 // grid.row_bytes) - skew, int(budget // 2 // (dw * WARP_ROW_BYTES))))
+    out = None
+    for r0 in range(0, dh, rows):
+        n = min(rows, dh - r0)
+        with timed(timings, "warp"):
+            index = plan.rows(r0, r0 + n)
+            outside = index < 0
+            src_rows = index[~outside] // out_w
+            lo, hi = (int(src_rows.min()), int(src_rows.max()) + 1) if src_rows.size else (0, 1)
+            del src_rows
+        with timed(timings, "read"):
+            block = grid.rows(lo, hi)
+        with timed(timings, "warp"):
+            flat = block.reshape((-1,) + block.shape[2:])
+            res = flat[np.where(outside, 0, index - lo * out_w)]
+            res[outside] = fill
+            del block, flat, index, outside
+        if out is None:
+            out = np.empty((dh, dw) + res.shape[2:], dtype=res.dtype)
+        out[r0:r0 + n] = res
+        del res
+    return out, plan.transform
+
+
+def _aggregates(src, max_pixels=MAX_PIXELS, bounds=None) -> bool:
+    """True si hay que diezmar src y DOWNSAMPLE pide agregar en vez de muestrear."""
+    win = read_window(src, bounds)
+    return DOWNSAMPLE == "aggregate" and decimation_step(int(win.height), int(win.width), max_pixels) > 1
+
+
+def load_mask_index_and_bounds(path, max_pixels=MAX_PIXELS, bounds=None, timings=None, budget=MEMORY_BUDGET,
+                               counts: bool = False):
+    """
+    Máscara 1 banda → índice uint8 (0 vacío, 1 pérdida) en EPSG:4326 + bounds.
+    Se reproyecta una sola banda uint8; el color se aplica después con MASK_PALETTE.
+    Al diezmar, cada píxel de salida es el OR de su celda (read_aggregated);
+    con counts=True es el número de píxeles nativos con pérdida de la celda
+    (aggregate_count, siempre agregando; sin diezmar coincide con el índice).
+    timings (dict) opcional acumula segundos por etapa ("read", "warp").
+    Si leerla entera no cabe en budget se procesa por bloques (stream_read).
+    """
+    with rasterio.open(path) as src:
+        win = read_window(src, bounds)
+        step = decimation_step(int(win.height), int(win.width), max_pixels)
+        aggregate = step > 1 and (counts or _aggregates(src, max_pixels, bounds))
+        agg = ("count" if counts else "any") if aggregate else None
+        nodata = src.nodata
+        if in_memory_bytes(src, 1, max_pixels, bounds) > budget and (_needs_warp(src) or not aggregate):
+            idx, transform = stream_read(src, lambda b: mask_index(b, nodata), 1, max_pixels, bounds,
+                                         budget, timings, agg)
+            return idx, bounds_of(transform, idx.shape)
+        if aggregate:
+            idx, transform = read_aggregated(src, agg, max_pixels, bounds, budget, timings)
+        else:
+            with timed(timings, "read"):
+                m, transform = read_decimated(src, 1, max_pixels, bounds)
+                idx = mask_index(m, nodata)
+                del m
+        if _needs_warp(src):
+            with timed(timings, "warp"):
+                step = decimation_step(src.height, src.width, max_pixels)
+                idx, transform = warp_with_plan(idx, transform, src.crs, step, max_pixels)
+    return idx, bounds_of(transform, idx.shape)
+
+
+def _rgba_block(data: np.ndarray) -> np.ndarray:
+    """Bloque (3|4, h, w) → RGBA (h, w, 4) uint8 (alfa 255 si no hay cuarta banda)."""
+    data = data.astype(np.uint8, copy=False)
+    if data.shape[0] == 3:
+        data = np.concatenate([data, np.full_like(data[:1], 255)])
+    return np.moveaxis(data, 0, -1)
+
+
+def load_any_as_rgba_and_bounds(path, max_pixels=MAX_PIXELS, bounds=None, timings=None,
+                                palette: Palette = DEFAULT_PALETTE, budget=MEMORY_BUDGET):
+    """
+    GeoTIFF → RGBA + bounds (S,W,N,E), reproyectado a EPSG:4326, leído ya diezmado.
+    1 banda → máscara >0 con el color de pérdida; 3/4 bandas → respeta RGB(A).
+    bounds (W,S,E,N) opcional recorta la lectura a esa ventana.
+    """
+    with rasterio.open(path) as src:
+        count, crs = src.count, src.crs
+        if count >= 3:
+            bands = [1, 2, 3, 4] if count >= 4 else [1, 2, 3]
+            if in_memory_bytes(src, bands, max_pixels, bounds) > budget:
+                arr, transform = stream_read(src, _rgba_block, bands, max_pixels, bounds, budget, timings)
+                return arr, bounds_of(transform, arr.shape)
+            with timed(timings, "read"):
+                data, transform = read_decimated(src, bands, max_pixels, bounds)
+                data = data.astype(np.uint8, copy=False)
+                if count == 3:
+                    data = np.concatenate([data, np.full_like(data[:1], 255)])
+            if _needs_warp(src):
+                with timed(timings, "warp"):
+                    step = decimation_step(src.height, src.width, max_pixels)
+                    warped = [warp_with_plan(b, transform, crs, step, max_pixels) for b in data]
+                    data, transform = np.stack([b for b, _t in warped]), warped[0][1]
+            arr = np.ascontiguousarray(np.moveaxis(data, 0, -1))
+            return arr, bounds_of(transform, arr.shape)
+
+    idx, bnds = load_mask_index_and_bounds(path, max_pixels, bounds, timings, budget)
+    with timed(timings, "colorize"):
+        rgba = palette.mask_palette[idx]
+    return rgba, bnds
+
+
+def load_landcover_codes_and_bounds(path, max_pixels=MAX_PIXELS, bounds=None, budget=MEMORY_BUDGET):
+    """
+    TIFF categórico → arr códigos (H,W) en EPSG:4326 + bounds (S,W,N,E) + nodata.
+    Al diezmar, cada píxel de salida es la clase mayoritaria de su celda.
+    """
+    with rasterio.open(path) as src:
+        nodata = src.nodata
+        fill = nodata if nodata is not None else 0
+        aggregate = _aggregates(src, max_pixels, bounds)
+        if in_memory_bytes(src, 1, max_pixels, bounds) > budget and (_needs_warp(src) or not aggregate):
+            arr, transform = stream_read(src, None, 1, max_pixels, bounds, budget,
+                                         agg="mode" if aggregate else None, fill=fill)
+        else:
+            if aggregate:
+                arr, transform = read_aggregated(src, "mode", max_pixels, bounds, budget)
+            else:
+                arr, transform = read_decimated(src, 1, max_pixels, bounds)
+            if _needs_warp(src):
+                step = decimation_step(src.height, src.width, max_pixels)
+                arr, transform = warp_with_plan(arr, transform, src.crs, step, max_pixels, fill)
+    return arr, bounds_of(transform, arr.shape), nodata
+
+
+def load_landcover_rgba_and_bounds(path, max_pixels=MAX_PIXELS, bounds=None, palette: Palette = DEFAULT_PALETTE,
+                                   budget=MEMORY_BUDGET):
+    """
+    TIFF categórico → RGBA por LUT + bounds (S,W,N,E) + leyenda + arr códigos (H,W).
+    Si no hace falta el RGBA, load_landcover_codes_and_bounds + landcover_legend.
+    """
+    arr, bnds, nodata = load_landcover_codes_and_bounds(path, max_pixels, bounds, budget)
+    rgba, present_codes = colorize_landcover(arr, nodata, palette=palette)
+    return rgba, bnds, legend_for(present_codes, palette), arr
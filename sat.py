@@ -0,0 +1,352 @@
+# sat.py
+"""
+Índice de tablas de sumas acumuladas (summed-area tables) por frame para
+consultar la pérdida dentro de un rectángulo o polígono dibujado en el mapa.
+
+Las tablas van sobre una malla de celdas alineada con la malla nativa de la
+máscara (cada celda agrupa un bloque de píxeles nativos, como la agregación
+de rasters.py) de hasta SAT_MAX_PIXELS celdas, y se calculan a resolución
+nativa, no sobre la capa de visualización (en ella una celda con algún píxel
+perdido cuenta entera). Con una fila y una columna de ceros delante:
+    loss_ha       SAT float64 de hectáreas perdidas: suma del área geodésica
+                  de cada píxel nativo perdido (mismo cálculo que stats.py)
+    class_counts  SAT uint32 de píxeles nativos perdidos por clase de land
+                  cover (solo las clases con pérdida en ese frame)
+    row_ha        área (ha) media de un píxel nativo en cada fila de celdas
+Un rectángulo cuesta 4 lecturas por tabla; un polígono se rasteriza en tramos
+por fila (scanline) y cuesta 2 lecturas por tramo, proporcional a sus filas.
+Las tablas se guardan en la caché persistente y se abren con mmap.
+
+Uso (construir las tablas, consultar un bbox y comparar con stats.py):
+    python sat.py --bbox -78.2 7.6 -77.8 8.0 --check
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import threading
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform as transform_coords
+from rasterio.windows import Window
+
+import artifact_cache
+import catalog
+import stats
+from rasters import DEFAULT_PALETTE, DST_CRS, Palette, _group_ids, decimation_step, group_starts, mask_index
+from stats import row_areas_ha
+
+SAT_VERSION = 2   # subir si cambia el formato (invalida la caché)
+SAT_MAX_PIXELS = int(os.environ.get("DARIEN_SAT_MAX_PIXELS", "500000"))   # celdas de la malla de las tablas
+SAT_CHECK_RTOL = 1e-6   # tolerancia de check_totals (solo cambia el orden de las sumas)
+
+
+def _sat(a: np.ndarray, dtype) -> np.ndarray:
+    """Tabla (H+1, W+1) con S[r, c] = suma de a[:r, :c]."""
+    out = np.zeros((a.shape[0] + 1, a.shape[1] + 1), dtype=dtype)
+    np.cumsum(a, axis=0, dtype=dtype, out=out[1:, 1:])
+    np.cumsum(out[1:, 1:], axis=1, dtype=dtype, out=out[1:, 1:])
+    return out
+
+
+@contextlib.contextmanager
+def _landcover_on(landcover_path: str, src):
+    """WarpedVRT del land cover sobre la malla de src (nearest, como stats.py), o None sin land cover."""
+    if not landcover_path:
+        yield None
+        return
+    with rasterio.open(landcover_path) as lc_src, WarpedVRT(
+        lc_src, crs=src.crs, transform=src.transform, width=src.width, height=src.height,
+        resampling=Resampling.nearest, nodata=lc_src.nodata,
+    ) as vrt:
+        yield vrt
+
+
+def cell_sums(mask_path: str, landcover_path: str = None, max_pixels: int = SAT_MAX_PIXELS,
+              palette: Palette = DEFAULT_PALETTE, block_rows: int = stats.STATS_BLOCK_ROWS):
+    """
+    Recorre la máscara a resolución nativa por bloques de filas y suma por
+    celda: hectáreas perdidas (float64) y píxeles perdidos por clase de land
+    cover ({código: uint32}), con el land cover alineado a la malla nativa
+    (WarpedVRT nearest, como stats.py). Devuelve (ha, {código: conteos},
+    row_ha, transform, crs) de la malla de celdas.
+    """
+    with rasterio.open(mask_path) as src, _landcover_on(landcover_path, src) as lc:
+        H, W = src.height, src.width
+        step = decimation_step(H, W, max_pixels)
+        sh, sw = -(-H // step), -(-W // step)
+        rs, cs = group_starts(H, sh), group_starts(W, sw)
+        row_ids, col_ids = _group_ids(rs, H), _group_ids(cs, W)
+        native_ha = row_areas_ha(src.transform, src.crs, 0, H)
+        codes = stats.class_codes(palette)
+        lut = stats._code_lut(codes, 256 if lc is not None and lc.dtypes[0] in ("uint8", "int8") else 65536)
+        ha = np.zeros((sh, sw), dtype=np.float64)
+        counts = {}
+        rows = max(1, block_rows // step)
+        for a in range(0, sh, rows):
+            b = min(sh, a + rows)
+            s0, s1 = rs[a], (rs[b] if b < sh else H)
+            win = Window(0, s0, W, s1 - s0)
+            rr, cc = np.nonzero(mask_index(src.read(1, window=win), src.nodata))
+            if rr.size == 0:
+                continue
+            cell = (row_ids[s0 + rr] - a) * sw + col_ids[cc]
+            n = (b - a) * sw
+            ha[a:b] += np.bincount(cell, weights=native_ha[s0 + rr], minlength=n).reshape(b - a, sw)
+            if lc is None:
+                continue
+            cls = stats.class_index(lc.read(1, window=win)[rr, cc], lut, lc.nodata)
+            for k in np.unique(cls):
+                if k < len(codes):
+                    grid = counts.setdefault(codes[k], np.zeros((sh, sw), dtype=np.uint32))
+                    grid[a:b] += np.bincount(cell[cls == k], minlength=n).reshape(b - a, sw).astype(np.uint32)
+        sizes = np.diff(np.append(rs, H))
+        row_ha = np.add.reduceat(native_ha, rs) / sizes
+        transform = src.transform * Affine.scale(W / sw, H / sh)
+        return ha, counts, row_ha, transform, src.crs
+
+
+class SATIndex:
+    """Tablas de un frame y consultas por rectángulo (O(1)) y polígono (O(filas))."""
+
+    def __init__(self, transform, crs, shape, loss_ha, class_codes, class_counts, row_ha,
+                 palette: Palette = DEFAULT_PALETTE):
+        self.transform = Affine(*transform[:6])
+        self.crs = CRS.from_user_input(crs) if crs else CRS.from_string(DST_CRS)
+        self.shape = tuple(shape)
+        self.loss_ha = loss_ha
+        self.class_codes = [int(c) for c in class_codes]
+        self.class_counts = class_counts
+        self.row_ha = row_ha
+        self._classes = {code: (label, color) for code, color, label in palette.landcover_classes}
+
+    @classmethod
+    def build(cls, mask_path: str, landcover_path: str = None, max_pixels: int = SAT_MAX_PIXELS,
+              palette: Palette = DEFAULT_PALETTE):
+        """Tablas de la máscara mask_path (y del land cover, opcional) a partir de cell_sums."""
+        ha, counts, row_ha, transform, crs = cell_sums(mask_path, landcover_path, max_pixels, palette)
+        loss_ha = _sat(ha, np.float64)
+        codes = sorted(counts)
+        class_counts = (np.stack([_sat(counts[c], np.uint32) for c in codes]) if codes
+                        else np.zeros((0,) + loss_ha.shape, np.uint32))
+        return cls(transform, crs, ha.shape, loss_ha, codes, class_counts, row_ha, palette)
+
+    @property
+    def total_ha(self) -> float:
+        return float(self.loss_ha[-1, -1])
+
+    # ---------- geometría ----------
+    def _rowcol(self, lon, lat):
+        if not self.crs.is_geographic:
+            x, y = transform_coords(DST_CRS, self.crs, np.atleast_1d(lon), np.atleast_1d(lat))
+            lon, lat = np.asarray(x), np.asarray(y)
+        inv = ~self.transform
+        col, row = inv * (lon, lat)
+        return row, col
+
+    def bbox_window(self, bbox):
+        """bbox (W,S,E,N) → (r0, r1, c0, c1) recortado a la malla (semiabierto)."""
+        w, s, e, n = bbox
+        r0, c0 = self._rowcol(w, n)
+        r1, c1 = self._rowcol(e, s)
+        H, W = self.shape
+        r0, r1 = int(np.clip(np.floor(r0 + 0.5), 0, H)), int(np.clip(np.floor(r1 + 0.5), 0, H))
+        c0, c1 = int(np.clip(np.floor(c0 + 0.5), 0, W)), int(np.clip(np.floor(c1 + 0.5), 0, W))
+        return r0, max(r0, r1), c0, max(c0, c1)
+
+    def polygon_spans(self, rings):
+        """
+        Tramos (filas, c0, c1) de píxeles cuyo centro cae dentro del polígono
+        (regla par-impar; rings = [[[lon, lat], ...], ...] como en GeoJSON).
+        """
+        edges = []
+        for ring in rings:
+            pts = np.asarray(ring, dtype=np.float64)
+            r, c = self._rowcol(pts[:, 0], pts[:, 1])
+            rc = np.stack([np.asarray(r), np.asarray(c)], axis=1)
+            edges.append(np.concatenate([rc[:-1], rc[1:]], axis=1) if np.allclose(rc[0], rc[-1])
+                         else np.concatenate([rc, np.roll(rc, -1, axis=0)], axis=1))
+        edges = np.concatenate(edges)                        # (E, 4): r0, c0, r1, c1
+        edges = edges[edges[:, 0] != edges[:, 2]]            # las horizontales no cortan
+        H, W = self.shape
+        rmin = int(np.clip(np.floor(edges[:, [0, 2]].min() - 0.5), 0, H))
+        rmax = int(np.clip(np.ceil(edges[:, [0, 2]].max() + 0.5), 0, H))
+        rows = np.arange(rmin, rmax) + 0.5                   # centros de fila
+        r0, c0, r1, c1 = (edges[:, k][None, :] for k in range(4))
+        y = rows[:, None]
+        hit = ((r0 <= y) & (y < r1)) | ((r1 <= y) & (y < r0))
+        x = c0 + (y - r0) * (c1 - c0) / (r1 - r0)
+        x = np.where(hit, x, np.inf)
+        x.sort(axis=1)
+        out_rows, out_c0, out_c1 = [], [], []
+        nhit = hit.sum(axis=1)
+        for k in range(0, int(nhit.max(initial=0)), 2):
+            ok = nhit > k + 1
+            a = np.clip(np.ceil(x[ok, k] - 0.5), 0, W).astype(np.int64)
+            b = np.clip(np.ceil(x[ok, k + 1] - 0.5), 0, W).astype(np.int64)
+            keep = b > a
+            out_rows.append(np.arange(rmin, rmax)[ok][keep])
+            out_c0.append(a[keep])
+            out_c1.append(b[keep])
+        if not out_rows:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64)
+        return np.concatenate(out_rows), np.concatenate(out_c0), np.concatenate(out_c1)
+
+    # ---------- sumas ----------
+    @staticmethod
+    def _rect_sum(S, r0, r1, c0, c1):
+        return S[..., r1, c1] - S[..., r0, c1] - S[..., r1, c0] + S[..., r0, c0]
+
+    @staticmethod
+    def _spans_sum(S, rows, c0, c1, dtype=None):
+        """Suma de los tramos [c0, c1) de cada fila; dtype evita desbordar uint32 al restar."""
+        def at(r, c):
+            v = S[..., r, c]
+            return v if dtype is None else v.astype(dtype)
+        return (at(rows + 1, c1) - at(rows, c1) - at(rows + 1, c0) + at(rows, c0)).sum(axis=-1)
+
+    def _result(self, loss_ha, counts, mean_row_ha):
+        classes = []
+        for code, n in zip(self.class_codes, np.atleast_1d(counts)):
+            if n:
+                label, color = self._classes.get(code, (str(code), "#cccccc"))
+                classes.append({"code": code, "label": label, "color": color, "ha": float(n) * mean_row_ha})
+        classes.sort(key=lambda c: -c["ha"])
+        return {"ha": float(loss_ha), "classes": classes}
+
+    def query_bbox(self, bbox) -> dict:
+        if not self.crs.is_geographic:   # en una malla proyectada el bbox lon/lat no es un rectángulo
+            w, s, e, n = bbox
+            t = np.linspace(0.0, 1.0, 32, endpoint=False)
+            ring = np.concatenate([np.stack([w + (e - w) * t, np.full_like(t, n)], 1),
+                                   np.stack([np.full_like(t, e), n + (s - n) * t], 1),
+                                   np.stack([e + (w - e) * t, np.full_like(t, s)], 1),
+                                   np.stack([np.full_like(t, w), s + (n - s) * t], 1)])
+            return self.query_polygon([ring.tolist()])
+        r0, r1, c0, c1 = self.bbox_window(bbox)
+        if r1 <= r0 or c1 <= c0:
+            return self._result(0.0, [], 0.0)
+        counts = self._rect_sum(self.class_counts, r0, r1, c0, c1).astype(np.int64)
+        return self._result(self._rect_sum(self.loss_ha, r0, r1, c0, c1), counts, float(np.mean(self.row_ha[r0:r1])))
+
+    def query_polygon(self, rings) -> dict:
+        rows, c0, c1 = self.polygon_spans(rings)
+        if rows.size == 0:
+            return self._result(0.0, [], 0.0)
+        counts = self._spans_sum(self.class_counts, rows, c0, c1, np.int64) if self.class_codes else []
+        return self._result(self._spans_sum(self.loss_ha, rows, c0, c1), counts, float(np.mean(self.row_ha[rows])))
+
+    def query(self, geometry: dict) -> dict:
+        """geometry: {"bbox": [W,S,E,N]} o geometría GeoJSON Polygon/MultiPolygon."""
+        if "bbox" in geometry:
+            return self.query_bbox(geometry["bbox"])
+        if geometry.get("type") == "Polygon":
+            return self.query_polygon(geometry["coordinates"])
+        if geometry.get("type") == "MultiPolygon":
+            parts = [self.query_polygon(p) for p in geometry["coordinates"]]
+            merged = {}
+            for part in parts:
+                for c in part["classes"]:
+                    merged.setdefault(c["code"], dict(c, ha=0.0))["ha"] += c["ha"]
+            return {"ha": sum(p["ha"] for p in parts), "classes": sorted(merged.values(), key=lambda c: -c["ha"])}
+        raise ValueError(f"Geometría no soportada: {geometry.get('type')}")
+
+
+# ================== CACHÉ ==================
+def load_sat(path: str, landcover_path: str = None, max_pixels: int = SAT_MAX_PIXELS,
+             palette: Palette = DEFAULT_PALETTE, cache: "artifact_cache.ArtifactCache" = None) -> SATIndex:
+    """SATIndex del frame path (tablas mmap desde la caché persistente; se construyen la primera vez)."""
+    cache = cache or artifact_cache.default_cache()
+    lc_hash = artifact_cache.file_hash(landcover_path) if landcover_path else "-"
+    key = cache.key(path, "sat", max_pixels, palette=palette, extra=f"sat{SAT_VERSION}|{lc_hash}")
+    hit = cache.get(key)
+    if hit is None:
+        idx = SATIndex.build(path, landcover_path, max_pixels, palette)
+        cache.put(key, {"kind": "sat", "source": path, "transform": list(idx.transform)[:6],
+                        "crs": idx.crs.to_string(), "shape": list(idx.shape), "class_codes": idx.class_codes},
+                  {"loss_ha": idx.loss_ha, "class_counts": idx.class_counts, "row_ha": idx.row_ha})
+        hit = cache.get(key)
+        if hit is None:   # caché desalojada al instante (tope demasiado pequeño)
+            return idx
+    meta, arrays = hit["meta"], hit["arrays"]
+    return SATIndex(meta["transform"], meta["crs"], meta["shape"], arrays["loss_ha"], meta["class_codes"],
+                    arrays["class_counts"], arrays["row_ha"], palette)
+
+
+class SATSet:
+    """Índices de todos los frames de un área, construidos una vez y consultados juntos."""
+
+    def __init__(self, entries, landcover_path: str = None, max_pixels: int = SAT_MAX_PIXELS,
+                 palette: Palette = DEFAULT_PALETTE):
+        self.entries = list(entries)
+        self.landcover_path = landcover_path
+        self.max_pixels = max_pixels
+        self.palette = palette
+        self._indexes = None
+        self._lock = threading.Lock()
+
+    def indexes(self):
+        with self._lock:
+            if self._indexes is None:
+                self._indexes = [load_sat(e.path, self.landcover_path, self.max_pixels, self.palette)
+                                 for e in self.entries]
+            return self._indexes
+
+    def query(self, geometry: dict) -> dict:
+        """{"frames": [{"label", "ha", "classes": [...]}, ...]} en el orden de los frames."""
+        return {"frames": [dict(idx.query(geometry), label=e.label)
+                           for e, idx in zip(self.entries, self.indexes())]}
+
+
+def check_totals(sats: SATSet, landcover_path: str, rtol: float = SAT_CHECK_RTOL) -> list:
+    """
+    Pérdida total de cada frame según las tablas (extensión completa) frente al
+    total de stats.loss_table: [{"label", "sat_ha", "stats_ha", "ok"}]. Las dos
+    suman el mismo área nativa; solo difiere el orden de las sumas.
+    """
+    table = stats.loss_table(sats.entries, landcover_path, sats.palette)
+    totals = table.groupby("periodo", sort=False)["hectareas"].sum()
+    out = []
+    for e, idx in zip(sats.entries, sats.indexes()):
+        ref = float(totals[e.label])
+        out.append({"label": e.label, "sat_ha": idx.total_ha, "stats_ha": ref,
+                    "ok": bool(np.isclose(idx.total_ha, ref, rtol=rtol, atol=1e-9))})
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Construye las tablas SAT y consulta la pérdida en un bbox.")
+    ap.add_argument("paths", nargs="*")
+    ap.add_argument("--landcover", default="landcover_darien.tif")
+    ap.add_argument("--max-pixels", type=int, default=SAT_MAX_PIXELS, help="celdas de las tablas")
+    ap.add_argument("--bbox", type=float, nargs=4, metavar=("W", "S", "E", "N"))
+    ap.add_argument("--check", action="store_true", help="comparar el total de cada frame con stats.py")
+    args = ap.parse_args(argv)
+    paths = args.paths or sorted(glob.glob(os.path.join(catalog.LOSS_DIR, "*.tif")))
+    entries = [e for e in (catalog.read_entry(p) for p in paths) if e is not None]
+    landcover = args.landcover if os.path.exists(args.landcover) else None
+    sats = SATSet(entries, landcover, args.max_pixels)
+    for e, idx in zip(sats.entries, sats.indexes()):
+        nbytes = idx.loss_ha.nbytes + idx.class_counts.nbytes
+        print(f"{e.label:>14}  {idx.shape[0]}x{idx.shape[1]}  {idx.total_ha:,.1f} ha  "
+              f"{len(idx.class_codes)} clases  {nbytes / 2**20:.1f} MB")
+    if args.bbox:
+        print(json.dumps(sats.query({"bbox": args.bbox}), ensure_ascii=False, indent=1))
+    if args.check:
+        if landcover is None:
+            ap.error("--check necesita el land cover (stats.loss_table)")
+        results = check_totals(sats, landcover)
+        for r in results:
+            print(f"{r['label']:>14}  SAT {r['sat_ha']:,.3f} ha  stats {r['stats_ha']:,.3f} ha  "
+                  f"{'OK' if r['ok'] else 'DISTINTO'}")
+        return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
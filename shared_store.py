@@ -0,0 +1,253 @@
+# shared_store.py
+"""
+Almacén compartido entre procesos para varias réplicas del visor en un mismo
+host: lo que cada réplica construía en su RAM (cubo empaquetado y su gzip,
+OR prefijo de las acumuladas, PNG de capas derivadas, bloques del historial)
+se escribe una sola vez en un directorio y todos los procesos lo adjuntan de
+solo lectura con np.memmap, así que la caché de páginas del SO guarda una
+sola copia.
+
+Estructura de DARIEN_SHARED_DIR:
+    manifest.json   {nombre: {"file", "kind" (array|blob), "dtype", "shape",
+                     "nbytes", "meta", "created"}}
+    <nombre>.npy    arrays (formato .npy, se abren con mmap_mode="r")
+    <nombre>.bin    blobs en crudo (PNG, gzip…; el mime va en "meta")
+    .locks/         un fichero de lock por nombre (fcntl.flock)
+
+Escrituras atómicas: el fichero se escribe con otro nombre, se hace fsync y
+se publica con os.replace; solo después se añade al manifiesto (también
+reescrito y reemplazado de golpe bajo su propio lock). Un lector solo
+adjunta lo que está en el manifiesto, así que nunca ve un artefacto a medio
+escribir. Un lock por nombre hace que solo un proceso lo construya: los
+demás esperan y lo adjuntan.
+
+Sin DARIEN_SHARED_DIR (por defecto) no hay almacén y cada proceso guarda lo
+suyo en memoria, como siempre. Sin fcntl (Windows) los locks son solo de
+proceso: las escrituras siguen siendo atómicas, pero dos réplicas pueden
+construir lo mismo a la vez.
+
+Uso:
+    python shared_store.py info
+    python shared_store.py clear
+"""
+import argparse
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from encoders import Encoded
+
+try:
+    import fcntl
+except ImportError:   # Windows: sin locks entre procesos
+    fcntl = None
+
+SHARED_DIR = os.environ.get("DARIEN_SHARED_DIR", "")   # vacío: sin almacén compartido
+
+_NAME_RE = re.compile(r"^[\w\-.]+$")
+
+
+def ram_bytes(data) -> int:
+    """Bytes en RAM del proceso de un blob (0 si está adjuntado del almacén)."""
+    return 0 if isinstance(data, memoryview) else len(data)
+
+
+class SharedStore:
+    """Arrays y blobs publicados una vez en root y adjuntados con np.memmap."""
+
+    def __init__(self, root: str = SHARED_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self._lock = threading.Lock()
+        self._manifest = {}
+        self._manifest_stamp = None
+        self._attached = {}
+        self._name_locks = {}
+        os.makedirs(os.path.join(root, ".locks"), exist_ok=True)
+
+    # ---------- locks ----------
+    @contextlib.contextmanager
+    def _locked(self, name: str):
+        """Lock exclusivo entre procesos (y entre hilos de este) para name."""
+        with self._lock:
+            local = self._name_locks.setdefault(name, threading.Lock())
+        with local, open(os.path.join(self.root, ".locks", f"{name}.lock"), "a+") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # ---------- manifiesto ----------
+    def manifest(self) -> dict:
+        """Manifiesto publicado (se relee solo si cambió en disco)."""
+        try:
+            st_ = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return {}
+        stamp = (st_.st_mtime_ns, st_.st_size, st_.st_ino)
+        with self._lock:
+            if stamp != self._manifest_stamp:
+                with open(self.manifest_path, encoding="utf-8") as f:
+                    self._manifest = json.load(f)
+                self._manifest_stamp = stamp
+            return self._manifest
+
+    def _update_manifest(self, fn):
+        """fn(manifiesto) lo modifica en sitio; se reescribe y publica atómicamente."""
+        with self._locked("manifest"):
+            manifest = dict(self.manifest())
+            fn(manifest)
+            tmp = f"{self.manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.manifest_path)
+
+    def _publish(self, name: str, filename: str, write, record: dict):
+        """write(ruta temporal) escribe el fichero; se publica y luego se anota en el manifiesto."""
+        path = os.path.join(self.root, filename)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        write(tmp)
+        with open(tmp, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        record = dict(record, file=filename, created=time.time())
+
+        def add(manifest):
+            manifest[name] = record
+        self._update_manifest(add)
+
+    # ---------- escritura ----------
+    def put_array(self, name: str, array: np.ndarray, meta: dict = None):
+        _check_name(name)
+        array = np.ascontiguousarray(array)
+        self._publish(name, f"{name}.npy", lambda tmp: _save_npy(tmp, array),
+                      {"kind": "array", "dtype": array.dtype.str, "shape": list(array.shape),
+                       "nbytes": int(array.nbytes), "meta": meta or {}})
+
+    def put_blob(self, name: str, data: bytes, meta: dict = None):
+        _check_name(name)
+
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                f.write(data)
+        self._publish(name, f"{name}.bin", write, {"kind": "blob", "nbytes": len(data), "meta": meta or {}})
+
+    # ---------- lectura ----------
+    def meta(self, name: str):
+        record = self.manifest().get(name)
+        return None if record is None else record["meta"]
+
+    def attach(self, name: str):
+        """Array (memmap de solo lectura) o blob (memoryview) publicado; None si no existe."""
+        with self._lock:
+            if name in self._attached:
+                return self._attached[name]
+        record = self.manifest().get(name)
+        if record is None:
+            return None
+        path = os.path.join(self.root, record["file"])
+        if record["kind"] == "array":
+            value = np.load(path, mmap_mode="r")
+        elif record["nbytes"] == 0:
+            value = memoryview(b"")   # mmap no admite ficheros vacíos
+        else:
+            value = memoryview(np.memmap(path, dtype=np.uint8, mode="r"))
+        with self._lock:
+            return self._attached.setdefault(name, value)
+
+    # ---------- get-or-build ----------
+    def array(self, name: str, build, meta=None) -> np.ndarray:
+        """
+        Array name adjuntado; si no existe lo construye build() una sola vez
+        entre todos los procesos. meta puede ser un callable(array) → dict.
+        """
+        value = self.attach(name)
+        if value is None:
+            with self._locked(name):
+                value = self.attach(name)   # otro proceso pudo publicarlo mientras esperábamos
+                if value is None:
+                    array = build()
+                    self.put_array(name, array, meta(array) if callable(meta) else meta)
+                    value = self.attach(name)
+        return value
+
+    def encoded(self, name: str, build) -> Encoded:
+        """Encoded name (datos adjuntados, mime del manifiesto); build() → Encoded si no existe."""
+        value = self.attach(name)
+        if value is None:
+            with self._locked(name):
+                value = self.attach(name)
+                if value is None:
+                    enc = build()
+                    self.put_blob(name, enc.data, {"mime": enc.mime})
+                    value = self.attach(name)
+        return Encoded(value, self.meta(name)["mime"])
+
+    # ---------- mantenimiento ----------
+    def entries(self):
+        """[(nombre, bytes, creado)] del manifiesto."""
+        return [(name, r["nbytes"], r["created"]) for name, r in self.manifest().items()]
+
+    def clear(self):
+        """Vacía el manifiesto y borra los ficheros (los procesos que los tengan adjuntos siguen leyendo)."""
+        removed = []
+        self._update_manifest(lambda manifest: (removed.extend(manifest.values()), manifest.clear()))
+        for record in removed:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.root, record["file"]))
+        with self._lock:
+            self._attached.clear()
+
+
+def _check_name(name: str):
+    if not _NAME_RE.match(name) or name.startswith("."):
+        raise ValueError(f"Nombre no válido para el almacén compartido: {name!r}")
+
+
+def _save_npy(path: str, array: np.ndarray):
+    with open(path, "wb") as f:   # np.save añadiría ".npy" a una ruta temporal sin esa extensión
+        np.save(f, array)
+
+
+_DEFAULT = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_store():
+    """Almacén de DARIEN_SHARED_DIR (uno por proceso) o None si no está configurado."""
+    global _DEFAULT
+    if not SHARED_DIR:
+        return None
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = SharedStore(SHARED_DIR)
+        return _DEFAULT
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Almacén compartido (memmap) entre réplicas del visor.")
+    ap.add_argument("cmd", choices=["info", "clear"])
+    ap.add_argument("--root", default=SHARED_DIR or ".cache/shared")
+    args = ap.parse_args(argv)
+    store = SharedStore(args.root)
+    if args.cmd == "info":
+        entries = store.entries()
+        for name, size, created in sorted(entries, key=lambda e: -e[2]):
+            print(f"{name}\t{size / 2**20:.1f} MB\t{time.ctime(created)}")
+        print(f"total {sum(e[1] for e in entries) / 2**20:.1f} MB en {args.root}")
+    else:
+        store.clear()
+
+
+if __name__ == "__main__":
+    main()
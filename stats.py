@@ -0,0 +1,182 @@
+# stats.py
+"""
+Estadísticas de pérdida: hectáreas perdidas por (periodo, clase de land cover).
+
+Cada máscara se recorre a resolución nativa por bloques de filas (memoria
+acotada). El land cover se alinea con la malla de la máscara mediante un
+WarpedVRT (nearest), así que da igual que tenga otra resolución o CRS. El
+área de cada píxel sale del transform geodésico (elipsoide WGS84: en una
+malla lon/lat depende solo de la fila) y la suma por clase es un único
+np.bincount ponderado sobre claves combinadas periodo·K + clase.
+
+Los resultados por periodo se guardan en la caché persistente (artifact_cache).
+
+Uso:
+    python stats.py [máscaras...] [--landcover landcover_darien.tif]
+"""
+import argparse
+import glob
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+import artifact_cache
+import catalog
+from rasters import DEFAULT_PALETTE, Palette, mask_index
+
+STATS_BLOCK_ROWS = int(os.environ.get("DARIEN_STATS_BLOCK_ROWS", "512"))
+STATS_VERSION = 1   # subir si cambia el cálculo (invalida la caché)
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+
+# ================== ÁREA DE PÍXEL ==================
+def _authalic_q(lat_rad: np.ndarray, e: float) -> np.ndarray:
+    s = np.sin(lat_rad)
+    return (1 - e * e) * (s / (1 - (e * s) ** 2) - np.log((1 - e * s) / (1 + e * s)) / (2 * e))
+
+
+def row_areas_ha(transform, crs, row0: int, nrows: int) -> np.ndarray:
+    """
+    Área (ha) de un píxel de cada fila [row0, row0+nrows). En CRS geográfico
+    es el área exacta de la celda sobre el elipsoide WGS84; en CRS proyectado,
+    |det| del transform (m²), igual para todas las filas.
+    """
+    if crs is not None and not crs.is_geographic:
+        return np.full(nrows, abs(transform.a * transform.e - transform.b * transform.d) / 1e4)
+    e = math.sqrt(WGS84_F * (2 - WGS84_F))
+    rows = np.arange(row0, row0 + nrows + 1, dtype=np.float64)
+    lat = np.radians(np.clip(transform.f + transform.e * rows, -90.0, 90.0))
+    q = _authalic_q(lat, e)
+    dlon = math.radians(abs(transform.a))
+    # franja entre dos latitudes de ancho dlon: a²/2 · dlon · |Δq| (q: latitud auténtica)
+    area_m2 = np.abs(np.diff(q)) * dlon * WGS84_A * WGS84_A / 2
+    return area_m2 / 1e4
+
+
+# ================== CÓMPUTO ==================
+def class_codes(palette: Palette = DEFAULT_PALETTE) -> list:
+    return [code for code, _hex, _label in palette.landcover_classes]
+
+
+def _code_lut(codes, size: int) -> np.ndarray:
+    """código → posición en codes; K (= len(codes)) para los códigos sin clase."""
+    lut = np.full(size, len(codes), dtype=np.int64)
+    for i, c in enumerate(codes):
+        if c < size:
+            lut[c] = i
+    return lut
+
+
+def class_index(lc_block: np.ndarray, lut: np.ndarray, nodata=None) -> np.ndarray:
+    """Posición de clase (_code_lut) de cada código; K para nodata y lo que no es un código."""
+    K = int(lut.max())
+    invalid = (lc_block < 0) | (lc_block >= len(lut))
+    if not np.issubdtype(lc_block.dtype, np.integer):
+        invalid |= ~np.isfinite(lc_block)
+    if nodata is not None:
+        invalid |= lc_block == nodata
+    cls = lut[np.where(invalid, 0, lc_block).astype(np.int64, copy=False)]
+    cls[invalid] = K
+    return cls
+
+
+def _grid(src):
+    return (src.crs.to_string() if src.crs else "", tuple(src.transform)[:6], src.width, src.height)
+
+
+def loss_area_by_class(mask_paths, landcover_path: str, palette: Palette = DEFAULT_PALETTE,
+                       block_rows: int = STATS_BLOCK_ROWS) -> np.ndarray:
+    """
+    Hectáreas (P, K+1): fila = máscara, columna = clase de palette (última:
+    sin clase / fuera del land cover). Una sola pasada por bloques de filas
+    para todas las máscaras; deben compartir malla.
+    """
+    codes = class_codes(palette)
+    K1 = len(codes) + 1
+    srcs = [rasterio.open(p) for p in mask_paths]
+    try:
+        ref = srcs[0]
+        if any(_grid(s) != _grid(ref) for s in srcs[1:]):
+            raise ValueError("Las máscaras no comparten malla; calcúlalas por separado")
+        acc = np.zeros(len(srcs) * K1, dtype=np.float64)
+        with rasterio.open(landcover_path) as lc_src, WarpedVRT(
+            lc_src, crs=ref.crs, transform=ref.transform, width=ref.width, height=ref.height,
+            resampling=Resampling.nearest, nodata=lc_src.nodata,
+        ) as lc:
+            lut = _code_lut(codes, 65536 if lc.dtypes[0] not in ("uint8", "int8") else 256)
+            for r0 in range(0, ref.height, block_rows):
+                h = min(block_rows, ref.height - r0)
+                win = Window(0, r0, ref.width, h)
+                cls = class_index(lc.read(1, window=win), lut, lc.nodata)
+                area = np.broadcast_to(row_areas_ha(ref.transform, ref.crs, r0, h)[:, None], (h, ref.width))
+                for p, src in enumerate(srcs):
+                    loss = mask_index(src.read(1, window=win), src.nodata).view(bool)
+                    if not loss.any():
+                        continue
+                    acc += np.bincount(p * K1 + cls[loss], weights=area[loss], minlength=acc.size)
+        return acc.reshape(len(srcs), K1)
+    finally:
+        for s in srcs:
+            s.close()
+
+
+def loss_table(entries, landcover_path: str, palette: Palette = DEFAULT_PALETTE,
+               cache: "artifact_cache.ArtifactCache" = None, block_rows: int = STATS_BLOCK_ROWS) -> pd.DataFrame:
+    """
+    DataFrame largo (periodo, inicio, fin, code, clase, color, hectareas) para las
+    entradas del catálogo (catalog.RasterEntry). Cada periodo se calcula una vez
+    y queda en la caché en disco; los que faltan se calculan juntos por malla.
+    """
+    cache = cache or artifact_cache.default_cache()
+    extra = f"stats{STATS_VERSION}|{artifact_cache.file_hash(landcover_path)}"
+    keys = {e.path: cache.key(e.path, "stats", 0, palette=palette, extra=extra) for e in entries}
+    ha = {}
+    for e in entries:
+        hit = cache.get(keys[e.path])
+        if hit is not None:
+            ha[e.path] = np.asarray(hit["arrays"]["ha"])
+
+    pending = [e.path for e in entries if e.path not in ha]
+    groups = {}
+    for p in pending:
+        with rasterio.open(p) as src:
+            groups.setdefault(_grid(src), []).append(p)
+    for paths in groups.values():
+        for p, row in zip(paths, loss_area_by_class(paths, landcover_path, palette, block_rows)):
+            ha[p] = row
+            cache.put(keys[p], {"kind": "stats", "source": p, "landcover": landcover_path}, {"ha": row})
+
+    classes = list(palette.landcover_classes) + [(None, "#cccccc", "Sin clase")]
+    rows = []
+    for e in entries:
+        for (code, color, label), value in zip(classes, ha[e.path]):
+            rows.append({"periodo": e.label, "inicio": e.start, "fin": e.end, "code": code,
+                         "clase": label, "color": color, "hectareas": float(value)})
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Hectáreas perdidas por periodo y clase de land cover.")
+    ap.add_argument("paths", nargs="*")
+    ap.add_argument("--landcover", default="landcover_darien.tif")
+    ap.add_argument("--block-rows", type=int, default=STATS_BLOCK_ROWS)
+    args = ap.parse_args(argv)
+    paths = args.paths or sorted(glob.glob(os.path.join(catalog.LOSS_DIR, "*.tif")))
+    entries = [e for e in (catalog.read_entry(p) for p in paths) if e is not None]
+    df = loss_table(entries, args.landcover, block_rows=args.block_rows)
+    pivot = df[df["hectareas"] > 0].pivot_table(index="clase", columns="periodo", values="hectareas", aggfunc="sum")
+    with pd.option_context("display.float_format", "{:,.1f}".format, "display.width", 200):
+        print(pivot.fillna(0))
+        print(df.groupby("periodo")["hectareas"].sum())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# tiles.py
+"""
+Pirámide de teselas XYZ (Web Mercator, 256 px) para las capas ráster del visor.
+Cada tesela se renderiza bajo demanda desde el GeoTIFF original (WarpedVRT a
+EPSG:3857, vecino más cercano) y se guarda en disco; las siguientes peticiones
+se sirven directamente desde la caché.
+"""
+import hashlib
+import io
+import math
+import os
+import threading
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from PIL import Image
+
+from encoders import EncoderOptions, encode_landcover, encode_mask
+from rasters import DEFAULT_PALETTE, DOWNSAMPLE, Palette, mask_index
+
+TILE_SIZE = 256
+TILE_CACHE_DIR = os.environ.get("DARIEN_TILE_CACHE", ".cache/tiles")
+WEB_MERCATOR = "EPSG:3857"
+ORIGIN_SHIFT = 20037508.342789244   # semiperímetro de EPSG:3857 (m)
+MAX_LAT = 85.05112878
+
+KINDS = ("mask", "landcover")
+TILE_FORMAT = 2   # subir si cambia la codificación de las teselas (invalida la caché)
+TILE_OPTIONS = EncoderOptions(fmt="png")   # la URL de las teselas es .png
+
+
+def _empty_png() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0)).save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+EMPTY_TILE = _empty_png()
+
+
+# ================== GEOMETRÍA XYZ ==================
+def tile_bounds(z: int, x: int, y: int):
+    """Bounds (xmin, ymin, xmax, ymax) en EPSG:3857 de la tesela z/x/y."""
+    size = 2 * ORIGIN_SHIFT / (1 << z)
+    xmin = -ORIGIN_SHIFT + x * size
+    ymax = ORIGIN_SHIFT - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int):
+    """Tesela (x, y) que contiene el punto lon/lat al zoom z."""
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    n = 1 << z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def native_zoom(res_m: float) -> int:
+    """Menor zoom cuyo píxel de tesela es ≤ resolución nativa (m)."""
+    return max(0, int(math.ceil(math.log2(2 * ORIGIN_SHIFT / (TILE_SIZE * res_m)))))
+
+
+# ================== CAPAS ==================
+class TileLayer:
+    """Capa teselable: un GeoTIFF + forma de colorizar ('mask' o 'landcover')."""
+
+    def __init__(self, name: str, path: str, kind: str = "mask", cache_dir: str = TILE_CACHE_DIR,
+                 palette: Palette = DEFAULT_PALETTE):
+        if kind not in KINDS:
+            raise ValueError(f"Tipo de capa desconocido: {kind}")
+        self.name = name
+        self.path = path
+        self.kind = kind
+        self.palette = palette
+        with rasterio.open(path) as src:
+            self.bounds_4326 = transform_bounds(src.crs or "EPSG:4326", "EPSG:4326", *src.bounds)
+            self.bounds_3857 = transform_bounds(src.crs or "EPSG:4326", WEB_MERCATOR, *src.bounds)
+            xmin, ymin, xmax, ymax = self.bounds_3857
+            res_m = min((xmax - xmin) / src.width, (ymax - ymin) / src.height)
+        self.max_zoom = native_zoom(res_m)
+        st_ = os.stat(path)
+        key = f"{os.path.abspath(path)}|{st_.st_mtime_ns}|{st_.st_size}|{kind}|{TILE_FORMAT}|{palette.key}|{DOWNSAMPLE}"
+        self.version = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+        self.cache_dir = os.path.join(cache_dir, f"{name}-{self.version}")
+
+    @property
+    def bounds(self):
+        """(S, W, N, E) en EPSG:4326, como devuelven los loaders."""
+        w, s, e, n = self.bounds_4326
+        return s, w, n, e
+
+    def intersects(self, z: int, x: int, y: int) -> bool:
+        xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+        lxmin, lymin, lxmax, lymax = self.bounds_3857
+        return xmin < lxmax and xmax > lxmin and ymin < lymax and ymax > lymin
+
+    def tile(self, z: int, x: int, y: int) -> bytes:
+        """PNG de la tesela z/x/y (desde caché en disco o renderizada al vuelo)."""
+        if z > self.max_zoom + 6 or not self.intersects(z, x, y):
+            return EMPTY_TILE
+        fp = os.path.join(self.cache_dir, str(z), str(x), f"{y}.png")
+        if os.path.exists(fp):
+            with open(fp, "rb") as f:
+                return f.read()
+        data = self.render(z, x, y)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        tmp = f"{fp}.{os.getpid()}.{threading.get_ident()}.tmp"   # un temporal por hilo del servidor
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, fp)   # escritura atómica: nunca se sirve una tesela a medias
+        return data
+
+    def render(self, z: int, x: int, y: int) -> bytes:
+        """Reproyecta la ventana de la tesela a 256×256 y la coloriza a PNG."""
+        # Por encima del zoom nativo se renderiza el ancestro y se recorta,
+        # para no reproyectar la misma celda nativa una y otra vez.
+        dz = max(0, z - self.max_zoom)
+        pz, px, py = z - dz, x >> dz, y >> dz
+        T = from_bounds(*tile_bounds(pz, px, py), TILE_SIZE, TILE_SIZE)
+        # Por debajo del zoom nativo cada píxel de tesela cubre varios nativos: se agregan
+        resampling = Resampling.nearest
+        if DOWNSAMPLE == "aggregate" and z < self.max_zoom:
+            resampling = Resampling.max if self.kind == "mask" else Resampling.mode
+        with rasterio.open(self.path) as src:
+            with WarpedVRT(src, crs=WEB_MERCATOR, transform=T, width=TILE_SIZE, height=TILE_SIZE,
+                           resampling=resampling, add_alpha=True) as vrt:
+                band, alpha = vrt.read([1, vrt.count])
+                nodata = src.nodata
+        if dz:
+            n = 1 << dz
+            sub = TILE_SIZE // n
+            r0, c0 = (y - (py << dz)) * sub, (x - (px << dz)) * sub
+            band = np.repeat(np.repeat(band[r0:r0 + sub, c0:c0 + sub], n, 0), n, 1)
+            alpha = np.repeat(np.repeat(alpha[r0:r0 + sub, c0:c0 + sub], n, 0), n, 1)
+        covered = alpha > 0
+        if not covered.any():
+            return EMPTY_TILE
+        if self.kind == "mask":
+            index = mask_index(band, nodata) & covered
+            if not index.any():
+                return EMPTY_TILE
+            return encode_mask(index, TILE_OPTIONS, self.palette).data
+        return encode_landcover(band, nodata, covered, TILE_OPTIONS, self.palette).data
+
+    def url_template(self, base_url: str) -> str:
+        return f"{base_url.rstrip('/')}/tiles/{self.name}/{{z}}/{{x}}/{{y}}.png?v={self.version}"
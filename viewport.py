@@ -0,0 +1,193 @@
+# viewport.py
+"""
+Recorte a resolución nativa de la vista actual del mapa. El componente del
+mapa devuelve sus bounds y zoom (map_component.py); si a ese zoom la capa
+global diezmada ya se ve más gruesa que la pantalla, se lee solo la ventana
+visible del GeoTIFF original (lecturas por ventana de rasters.py, con la
+misma agregación y reproyección que la capa global) y se manda como una
+imagen más que el navegador pone encima.
+
+Para que arrastrar el mapa no dispare una lectura por cada moveend:
+    - la ventana se alinea hacia fuera a una rejilla de VIEWPORT_SNAP píxeles
+      nativos, así que los desplazamientos pequeños caen en la misma ventana;
+    - las ventanas renderizadas quedan en un LRU de proceso (VIEWPORT_CACHE
+      entradas, compartido por las sesiones), y una ventana que ya se está
+      renderizando no se vuelve a pedir: se espera al primero;
+    - el navegador agrupa los moveend con un debounce de VIEWPORT_DEBOUNCE_MS.
+
+Uso (tiempos de una ventana fría y de la misma ventana ya cacheada):
+    python viewport.py mask_loss/Mask_Loss_2020_2021_adaptive.tif --bounds -77.9 8.2 -77.7 8.4
+"""
+import argparse
+import math
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+
+import rasterio
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+
+import encoders
+import rasters
+from rasters import DEFAULT_PALETTE, DST_CRS, MAX_PIXELS, Palette
+
+VIEWPORT_MAX_PIXELS = int(os.environ.get("DARIEN_VIEWPORT_MAX_PIXELS", "2000000"))   # por capa y ventana
+VIEWPORT_SNAP = int(os.environ.get("DARIEN_VIEWPORT_SNAP", "256"))     # rejilla de alineado (píxeles nativos)
+VIEWPORT_CACHE = int(os.environ.get("DARIEN_VIEWPORT_CACHE", "64"))    # ventanas recientes en memoria
+VIEWPORT_DEBOUNCE_MS = int(os.environ.get("DARIEN_VIEWPORT_DEBOUNCE_MS", "400"))
+
+KINDS = ("mask", "landcover")
+
+
+def screen_degrees(zoom: float) -> float:
+    """Grados de longitud por píxel de pantalla de Leaflet al zoom dado."""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def snapped_window(src, bounds, snap: int = VIEWPORT_SNAP):
+    """
+    Ventana de src que cubre bounds (W,S,E,N en EPSG:4326) alineada hacia fuera
+    a múltiplos de snap píxeles y recortada al ráster; None si no se solapan.
+    """
+    win = rasters.read_window(src, bounds)
+    if win.width <= 0 or win.height <= 0:
+        return None
+    c0 = int(win.col_off) // snap * snap
+    r0 = int(win.row_off) // snap * snap
+    c1 = min(src.width, -(-int(win.col_off + win.width) // snap) * snap)
+    r1 = min(src.height, -(-int(win.row_off + win.height) // snap) * snap)
+    return Window(c0, r0, c1 - c0, r1 - r0)
+
+
+def window_bounds_4326(src, win: Window):
+    """(W,S,E,N) en EPSG:4326 de una ventana de src."""
+    w, s, e, n = src.window_bounds(win)
+    if rasters._needs_warp(src):
+        w, s, e, n = transform_bounds(src.crs, DST_CRS, w, s, e, n)
+    return w, s, e, n
+
+
+def plan(path: str, view: dict, global_max_pixels: int = MAX_PIXELS, max_pixels: int = VIEWPORT_MAX_PIXELS,
+         snap: int = VIEWPORT_SNAP):
+    """
+    (ventana alineada, bounds W,S,E,N) que hay que renderizar para la vista
+    {"bounds", "zoom"}, o None si la capa global ya basta: la vista no toca el
+    ráster, la capa global no está diezmada o su píxel no es más grueso que
+    el de la pantalla, o la ventana no ganaría resolución.
+    """
+    with rasterio.open(path) as src:
+        global_step = rasters.decimation_step(src.height, src.width, global_max_pixels)
+        if global_step == 1:
+            return None
+        gw, gs, ge, gn = window_bounds_4326(src, Window(0, 0, src.width, src.height))
+        global_px = (ge - gw) / -(-src.width // global_step)
+        if global_px <= screen_degrees(view["zoom"]):
+            return None
+        win = snapped_window(src, view["bounds"], snap)
+        if win is None or rasters.decimation_step(int(win.height), int(win.width), max_pixels) >= global_step:
+            return None
+        return win, window_bounds_4326(src, win)
+
+
+def render(path: str, kind: str, bounds, max_pixels: int = VIEWPORT_MAX_PIXELS,
+           opts: "encoders.EncoderOptions" = encoders.DEFAULT_OPTIONS, palette: Palette = DEFAULT_PALETTE) -> dict:
+    """{"image" (encoders.Encoded), "bounds" [W,S,E,N], "shape"} de la ventana bounds de path."""
+    if kind not in KINDS:
+        raise ValueError(f"Tipo de capa desconocido: {kind}")
+    w, s, e, n = bounds
+    if kind == "mask":
+        index, (bs, bw, bn, be) = rasters.load_mask_index_and_bounds(path, max_pixels, bounds=(w, s, e, n))
+        image = encoders.encode_mask(index, opts, palette)
+        shape = index.shape
+    else:
+        codes, (bs, bw, bn, be), nodata = rasters.load_landcover_codes_and_bounds(
+            path, max_pixels, bounds=(w, s, e, n))
+        image = encoders.encode_landcover(codes, nodata, opts=opts, palette=palette)
+        shape = codes.shape
+    return {"image": image, "bounds": [bw, bs, be, bn], "shape": tuple(int(v) for v in shape)}
+
+
+class ViewportCache:
+    """LRU de ventanas renderizadas; cada ventana se renderiza una sola vez aunque la pidan a la vez."""
+
+    def __init__(self, max_entries: int = VIEWPORT_CACHE, max_pixels: int = VIEWPORT_MAX_PIXELS,
+                 global_max_pixels: int = MAX_PIXELS):
+        self.max_entries = max_entries
+        self.max_pixels = max_pixels
+        self.global_max_pixels = global_max_pixels
+        self._items = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, path: str, kind: str, view: dict, palette: Palette = DEFAULT_PALETTE):
+        """Ventana de path para view (ver render) o None si la capa global ya basta."""
+        if not view or not view.get("bounds") or view.get("zoom") is None:
+            return None
+        p = plan(path, view, self.global_max_pixels, self.max_pixels)
+        if p is None:
+            return None
+        win, bounds = p
+        st_ = os.stat(path)
+        key = (os.path.abspath(path), st_.st_size, st_.st_mtime_ns, kind, palette.key,
+               int(win.col_off), int(win.row_off), int(win.width), int(win.height))
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item
+            pending = self._pending.setdefault(key, threading.Lock())
+        with pending:
+            with self._lock:
+                item = self._items.get(key)
+            if item is None:
+                try:
+                    item = render(path, kind, bounds, self.max_pixels, palette=palette)
+                except Exception as exc:  # noqa: BLE001 — sin ventana el mapa sigue con la capa global
+                    warnings.warn(f"ventana de {os.path.basename(path)} falló: {exc}")
+                    return None
+                finally:
+                    if item is None:   # falló: la siguiente petición lo reintenta
+                        with self._lock:
+                            self._pending.pop(key, None)
+                with self._lock:   # a la vez: nadie ve la ventana fuera de _items y de _pending
+                    self.misses += 1
+                    self._items[key] = item
+                    self._pending.pop(key, None)
+                    while len(self._items) > self.max_entries:
+                        self._items.popitem(last=False)
+        return item
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(item["image"].nbytes for item in self._items.values())
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Recorte a resolución nativa de una vista del mapa.")
+    ap.add_argument("path")
+    ap.add_argument("--bounds", type=float, nargs=4, metavar=("W", "S", "E", "N"), required=True)
+    ap.add_argument("--zoom", type=float, help="zoom de Leaflet (por defecto el que llena ~1000 px)")
+    ap.add_argument("--kind", choices=KINDS, default=None)
+    args = ap.parse_args(argv)
+    kind = args.kind or ("landcover" if "landcover" in os.path.basename(args.path).lower() else "mask")
+    w, s, e, n = args.bounds
+    zoom = args.zoom if args.zoom is not None else math.log2(360.0 / (256 * (e - w) / 1000))
+    cache = ViewportCache()
+    view = {"bounds": args.bounds, "zoom": zoom}
+    for attempt in ("fría", "cacheada"):
+        t0 = time.perf_counter()
+        item = cache.get(args.path, kind, view)
+        if item is None:
+            print("la capa global ya tiene resolución suficiente para esa vista")
+            return
+        print(f"{attempt}: {item['shape'][1]}×{item['shape'][0]} px, {item['image'].nbytes / 1024:.1f} KB, "
+              f"bounds {[round(v, 5) for v in item['bounds']]} ({time.perf_counter() - t0:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
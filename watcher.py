@@ -0,0 +1,180 @@
+# watcher.py
+"""
+Recarga en caliente de los rásters de cada área: un hilo revisa cada
+WATCH_INTERVAL segundos las máscaras *.tif de loss_dir y el land cover, y
+llama a on_change(área, cambios) cuando alguno aparece, desaparece o cambia.
+
+    - La firma de cada fichero es (tamaño, mtime); si cambia, se compara el
+      sha1 del contenido (artifact_cache.file_hash) y un fichero solo tocado
+      no cuenta como cambio.
+    - Un cambio se entrega cuando el fichero ha dejado de cambiar: debe tener
+      la misma firma en dos pasadas seguidas (un GeoTIFF a medio copiar no se
+      procesa).
+    - Si on_change falla, el área no se da por actualizada y se reintenta.
+
+Lo que hay que reprocesar lo decide quien recibe el aviso; como todos los
+artefactos en disco van por hash de contenido, recargar un área solo
+recalcula lo que depende de los ficheros cambiados (AOIData.refreshed).
+
+Uso (ver qué detectaría el visor):
+    python watcher.py --interval 2
+"""
+import argparse
+import glob
+import hashlib
+import os
+import threading
+import time
+import warnings
+
+import aoi
+import artifact_cache
+
+WATCH_INTERVAL = float(os.environ.get("DARIEN_WATCH_INTERVAL", "5"))   # segundos; 0 desactiva
+
+
+def file_version(path: str) -> str:
+    """Cambia si cambia el fichero (ruta, tamaño, mtime); "-" si no existe."""
+    if not path or not os.path.exists(path):
+        return "-"
+    st_ = os.stat(path)
+    raw = f"{os.path.abspath(path)}|{st_.st_size}|{st_.st_mtime_ns}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:10]
+
+
+def watched_paths(area: "aoi.AOI") -> list:
+    """Máscaras de pérdida y land cover del área."""
+    paths = sorted(glob.glob(os.path.join(area.loss_dir, "*.tif")))
+    if area.landcover:
+        paths.append(area.landcover)
+    return paths
+
+
+def _signature(path: str):
+    try:
+        st_ = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st_.st_size, st_.st_mtime_ns
+
+
+def scan(area: "aoi.AOI") -> dict:
+    """{ruta: (tamaño, mtime)} de los ficheros vigilados que existen."""
+    out = {}
+    for path in watched_paths(area):
+        sig = _signature(path)
+        if sig is not None:
+            out[path] = sig
+    return out
+
+
+class Watcher:
+    """Sondeo periódico de los ficheros de varias áreas; on_change(clave, cambios) por área."""
+
+    def __init__(self, aois: dict, on_change, interval: float = WATCH_INTERVAL):
+        self.aois = dict(aois)
+        self.on_change = on_change
+        self.interval = interval
+        self._seen = {key: scan(a) for key, a in self.aois.items()}
+        self._hashes = {}
+        self._pending = {}   # ruta → firma vista en la pasada anterior (aún sin entregar)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _hash(self, path: str):
+        try:
+            return artifact_cache.file_hash(path)
+        except FileNotFoundError:
+            return None
+
+    def changes(self, key: str):
+        """
+        ({"added", "removed", "modified"}, firmas nuevas, hashes nuevos) de los
+        cambios ya estables del área key desde la última entrega; listas vacías
+        si no hay. Firmas y hashes solo se guardan si la entrega sale bien.
+        """
+        before, now = self._seen[key], scan(self.aois[key])
+        changes = {"added": [], "removed": [], "modified": []}
+        stable, hashes = dict(before), {}
+        for path in sorted(set(before) | set(now)):
+            old, new = before.get(path), now.get(path)
+            if old == new:
+                self._pending.pop(path, None)
+                continue
+            if path not in self._pending or self._pending[path] != new:
+                self._pending[path] = new   # todavía cambiando: se espera a la siguiente pasada
+                continue
+            del self._pending[path]
+            if new is None:
+                stable.pop(path)
+                hashes[path] = None
+                changes["removed"].append(path)
+                continue
+            stable[path] = new
+            digest = self._hash(path)
+            if old is not None and digest is not None and digest == self._hashes.get(path):
+                continue   # mismo contenido (solo cambió el mtime)
+            hashes[path] = digest
+            changes["added" if old is None else "modified"].append(path)
+        return changes, stable, hashes
+
+    def poll(self) -> dict:
+        """Una pasada: entrega los cambios de cada área y devuelve {clave: cambios} de las que cambiaron."""
+        delivered = {}
+        for key in self.aois:
+            changes, stable, hashes = self.changes(key)
+            if any(changes.values()):
+                try:
+                    self.on_change(key, changes)
+                except Exception as exc:  # noqa: BLE001 — se reintenta en la próxima pasada
+                    warnings.warn(f"recarga de {key} falló ({exc}); se reintentará")
+                    continue
+                delivered[key] = changes
+            self._seen[key] = stable   # también recoge ficheros solo tocados
+            for path, digest in hashes.items():
+                if digest is None:
+                    self._hashes.pop(path, None)
+                else:
+                    self._hashes[path] = digest
+        return delivered
+
+    def _run(self):
+        for files in self._seen.values():   # hashes de referencia (en disco casi siempre ya calculados)
+            for path in files:
+                self._hashes[path] = self._hash(path)
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self) -> "Watcher":
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="darien-watcher")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Vigila los rásters de las áreas e informa de los cambios.")
+    ap.add_argument("--interval", type=float, default=WATCH_INTERVAL or 5)
+    args = ap.parse_args(argv)
+    aois, _default = aoi.load_config()
+
+    def report(key, changes):
+        for kind, paths in changes.items():
+            for p in paths:
+                print(f"{time.strftime('%H:%M:%S')} {key}: {kind} {p}")
+
+    w = Watcher(aois, report, args.interval)
+    print(f"vigilando {sum(len(v) for v in w._seen.values())} ficheros cada {args.interval}s (Ctrl+C para salir)")
+    w.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        w.stop()
+
+
+if __name__ == "__main__":
+    main()